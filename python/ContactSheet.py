@@ -0,0 +1,135 @@
+import csv
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("ContactSheet")
+
+LABEL_HEIGHT = 18
+INDEX_HEADER = ["PAGE", "CELL ROW", "CELL COLUMN", "ROW ID", "STATE", "FOIL", "FOV NUMBER", "FM SIZE"]
+
+
+class ContactSheet:
+    """
+    Tiles fixed-size thumbnails of the FM crops into pages for rapid review, e.g. 10x10 per page,
+    with the ROW ID under every thumbnail and an index CSV mapping page and cell to ROW ID.
+
+    Every FM gets its page and cell up front (plan()), sorted by state, foil and FM SIZE
+    (largest first), so the crop workers can add() thumbnails in any order from the images
+    they already decoded. A page is written and released as soon as all its cells are filled,
+    so only the pages of the foils being cropped are held in memory.
+    Safe to use from the crop worker threads.
+    """
+    def __init__(self, output_folder, rows=10, columns=10, cell_width=256, name_suffix=""):
+        """
+        Args:
+            output_folder (str): Folder for the pages and the index.
+            rows, columns (int): Thumbnails per page.
+            cell_width (int): Thumbnail width in pixels; the height is half of it, the
+                white and red crops side by side.
+            name_suffix (str): Appended to the file names, e.g. the shard of a sharded run.
+        """
+        self.output_folder = output_folder
+        self.rows = int(rows)
+        self.columns = int(columns)
+        self.cell_width = int(cell_width)
+        self.cell_height = max(self.cell_width // 2, 1)
+        self.name_suffix = name_suffix
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._pages = {}
+        self._index_file = None
+        self._index_writer = None
+        self.pages_written = 0
+
+    def plan(self, df):
+        """Assigns a page and cell to every FM row of df; call before adding thumbnails."""
+        ordered = df.sort_values(['STATE', 'FOIL', 'FM SIZE', 'ROW ID'], ascending=[True, True, False, True])
+        per_page = self.rows * self.columns
+        for (state, foil), foil_rows in ordered.groupby(['STATE', 'FOIL'], sort=False):
+            records = foil_rows[['ROW ID', 'FOV NUMBER', 'FM SIZE']].to_dict('records')
+            for start in range(0, len(records), per_page):
+                page_name = f"{state} {foil} page {start // per_page + 1:03d}{self.name_suffix}"
+                page_records = records[start:start + per_page]
+                self._pages[page_name] = {"canvas": None, "expected": len(page_records), "filled": []}
+                for cell, record in enumerate(page_records):
+                    self._slots[int(record['ROW ID'])] = (page_name, cell, state, foil, record)
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        index_path = os.path.join(self.output_folder, f"contact sheet index{self.name_suffix}.csv")
+        self._index_file = open(index_path, "w", newline="", encoding="utf-8")
+        self._index_writer = csv.writer(self._index_file)
+        self._index_writer.writerow(INDEX_HEADER)
+        logger.info("Planned %d contact sheet pages for %d FMs", len(self._pages), len(self._slots))
+
+    @instrumentation.timed("contact_sheet.add")
+    def add(self, row_id, crop):
+        """Places the thumbnail of a crop (BGR, any size) in the cell planned for row_id."""
+        slot = self._slots.get(int(row_id))
+        if slot is None:
+            return
+        page_name, cell, _, _, _ = slot
+        block = self._cell_block(crop, row_id)
+
+        cell_row, cell_column = divmod(cell, self.columns)
+        top = cell_row * (self.cell_height + LABEL_HEIGHT)
+        left = cell_column * self.cell_width
+        with self._lock:
+            page = self._pages.get(page_name)
+            if page is None:
+                return
+            if page["canvas"] is None:
+                page["canvas"] = np.zeros((self.rows * (self.cell_height + LABEL_HEIGHT), self.columns * self.cell_width, 3),
+                                          dtype=np.uint8)
+            page["canvas"][top:top + block.shape[0], left:left + self.cell_width] = block
+            page["filled"].append(int(row_id))
+            complete = len(page["filled"]) == page["expected"]
+            if complete:
+                del self._pages[page_name]
+        if complete:
+            self._write_page(page_name, page)
+
+    def _cell_block(self, crop, row_id):
+        """Scales a crop to fit the cell, keeping its aspect ratio, centred on black, with the ROW ID below."""
+        if crop.ndim == 2:
+            crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+        h, w = crop.shape[:2]
+        scale = min(self.cell_width / w, self.cell_height / h)
+        new_w, new_h = max(int(w * scale), 1), max(int(h * scale), 1)
+        resized = cv2.resize(crop, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        block = np.zeros((self.cell_height + LABEL_HEIGHT, self.cell_width, 3), dtype=np.uint8)
+        y, x = (self.cell_height - new_h) // 2, (self.cell_width - new_w) // 2
+        block[y:y + new_h, x:x + new_w] = resized[:, :, :3]
+        cv2.putText(block, str(row_id), (4, self.cell_height + LABEL_HEIGHT - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                    (255, 255, 255), 1, lineType=cv2.LINE_AA)
+        return block
+
+    @instrumentation.timed("contact_sheet.page")
+    def _write_page(self, page_name, page):
+        page_path = os.path.join(self.output_folder, page_name + ".jpg")
+        cv2.imwrite(page_path, page["canvas"], [cv2.IMWRITE_JPEG_QUALITY, 90])
+        with self._lock:
+            for row_id in sorted(page["filled"], key=lambda row_id: self._slots[row_id][1]):
+                _, cell, state, foil, record = self._slots[row_id]
+                cell_row, cell_column = divmod(cell, self.columns)
+                self._index_writer.writerow([page_name, cell_row + 1, cell_column + 1, row_id, state, foil,
+                                             record['FOV NUMBER'], record['FM SIZE']])
+            self._index_file.flush()
+            self.pages_written += 1
+
+    def close(self):
+        """Writes the pages with empty cells, e.g. FMs whose images were missing, and the index."""
+        with self._lock:
+            remaining = [(name, page) for name, page in self._pages.items() if page["canvas"] is not None]
+            self._pages = {}
+        for page_name, page in remaining:
+            self._write_page(page_name, page)
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        logger.info("Wrote %d contact sheet pages to '%s'", self.pages_written, self.output_folder)
@@ -0,0 +1,216 @@
+"""
+Packed output of the crop stages: one uncompressed ZIP of encoded crops per stage instead of
+one loose file per FM.
+
+Entries are stored without compression (the crops are already PNG/JPEG/WebP), so a crop is
+read with one seek through the ZIP central directory. Entry names are the loose file names,
+which start with the ROW ID, e.g. '12 BeforeCutState Foil1 FOV Number_3 X_10 Y_20 FMsize_300.png',
+so archives open in any ZIP tool and expand back to the files the crop stages would have written:
+
+    python python/CropArchive.py "result/Gap Analysis/Combined white and red images.zip"
+"""
+import argparse
+import os
+import sys
+import threading
+import zipfile
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("CropArchive")
+
+ARCHIVE_EXTENSION = ".zip"
+CROP_FORMATS = (".png", ".jpg", ".webp")
+
+
+def row_id_of(entry_name):
+    """Returns the ROW ID an entry name starts with, or None for other entries."""
+    prefix = os.path.basename(entry_name).split(" ", 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+
+def archive_paths(crop_folder):
+    """
+    Returns the archives of a crop folder, e.g. 'Combined white and red images.zip' and the
+    'Combined white and red images shard_0_of_4.zip' archives of a sharded run.
+    """
+    parent = os.path.dirname(crop_folder) or "."
+    prefix = os.path.basename(crop_folder)
+    if not os.path.isdir(parent):
+        return []
+    return sorted(os.path.join(parent, name) for name in os.listdir(parent)
+                  if name.endswith(ARCHIVE_EXTENSION)
+                  and (name == prefix + ARCHIVE_EXTENSION or name.startswith(prefix + " shard_")))
+
+
+class CropArchiveWriter:
+    """
+    Writes encoded crops to a ZIP archive. Safe to use from the crop worker threads:
+    images are encoded in the calling thread and only the write itself is serialized.
+
+    A run writes a fresh archive next to the existing one; close() carries over the crops
+    of the existing archive that this run did not crop again and then replaces it. Every
+    name is stored once, with its newest crop, so re-cropping rows never grows the archive,
+    and an interrupted close leaves the existing archive untouched.
+    """
+    def __init__(self, archive_path, crop_format=".png"):
+        """
+        Args:
+            archive_path (str): Archive to create, or to update when it exists.
+            crop_format (str): Encoding of the crops, one of CROP_FORMATS.
+        """
+        if crop_format not in CROP_FORMATS:
+            raise ValueError(f"crop_format must be one of {CROP_FORMATS}, got {crop_format!r}")
+        os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+        self.archive_path = archive_path
+        self.crop_format = crop_format
+        self._lock = threading.Lock()
+        self._names = set()
+        self._temporary_path = archive_path + ".tmp"
+        self._zip = zipfile.ZipFile(self._temporary_path, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    @instrumentation.timed("archive.add")
+    def add(self, image, file_name):
+        """
+        Encodes an image and stores it as '<file_name><crop_format>'.
+
+        Returns:
+            str: The entry name.
+        """
+        import cv2
+
+        success, encoded = cv2.imencode(self.crop_format, image)
+        if not success:
+            raise ValueError(f"Could not encode '{file_name}' as {self.crop_format}")
+        entry_name = file_name + self.crop_format
+        data = encoded.tobytes()
+        with self._lock:
+            if entry_name in self._names:
+                logger.warning("Skipping '%s', it was already added to '%s' in this run", entry_name, self.archive_path)
+                return entry_name
+            self._zip.writestr(entry_name, data)
+            self._names.add(entry_name)
+        instrumentation.add("image.written_bytes", len(data))
+        return entry_name
+
+    def close(self):
+        """Carries over the crops of the existing archive not cropped again and replaces it."""
+        with self._lock:
+            if self._zip is None:
+                return
+            if os.path.exists(self.archive_path):
+                with zipfile.ZipFile(self.archive_path, mode="r") as existing:
+                    # The last entry of a name wins, also in archives holding duplicates
+                    latest = {info.filename: info for info in existing.infolist()}
+                    for name, info in latest.items():
+                        if name not in self._names:
+                            self._zip.writestr(info, existing.read(info))
+            self._zip.close()
+            self._zip = None
+            os.replace(self._temporary_path, self.archive_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class CropArchiveReader:
+    """
+    Random access to the crops of one or more archives by ROW ID, e.g. for viewers.
+
+    Only the central directories are read when opening, so opening a 200k-crop archive
+    is fast; every read then seeks straight to its entry.
+    """
+    def __init__(self, archive_paths):
+        if isinstance(archive_paths, str):
+            archive_paths = [archive_paths]
+        self._zips = [zipfile.ZipFile(path, mode="r") for path in archive_paths]
+        self._entries = {}
+        for archive in self._zips:
+            for info in archive.infolist():
+                row_id = row_id_of(info.filename)
+                if row_id is not None:
+                    self._entries[row_id] = (archive, info)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, row_id):
+        return int(row_id) in self._entries
+
+    def row_ids(self):
+        return sorted(self._entries)
+
+    def entry_name(self, row_id):
+        return self._entries[int(row_id)][1].filename
+
+    def read_bytes(self, row_id):
+        """Returns the encoded crop of a ROW ID; raises KeyError when it has none."""
+        archive, info = self._entries[int(row_id)]
+        return archive.read(info)
+
+    def read_image(self, row_id):
+        """Returns the decoded crop of a ROW ID as a BGR array."""
+        import cv2
+        import numpy as np
+
+        return cv2.imdecode(np.frombuffer(self.read_bytes(row_id), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def expand(self, output_folder, row_ids=None):
+        """
+        Writes the crops as loose files named like the crop stages name them.
+
+        Args:
+            output_folder (str): Folder to write the files to.
+            row_ids (iterable, optional): Only these ROW IDs; every crop by default.
+
+        Returns:
+            int: The number of files written.
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        written = 0
+        for row_id in (self.row_ids() if row_ids is None else row_ids):
+            if row_id not in self:
+                continue
+            name = os.path.basename(self.entry_name(row_id))
+            with open(os.path.join(output_folder, name), "wb") as f:
+                f.write(self.read_bytes(row_id))
+            written += 1
+        return written
+
+    def close(self):
+        for archive in self._zips:
+            archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expand crop archives to loose image files.")
+    parser.add_argument("archives", nargs="+", help="Crop archives (.zip) written by the crop stages.")
+    parser.add_argument("--output", default=None,
+                        help="Folder to write the files to; by default the crop folder the archive stands for.")
+    parser.add_argument("--row-ids", nargs="+", type=int, default=None, help="Only expand these ROW IDs.")
+    args = parser.parse_args(argv)
+
+    for archive_path in args.archives:
+        output_folder = args.output
+        if output_folder is None:
+            output_folder = os.path.splitext(archive_path)[0].split(" shard_", 1)[0]
+        with CropArchiveReader(archive_path) as reader:
+            written = reader.expand(output_folder, args.row_ids)
+        logger.info("Expanded %d crops from '%s' to '%s'", written, archive_path, output_folder)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+On-demand crop server: renders the crop of a FM when someone asks for it instead of
+pre-generating every crop.
+
+    python python/CropServer.py --settings python/tkinter_app/settings.json --port 8765
+
+Routes:
+    /                     HTML listing of the FMs with links to their crops (?page=N)
+    /crop/<row_id>        white/red crop, as crop_FM_classify_top_bottom_from_excel saves it
+    /background/<row_id>  different-foil crop, as crop_FM_check_background_fm saves it
+
+Rendered crops are kept in the same folders and under the same names as the crop stages use,
+so crops generated earlier are served straight from disk, crops rendered here are valid
+targets of the workbook hyperlinks, and nothing is rendered twice. Decoded FOV images are
+kept in a small LRU cache, so the neighbours of a FM are rendered without decoding again.
+"""
+import argparse
+import html
+import os
+import sys
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("CropServer")
+
+ROWS_PER_PAGE = 500
+
+
+class DecodedImageCache:
+    """
+    LRU cache of decoded images by path. Concurrent requests for the same image wait for
+    a single decode instead of each decoding it.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(int(capacity), 1)
+        self._images = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, loader):
+        with self._lock:
+            if path in self._images:
+                self._images.move_to_end(path)
+                instrumentation.add("crop_server.fov_cache_hits")
+                return self._images[path]
+            event = self._loading.get(path)
+            owner = event is None
+            if owner:
+                event = self._loading[path] = threading.Event()
+        if not owner:
+            event.wait()
+            return self.get(path, loader)
+
+        try:
+            image = loader(path)
+        finally:
+            with self._lock:
+                del self._loading[path]
+            event.set()
+        instrumentation.add("crop_server.fov_cache_misses")
+        if image is not None:
+            with self._lock:
+                self._images[path] = image
+                while len(self._images) > self.capacity:
+                    self._images.popitem(last=False)
+        return image
+
+
+class CropService:
+    """Renders and caches the crops of the FMs of a Dakar analysis."""
+    def __init__(self, dakar, fov_cache_size=8):
+        self.dakar = dakar
+        self.df = dakar._load_data().set_index('ROW ID', drop=False)
+        self.image_processer = dakar._get_image_processer()
+        self.image_index = dakar._get_image_index()
+        self.images = DecodedImageCache(fov_cache_size)
+        self.folders = {
+            "crop": os.path.join(dakar.save_folder, "Combined white and red images"),
+            "background": os.path.join(dakar.save_folder, "Combined different foil images"),
+        }
+        self._render_locks = {}
+        self._render_locks_lock = threading.Lock()
+
+    def _decode(self, path):
+        images = self.image_processer._read_image([path])
+        return images[0] if images else None
+
+    def crop_path(self, kind, row_id):
+        """Returns the path of the rendered crop, rendering it first when it is not on disk; None without images."""
+        row = self.df.loc[row_id]
+        crop_path = os.path.join(self.folders[kind], self.dakar.crop_file_name(row) + ".png")
+        if os.path.exists(crop_path):
+            instrumentation.add("crop_server.disk_cache_hits")
+            return crop_path
+
+        # One render per crop, also when several requests for it arrive together
+        with self._render_locks_lock:
+            lock = self._render_locks.setdefault((kind, row_id), threading.Lock())
+        try:
+            with lock:
+                if not os.path.exists(crop_path) and not self._render(kind, row, crop_path):
+                    return None
+        finally:
+            with self._render_locks_lock:
+                self._render_locks.pop((kind, row_id), None)
+        return crop_path
+
+    def _render(self, kind, row, crop_path):
+        with instrumentation.timer(f"crop_server.render_{kind}"):
+            combined_img = self._combine_white_red(row) if kind == "crop" else self._combine_background(row)
+            if combined_img is None:
+                return False
+            file_name, rendered = self.dakar._render_crop(combined_img, row)
+            # Written under a temporary name first, so no request reads a partial file
+            temporary_name = f"{file_name}.{threading.get_ident()}.tmp"
+            self.image_processer._save_image_to_folder(self.folders[kind], rendered, temporary_name)
+            os.replace(os.path.join(self.folders[kind], temporary_name + ".png"), crop_path)
+        return True
+
+    def _combine_white_red(self, row):
+        white_path, red_path = self.image_index.match_white_red_image(row['STATE'], row['FOIL'], row['FOV NUMBER'])
+        if not (white_path and red_path):
+            return None
+        white_img, red_img = self.images.get(white_path, self._decode), self.images.get(red_path, self._decode)
+        if white_img is None or red_img is None:
+            return None
+        crop_size = row['FM SIZE'] * 3
+        cropped_white = self.image_processer._crop_image_base_on_coordinate(white_img, row['POS X'], row['POS Y'], crop_size)
+        cropped_red = self.image_processer._crop_image_base_on_coordinate(red_img, row['POS X'], row['POS Y'], crop_size)
+        return self.image_processer._combine_image(cropped_white, cropped_red, direction="horizontal")
+
+    def _combine_background(self, row):
+        cropped_parts = []
+        for image_path in self.image_index.match_white_images(row['STATE'], row['FOV NUMBER'])[:4]:
+            image = self.images.get(image_path, self._decode)
+            if image is not None:
+                cropped_parts.append(self.image_processer._crop_image_base_on_coordinate(
+                    image, row['POS X'], row['POS Y'], row['FM SIZE'] * 3))
+        if not cropped_parts:
+            return None
+        return self.image_processer._combine_image(*cropped_parts, direction="horizontal")
+
+    def listing(self, page):
+        """Returns the HTML listing of one page of FMs."""
+        page_count = max((len(self.df) + ROWS_PER_PAGE - 1) // ROWS_PER_PAGE, 1)
+        page = min(max(page, 1), page_count)
+        rows = self.df.iloc[(page - 1) * ROWS_PER_PAGE:page * ROWS_PER_PAGE]
+        columns = [column for column in ('ROW ID', 'STATE', 'FOIL', 'FOV NUMBER', 'FM SIZE', 'POS X', 'POS Y', 'TOP BOTTOM')
+                   if column in rows.columns]
+
+        lines = [
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+            f"<title>{html.escape(self.dakar.settings.Dakar.analysis_name)} crops</title>",
+            "<style>body{font-family:sans-serif}td,th{padding:2px 8px;text-align:left}</style></head><body>",
+            f"<h1>{html.escape(self.dakar.settings.Dakar.analysis_name)}</h1>",
+            f"<p>{len(self.df)} FMs, page {page} of {page_count}",
+        ]
+        if page > 1:
+            lines.append(f" <a href='/?page={page - 1}'>previous</a>")
+        if page < page_count:
+            lines.append(f" <a href='/?page={page + 1}'>next</a>")
+        lines.append("</p><table><tr>" + "".join(f"<th>{html.escape(column)}</th>" for column in columns)
+                     + "<th></th><th></th></tr>")
+        for record in rows[columns].to_dict('records'):
+            row_id = record['ROW ID']
+            cells = "".join(f"<td>{html.escape(str(record[column]))}</td>" for column in columns)
+            lines.append(f"<tr>{cells}<td><a href='/crop/{row_id}'>crop</a></td>"
+                         f"<td><a href='/background/{row_id}'>background</a></td></tr>")
+        lines.append("</table></body></html>")
+        return "\n".join(lines)
+
+
+def make_handler(service):
+    class CropRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            try:
+                if not parts:
+                    page = parse_qs(url.query).get("page", ["1"])[0]
+                    if not page.isdigit():
+                        self._send_error(HTTPStatus.BAD_REQUEST, f"Invalid page {page!r}")
+                        return
+                    page = int(page)
+                    self._send(HTTPStatus.OK, "text/html; charset=utf-8", service.listing(page).encode("utf-8"))
+                elif len(parts) == 2 and parts[0] in service.folders and parts[1].isdigit():
+                    row_id = int(parts[1])
+                    if row_id not in service.df.index:
+                        self._send_error(HTTPStatus.NOT_FOUND, f"No FM with ROW ID {row_id}")
+                        return
+                    crop_path = service.crop_path(parts[0], row_id)
+                    if crop_path is None:
+                        self._send_error(HTTPStatus.NOT_FOUND, f"No images found for ROW ID {row_id}")
+                        return
+                    with open(crop_path, "rb") as f:
+                        self._send(HTTPStatus.OK, "image/png", f.read())
+                else:
+                    self._send_error(HTTPStatus.NOT_FOUND, f"Unknown path {url.path}")
+            except Exception as e:
+                logger.exception("Error serving %s", self.path)
+                self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+
+        def _send(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message):
+            self._send(status, "text/plain; charset=utf-8", message.encode("utf-8"))
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return CropRequestHandler
+
+
+def serve(dakar, host="127.0.0.1", port=8765, fov_cache_size=8):
+    """Serves the crops of a Dakar analysis until interrupted."""
+    service = CropService(dakar, fov_cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logger.info("Serving the crops of %d FMs on http://%s:%d/", len(service.df), host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    from tkinter_app.settings import load_settings
+    from Dakar import Dakar
+    from ImageProcesser import ImageProcesser
+
+    default_settings = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tkinter_app", "settings.json")
+    parser = argparse.ArgumentParser(description="Serve the FM crops of an analysis on demand over HTTP.")
+    parser.add_argument("--settings", default=default_settings, help="Path to the settings JSON file.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on; 0 picks a free one.")
+    parser.add_argument("--fov-cache", type=int, default=8, help="Decoded FOV images kept in memory.")
+    parser.add_argument("--crop-width", type=int, default=960,
+                        help="Width in pixels of the rendered crops (the GUI uses half the screen width).")
+    args = parser.parse_args(argv)
+
+    ImageProcesser.default_target_width = args.crop_width
+    serve(Dakar(load_settings(args.settings)), args.host, args.port, args.fov_cache)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,30 @@
-import pandas as pd
 from tkinter_app.settings import MasterSettings
-from ImageProcesser import ImageProcesser
-from Plotter import Plotter
+from JobProgress import ProgressReporter, JobCancelled
+from ImageIndex import ImageIndex
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger, configure_logging, RateLimitedProgress
 import os
+import re
+import json
+import zlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+logger = get_logger("Dakar")
+
 
 class Dakar:
     """
     Orchestrates data loading and classification from a single MasterSettings object.
+
+    pandas, OpenCV and matplotlib are imported by the stages that need them, so importing
+    and constructing Dakar stays cheap for the GUI and the command-line runner.
     """
-    def __init__(self, settings: MasterSettings):
+    def __init__(self, settings: MasterSettings, progress: ProgressReporter = None):
         
         self.settings = settings
+        self.progress = progress if progress is not None else ProgressReporter()
         save_folder = self.settings.Dakar.save_folder
         analysis_name = self.settings.Dakar.analysis_name
         self.save_folder = os.path.join(save_folder,analysis_name)
@@ -18,6 +32,200 @@ class Dakar:
         self.excel_file_name =self.settings.Dakar.analysis_name + '.xlsx'
         self.excel_path = os.path.join(self.save_folder,self.excel_file_name)
         self.raw_image_folder_path = self.settings.Dakar.data
+        self._configure_logging()
+
+        # Working state shared by every stage of a pipeline run
+        self._data = None
+        self._image_index = None
+        self.stage_results = []
+        self.preflight_report = None
+        self.export_report = None
+        self.change_table = None
+        self.Plotter = None
+        self.ImageProcesser = None
+        self._crop_archive = None
+        self._contact_sheet = None
+        self._fm_features = None
+
+    def _configure_logging(self):
+        """Applies the log settings; a relative JSON-lines log path is placed in the analysis folder."""
+        json_lines_path = self.settings.Dakar.log_json_path or None
+        if json_lines_path and not os.path.isabs(json_lines_path):
+            json_lines_path = os.path.join(self.save_folder, json_lines_path)
+        configure_logging(self.settings.Dakar.log_level, self.settings.Dakar.log_module_levels, json_lines_path)
+
+    def run_pipeline(self, stages, **stage_options):
+        """
+        Runs several Dakar functions in order as one job. The stages share this instance,
+        so the combined dataset, the raw image index and the Plotter caches are loaded
+        once instead of once per stage.
+
+        Args:
+            stages (list): Names of Dakar functions, e.g. ['combine_csv', 'plot_FM_summary'].
+            **stage_options: Keyword arguments passed to every stage that accepts them,
+                e.g. start_row/end_row for crop_FM_classify_top_bottom_from_excel.
+
+        Returns:
+            list: One dict per stage run with its name, status and duration in seconds.
+                Also kept in self.stage_results, so it is available when a stage raises.
+                With the 'instrumentation' setting on, the timers and counters of the run are
+                saved to the Instrumentation folder of the analysis, even when a stage raises.
+        """
+        for stage in stages:
+            if not callable(getattr(self, stage, None)) or stage.startswith('_'):
+                raise ValueError(f"Function {stage} not found in Dakar class.")
+
+        self.stage_results = []
+        instrument = bool(self.settings.Dakar.instrumentation)
+        if instrument:
+            instrumentation.reset()
+            instrumentation.enable()
+        try:
+            for i, stage in enumerate(stages, start=1):
+                self.progress.check_cancelled()
+                logger.info("Running stage %d/%d: %s", i, len(stages), stage)
+                method = getattr(self, stage)
+                parameters = inspect.signature(method).parameters
+                options = {name: value for name, value in stage_options.items() if name in parameters}
+                result = {"stage": stage, "status": "failed", "seconds": None}
+                self.stage_results.append(result)
+                start_time = datetime.now()
+                try:
+                    method(**options)
+                    result["status"] = "finished"
+                except JobCancelled:
+                    result["status"] = "cancelled"
+                    raise
+                finally:
+                    duration = datetime.now() - start_time
+                    result["seconds"] = duration.total_seconds()
+                    instrumentation.record(f"stage.{stage}", result["seconds"])
+                logger.info("Finished stage %s in %s", stage, duration,
+                            extra={"fields": {"stage": stage, "seconds": result["seconds"]}})
+        finally:
+            if instrument:
+                instrumentation.enable(False)
+                self._save_instrumentation_report()
+        return self.stage_results
+
+    def _save_instrumentation_report(self):
+        """Saves the timers and counters of the last pipeline run next to the analysis output."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = f"{self.settings.Dakar.analysis_name} {timestamp}"
+        if self._is_sharded():
+            name += f" shard_{self.settings.Dakar.shard_index}_of_{self.settings.Dakar.shard_count}"
+        report_path = os.path.join(self.save_folder, "Instrumentation", name + ".json")
+        report = instrumentation.save(report_path, stages=self.stage_results)
+        for name, timer in report["timers"].items():
+            logger.info("%s: %d calls, %.3fs total, p50 %.1fms, p95 %.1fms", name, timer['count'],
+                        timer['total'], timer['p50'] * 1000, timer['p95'] * 1000)
+        for name, value in report["counters"].items():
+            logger.info("%s: %s", name, value)
+        logger.info("Saved the instrumentation report to '%s'", report_path)
+        return report_path
+
+    def _process_work_units(self, phase, work_units, handler):
+        """
+        Calls handler(*unit) for every work unit and yields the results, reporting progress
+        and checking for cancellation between units. With the 'workers' setting above 1 the
+        units run on a thread pool (OpenCV releases the GIL while decoding and encoding) and
+        results are yielded as they complete; at most two units per worker are in flight to
+        bound the memory held by decoded images.
+        """
+        work_units = list(work_units)
+        self.progress.start_phase(phase, len(work_units))
+        workers = max(1, int(self.settings.Dakar.workers or 1))
+
+        if workers == 1:
+            for unit in work_units:
+                self.progress.check_cancelled()
+                yield handler(*unit)
+                self.progress.advance()
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            unit_iterator = iter(work_units)
+            pending = set()
+            try:
+                while True:
+                    for unit in unit_iterator:
+                        self.progress.check_cancelled()
+                        pending.add(executor.submit(handler, *unit))
+                        if len(pending) >= workers * 2:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                        self.progress.advance()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _load_data(self):
+        """
+        Returns the combined FM table, reading the Excel file only once per Dakar instance.
+        The crop links are restored as '=HYPERLINK' formulas, so _save_data writes them back.
+        """
+        if self._data is None:
+            import pandas as pd
+            with instrumentation.timer("excel.read"):
+                df = pd.read_excel(self.excel_path)
+                self._restore_hyperlinks(df)
+            self._data = df
+        return self._data
+
+    def _restore_hyperlinks(self, df):
+        """
+        pandas reads formula cells back as empty values, so the '=HYPERLINK' formulas of the
+        link columns are rebuilt from the targets in the workbook itself.
+        """
+        import pandas as pd
+        from ExcelExport import read_hyperlink_targets
+
+        link_columns = [column for column in df.columns if "HYPERLINK" in str(column)]
+        if not link_columns:
+            return
+        for column, targets in read_hyperlink_targets(self.excel_path, link_columns).items():
+            if len(targets) != len(df):
+                logger.warning("Could not restore the links of '%s': the workbook has %d rows, the table %d.",
+                               column, len(targets), len(df))
+                continue
+            targets = pd.Series(targets, index=df.index, dtype=object)
+            lost = df[column].isna() & targets.notna()
+            df[column] = df[column].astype(object)
+            df.loc[lost, column] = '=HYPERLINK("' + targets[lost] + '", "View")'
+
+    def _save_data(self, df):
+        """Writes the combined FM table to Excel and keeps it as the working dataset."""
+        with instrumentation.timer("excel.write"):
+            df.to_excel(self.excel_path, index=False, engine='openpyxl')
+        self._set_data(df)
+
+    def _set_data(self, df):
+        self._data = df
+        if self.Plotter is not None:
+            self.Plotter.set_data(df)
+
+    def _get_image_processer(self):
+        if self.ImageProcesser is None:
+            from ImageProcesser import ImageProcesser
+            self.ImageProcesser = ImageProcesser(self._load_data())
+        return self.ImageProcesser
+
+    def _get_plotter(self):
+        """Returns the Plotter of the working dataset, so its spatial index and summary template caches are shared."""
+        if self.Plotter is None:
+            self.Plotter = self._create_plotter(self._load_data())
+        return self.Plotter
+
+    def _get_image_index(self):
+        """Returns the index of the raw images, scanning the data folder once per Dakar instance."""
+        if self._image_index is None:
+            self._image_index = ImageIndex(self.raw_image_folder_path)
+            logger.info("Indexed %d FOVs in '%s'", len(self._image_index), self.raw_image_folder_path)
+        return self._image_index
 
     def combine_csv(self):
         """
@@ -25,20 +233,25 @@ class Dakar:
         and adds calculated columns.
         """
 
+        import pandas as pd
+
         foils_to_plot = self.settings.Dakar.foils_to_plot
         raw_data_folder = self.settings.Dakar.data
         all_dfs = []
 
+        self.progress.start_phase("Combine CSV foils", sum(len(foils) for foils in foils_to_plot.values()))
         for state, foils in foils_to_plot.items():
             state_path = os.path.join(raw_data_folder, state)
             if not os.path.isdir(state_path):
-                print(f"Warning: Directory for state '{state}' not found at '{state_path}'")
+                logger.warning("Directory for state '%s' not found at '%s'", state, state_path)
                 continue
 
             for foil in foils:
+                self.progress.check_cancelled()
+                self.progress.advance()
                 foil_path = os.path.join(state_path, foil)
                 if not os.path.isdir(foil_path):
-                    print(f"Warning: Directory for foil '{foil}' not found at '{foil_path}'")
+                    logger.warning("Directory for foil '%s' not found at '%s'", foil, foil_path)
                     continue
 
                 csv_files = []
@@ -48,11 +261,11 @@ class Dakar:
                             csv_files.append(os.path.join(root, file))
 
                 if not csv_files:
-                    print(f"Warning: No CSV file found for state '{state}', foil '{foil}' in '{foil_path}'")
+                    logger.warning("No CSV file found for state '%s', foil '%s' in '%s'", state, foil, foil_path)
                     continue
 
                 if len(csv_files) > 1:
-                    print(f"Warning: More than one CSV file found for state '{state}', foil '{foil}' in '{foil_path}'. Skipping.")
+                    logger.warning("More than one CSV file found for state '%s', foil '%s' in '%s'. Skipping.", state, foil, foil_path)
                     continue
                 
                 df = pd.read_csv(csv_files[0], header=None)
@@ -62,7 +275,7 @@ class Dakar:
                 all_dfs.append(df)
 
         if not all_dfs:
-            print("No CSV files found to combine.")
+            logger.warning("No CSV files found to combine.")
             return
 
         combined_df = pd.concat(all_dfs, ignore_index=True)
@@ -81,213 +294,849 @@ class Dakar:
         combined_df['ROW ID'] = combined_df.index + 1
 
         
-        combined_df.to_excel(self.excel_path, index=False)
-        print(f"Successfully combined {len(all_dfs)} CSV files with calculated columns into '{self.excel_path}'")
+        combined_df = combined_df.reset_index(drop=True)
+        self._save_data(combined_df)
+        logger.info("Successfully combined %d CSV files with calculated columns into '%s'", len(all_dfs), self.excel_path)
+
+
+    def preflight_dataset_stats(self, start_row=0, end_row=None):
+        """
+        Reports, before a long crop run, what the crop functions will touch: per state and foil
+        the FMs, FOVs and images, the FOVs whose white or red image is missing, the bytes that
+        will be decoded and the projected runtime. Only JPEG headers are read, nothing is decoded.
+        The summary and the missing images are saved to '<analysis> preflight.xlsx'.
+
+        Decoded sizes assume the 3-channel BGR arrays of ImageProcesser._read_image. The background
+        check decodes up to 4 white images per FM, so its bytes are counted per FM.
+        Runtimes divide the decoded bytes by the 'decode_mb_per_second' setting and the workers.
+
+        Args:
+            start_row (int): Starting row index, as for crop_FM_classify_top_bottom_from_excel.
+            end_row (int, optional): Ending row index. Defaults to None (all rows).
+
+        Returns:
+            dict: 'summary' and 'missing' DataFrames, 'totals' dict and the printed 'text'.
+                Also kept in self.preflight_report.
+        """
+        import pandas as pd
+
+        df = self._load_data()
+        image_index = self._get_image_index()
+        df_to_process = df.iloc[start_row:end_row]
+        workers = max(1, int(self.settings.Dakar.workers or 1))
+        bytes_per_second = max(float(self.settings.Dakar.decode_mb_per_second), 1e-6) * 1e6
+
+        decoded_sizes = {}
+
+        def decoded_bytes(image_path):
+            if image_path not in decoded_sizes:
+                size = ImageIndex.read_jpeg_size(image_path)
+                decoded_sizes[image_path] = size[0] * size[1] * 3 if size else 0
+            return decoded_sizes[image_path]
 
+        fov_groups = list(df_to_process.groupby(['STATE', 'FOIL', 'FOV NUMBER'], sort=False))
+        self.progress.start_phase("Pre-flight FOVs", len(fov_groups))
+        summary = {}
+        missing_rows = []
+        peak_pair_bytes = 0
+        for (state, foil, fov_number), matching_rows in fov_groups:
+            self.progress.check_cancelled()
+            row = summary.setdefault((state, foil), {
+                "STATE": state, "FOIL": foil, "FMS": 0, "FOVS": 0, "FOVS MISSING IMAGES": 0,
+                "FMS WITHOUT IMAGES": 0, "IMAGES": 0, "DECODE MB": 0.0, "BACKGROUND FMS": 0,
+                "BACKGROUND DECODE MB": 0.0,
+            })
+            fm_count = len(matching_rows)
+            row["FMS"] += fm_count
+            row["FOVS"] += 1
+
+            white_image, red_image = image_index.match_white_red_image(state, foil, fov_number)
+            if white_image and red_image:
+                pair_bytes = decoded_bytes(white_image) + decoded_bytes(red_image)
+                peak_pair_bytes = max(peak_pair_bytes, pair_bytes)
+                row["IMAGES"] += 2
+                row["DECODE MB"] += pair_bytes / 1e6
+            else:
+                row["FOVS MISSING IMAGES"] += 1
+                row["FMS WITHOUT IMAGES"] += fm_count
+                missing_rows.append({
+                    "STATE": state, "FOIL": foil, "FOV NUMBER": fov_number, "FMS": fm_count,
+                    "WHITE IMAGE": white_image or "missing", "RED IMAGE": red_image or "missing",
+                })
+
+            if "TOP BOTTOM" in matching_rows.columns:
+                background_fms = int(matching_rows["TOP BOTTOM"].isin(['top', 'bottom']).sum())
+                if background_fms:
+                    background_images = image_index.match_white_images(state, fov_number)[:4]
+                    row["BACKGROUND FMS"] += background_fms
+                    row["BACKGROUND DECODE MB"] += background_fms * sum(decoded_bytes(path) for path in background_images) / 1e6
+            self.progress.advance()
+
+        summary_df = pd.DataFrame(list(summary.values()), columns=[
+            "STATE", "FOIL", "FMS", "FOVS", "FOVS MISSING IMAGES", "FMS WITHOUT IMAGES", "IMAGES",
+            "DECODE MB", "BACKGROUND FMS", "BACKGROUND DECODE MB"])
+        summary_df["CROP SECONDS"] = summary_df["DECODE MB"] * 1e6 / bytes_per_second / workers
+        summary_df["BACKGROUND SECONDS"] = summary_df["BACKGROUND DECODE MB"] * 1e6 / bytes_per_second / workers
+        missing_df = pd.DataFrame(missing_rows, columns=["STATE", "FOIL", "FOV NUMBER", "FMS", "WHITE IMAGE", "RED IMAGE"])
+
+        totals = {
+            "fms": int(summary_df["FMS"].sum()),
+            "fovs": int(summary_df["FOVS"].sum()),
+            "fovs_missing_images": int(summary_df["FOVS MISSING IMAGES"].sum()),
+            "fms_without_images": int(summary_df["FMS WITHOUT IMAGES"].sum()),
+            "images": int(summary_df["IMAGES"].sum()),
+            "decode_mb": float(summary_df["DECODE MB"].sum()),
+            "background_decode_mb": float(summary_df["BACKGROUND DECODE MB"].sum()),
+            "crop_seconds": float(summary_df["CROP SECONDS"].sum()),
+            "background_seconds": float(summary_df["BACKGROUND SECONDS"].sum()),
+            "peak_worker_mb": peak_pair_bytes / 1e6,
+            "workers": workers,
+        }
+
+        lines = [f"Pre-flight of rows {start_row} to {end_row if end_row is not None else 'end'} ({workers} workers)"]
+        for row in summary_df.to_dict('records'):
+            lines.append(f"{row['STATE']} {row['FOIL']}: {row['FMS']} FMs in {row['FOVS']} FOVs, "
+                         f"{row['FOVS MISSING IMAGES']} FOVs missing images ({row['FMS WITHOUT IMAGES']} FMs), "
+                         f"{row['DECODE MB']:.0f} MB to decode, ~{row['CROP SECONDS']:.0f}s crop, "
+                         f"~{row['BACKGROUND SECONDS']:.0f}s background check")
+        lines.append(f"Total: {totals['fms']} FMs in {totals['fovs']} FOVs, {totals['images']} images, "
+                     f"{totals['fovs_missing_images']} FOVs missing images, "
+                     f"{totals['decode_mb']:.0f} MB to decode (peak {totals['peak_worker_mb']:.0f} MB per worker), "
+                     f"~{totals['crop_seconds']:.0f}s crop, ~{totals['background_seconds']:.0f}s background check")
+        text = "\n".join(lines)
+        logger.info(text, extra={"fields": totals})
+
+        os.makedirs(self.save_folder, exist_ok=True)
+        report_path = os.path.join(self.save_folder, self.settings.Dakar.analysis_name + ' preflight.xlsx')
+        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
+            summary_df.to_excel(writer, sheet_name='Summary', index=False)
+            missing_df.to_excel(writer, sheet_name='Missing images', index=False)
+        logger.info("Successfully saved the pre-flight report to '%s'", report_path)
+
+        self.preflight_report = {"summary": summary_df, "missing": missing_df, "totals": totals, "text": text}
+        return self.preflight_report
 
     def crop_FM_classify_top_bottom_from_excel(self, start_row=0, end_row=None):
         """
         Crops and classifies images based on data from the combined CSV file, iterating through states and foils.
+        Progress is reported per FOV and cancellation is checked between FOVs; a cancelled
+        run still saves the hyperlinks of the FOVs processed so far. FOVs are cropped on
+        'workers' threads when that setting is above 1. With the 'fm_features' setting the
+        intensity features of FMFeatures are measured on the same decoded images and saved
+        as numeric columns.
         
         Args:
             start_row (int): Starting row index for CSV processing.
             end_row (int, optional): Ending row index for CSV processing. Defaults to None (process all rows).
         """
 
-        df = pd.read_excel(self.excel_path)
-        self.ImageProcesser = ImageProcesser(df)
+        df = self._load_data()
+        self._get_image_processer()
+        self._get_image_index()
 
         save_folder = os.path.join(self.save_folder,"Combined white and red images")
         os.makedirs(save_folder, exist_ok=True)
 
+        hyperlink_header = "WHITE RED IMAGE HYPERLINK"
+        if self.settings.Dakar.show_hyperlink:
+            if hyperlink_header not in df.columns:
+                df[hyperlink_header] = ''
+            else:
+                # An empty link column reads back from Excel as float NaN, which rejects strings
+                df[hyperlink_header] = df[hyperlink_header].fillna('').astype(object)
+
+        if "TOP BOTTOM" not in df.columns:
+            df["TOP BOTTOM"] = ''
+
         df_to_process = df.iloc[start_row:end_row]
-        
+        work_units = [
+            (state, foil, fov_number, matching_rows, save_folder)
+            for (state, foil, fov_number), matching_rows
+            in df_to_process.groupby(['STATE', 'FOIL', 'FOV NUMBER'], sort=False)
+        ]
+
+        contact_sheet = None
+        if self.settings.Dakar.contact_sheet:
+            from ContactSheet import ContactSheet
+            rows, columns = self.settings.Dakar.contact_sheet_grid
+            name_suffix = ""
+            if self._is_sharded():
+                name_suffix = f" shard_{int(self.settings.Dakar.shard_index)}_of_{int(self.settings.Dakar.shard_count)}"
+            contact_sheet = ContactSheet(os.path.join(self.save_folder, "Contact sheets"), rows, columns,
+                                         self.settings.Dakar.contact_sheet_cell_width, name_suffix)
+
+        self._run_crop_units("crop_FM_classify_top_bottom_from_excel", "Crop white/red FOVs", work_units,
+                             self._crop_white_red_fov, df, hyperlink_header, save_folder, key_length=3,
+                             contact_sheet=contact_sheet, fm_features=bool(self.settings.Dakar.fm_features))
+
+    def _run_crop_units(self, stage, phase, work_units, handler, df, hyperlink_header, save_folder, key_length,
+                        contact_sheet=None, fm_features=False):
+        """
+        Runs the work units of a crop stage and records the saved crops.
+
+        Unsharded runs write the hyperlinks into the workbook, also when cancelled. With the
+        'shard_count' setting above 1 only the units of shard 'shard_index' are cropped and the
+        saved crops go to a journal in the Shards folder instead; merge_shard_journals then
+        writes the journals of all shards into the workbook. The first key_length items of a
+        work unit, e.g. (state, foil, FOV number), decide its shard.
+
+        With the 'crop_output' setting 'archive' the crops go to one archive next to save_folder
+        (one per shard); the hyperlinks point to the files expand_crop_archives writes.
+        A contact_sheet is planned with the FM rows of the units, the item after their key,
+        and the handler adds its thumbnails to self._contact_sheet. With fm_features the
+        handler appends one feature frame per FOV to self._fm_features, written to the
+        workbook (or the journal) as one update per FOV.
+        """
+        journal = None
+        if self._is_sharded():
+            work_units = self._select_shard(work_units, key_length)
+            journal = self._open_shard_journal(stage)
+        self._open_crop_archive(save_folder)
+        if contact_sheet is not None and work_units:
+            import pandas as pd
+            contact_sheet.plan(pd.concat([unit[key_length] for unit in work_units]))
+            self._contact_sheet = contact_sheet
+        if fm_features:
+            from FMFeatures import FEATURE_COLUMNS
+            for column in FEATURE_COLUMNS:
+                if column not in df.columns:
+                    df[column] = float('nan')
+            self._fm_features = []
+
+        saved_crops = RateLimitedProgress(logger, "Saved %d crops")
+        completed = False
+        try:
+            for saved_images in self._process_work_units(phase, work_units, handler):
+                saved_crops.update(len(saved_images))
+                self._write_fm_features(df, journal)
+                if journal is not None:
+                    for index, image_absolute_path in saved_images:
+                        journal.write(json.dumps({"row_id": int(df.at[index, 'ROW ID']), "column": hyperlink_header,
+                                                  "path": image_absolute_path}) + "\n")
+                    journal.flush()
+                elif self.settings.Dakar.show_hyperlink:
+                    for index, image_absolute_path in saved_images:
+                        df.loc[index, hyperlink_header] = f'=HYPERLINK("{image_absolute_path}", "View")'
+            completed = True
+        except JobCancelled:
+            logger.warning("Crop cancelled, saving the FOVs processed so far.")
+            raise
+        finally:
+            saved_crops.close()
+            self._write_fm_features(df, journal)
+            self._fm_features = None
+            self._close_crop_archive()
+            if self._contact_sheet is not None:
+                self._contact_sheet.close()
+                self._contact_sheet = None
+            if journal is not None:
+                # The last line tells the merge whether the shard ran to the end
+                journal.write(json.dumps({"complete": completed, "work_units": len(work_units)}) + "\n")
+                journal.close()
+                logger.info("Wrote the shard journal '%s'", journal.name)
+            else:
+                self._save_data(df)
+                logger.info("Successfully created Excel file with hyperlinks at '%s'", self.excel_path)
+
+    def _write_fm_features(self, df, journal):
+        """Moves the feature frames the workers have appended so far into df, or into the shard journal."""
+        while self._fm_features:
+            features = self._fm_features.pop()
+            if journal is not None:
+                for row_id, values in zip(df.loc[features.index, 'ROW ID'], features.to_dict('records')):
+                    journal.write(json.dumps({"row_id": int(row_id), "features": values}) + "\n")
+                journal.flush()
+            else:
+                df.loc[features.index, features.columns] = features.to_numpy()
+
+    def _open_crop_archive(self, save_folder):
+        crop_output = self.settings.Dakar.crop_output
+        if crop_output == "files":
+            return
+        if crop_output != "archive":
+            raise ValueError(f"crop_output must be 'files' or 'archive', got {crop_output!r}")
+        from CropArchive import CropArchiveWriter, ARCHIVE_EXTENSION
+
+        archive_path = save_folder
+        if self._is_sharded():
+            archive_path += f" shard_{int(self.settings.Dakar.shard_index)}_of_{int(self.settings.Dakar.shard_count)}"
+        self._crop_archive = CropArchiveWriter(archive_path + ARCHIVE_EXTENSION, self.settings.Dakar.crop_archive_format)
+        logger.info("Packing the crops into '%s'", self._crop_archive.archive_path)
+
+    def _close_crop_archive(self):
+        if self._crop_archive is not None:
+            self._crop_archive.close()
+            self._crop_archive = None
+
+    def _save_crop(self, save_folder, image, file_name):
+        """Saves one crop as a loose file or into the open crop archive and returns the absolute path of its file."""
+        if self._crop_archive is not None:
+            entry_name = self._crop_archive.add(image, file_name)
+            return os.path.abspath(os.path.join(save_folder, entry_name))
+        self.ImageProcesser._save_image_to_folder(save_folder, image, file_name)
+        return os.path.abspath(os.path.join(save_folder, file_name) + ".png")
+
+    def expand_crop_archives(self):
+        """
+        Expands the crop archives written with the 'crop_output' setting 'archive' to loose
+        files in the crop folders, where the workbook hyperlinks point.
+
+        Returns:
+            dict: Per crop folder, the number of files written.
+        """
+        from CropArchive import CropArchiveReader, archive_paths
+
+        expanded = {}
+        for folder_name in ("Combined white and red images", "Combined different foil images"):
+            crop_folder = os.path.join(self.save_folder, folder_name)
+            paths = archive_paths(crop_folder)
+            if not paths:
+                continue
+            with CropArchiveReader(paths) as reader:
+                expanded[folder_name] = reader.expand(crop_folder)
+            logger.info("Expanded %d crops from %d archives to '%s'", expanded[folder_name], len(paths), crop_folder)
+        if not expanded:
+            logger.warning("No crop archives found in '%s'.", self.save_folder)
+        return expanded
+
+    def _is_sharded(self):
+        return int(self.settings.Dakar.shard_count or 1) > 1
+
+    @staticmethod
+    def shard_of(key, shard_count):
+        """
+        Returns the shard of a work unit key such as (state, foil, FOV number). Uses CRC32 of
+        the key text rather than hash(), which is salted per process, so every node agrees.
+        """
+        text = "|".join(str(part) for part in key)
+        return zlib.crc32(text.encode("utf-8")) % shard_count
+
+    def _select_shard(self, work_units, key_length):
+        shard_count = int(self.settings.Dakar.shard_count)
+        shard_index = int(self.settings.Dakar.shard_index)
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"shard_index must be between 0 and {shard_count - 1}, got {shard_index}")
+        selected = [unit for unit in work_units if self.shard_of(unit[:key_length], shard_count) == shard_index]
+        logger.info("Shard %d of %d: %d of %d work units", shard_index, shard_count, len(selected), len(work_units))
+        return selected
+
+    def _shard_folder(self):
+        return os.path.join(self.save_folder, "Shards")
+
+    def _open_shard_journal(self, stage):
+        """Opens the journal of this shard; its first line records the run it belongs to."""
+        os.makedirs(self._shard_folder(), exist_ok=True)
+        shard_index, shard_count = int(self.settings.Dakar.shard_index), int(self.settings.Dakar.shard_count)
+        journal_path = os.path.join(self._shard_folder(), f"{stage} shard_{shard_index}_of_{shard_count}.jsonl")
+        journal = open(journal_path, "w", encoding="utf-8")
+        journal.write(json.dumps({"run": {"run_id": str(self.settings.Dakar.shard_run_id or ""), "stage": stage,
+                                          "shard_index": shard_index, "shard_count": shard_count,
+                                          "started": datetime.now().isoformat()}}) + "\n")
+        return journal
+
+    @staticmethod
+    def _read_journal_header(journal_path):
+        """Returns the run header of a shard journal, empty for journals written without one."""
+        with open(journal_path, encoding="utf-8") as journal:
+            first_line = journal.readline()
+        try:
+            return json.loads(first_line).get("run", {}) if first_line.strip() else {}
+        except ValueError:
+            return {}
+
+    def _select_shard_run(self, journals):
+        """
+        Keeps, per stage, the journals of one sharded run: the 'shard_run_id' setting when
+        given, otherwise the run of the newest journal. Journals of other runs are skipped.
+
+        Raises:
+            ValueError: When the journals of the selected run have different shard counts.
+        """
+        selected = []
+        for stage in sorted({journal["stage"] for journal in journals}):
+            stage_journals = [journal for journal in journals if journal["stage"] == stage]
+            run_id = self.settings.Dakar.shard_run_id
+            if not run_id:
+                run_id = max(stage_journals, key=lambda journal: journal["started"])["run_id"]
+            run_journals = [journal for journal in stage_journals if journal["run_id"] == run_id]
+            if len(run_journals) < len(stage_journals):
+                logger.info("%s: skipping %d journals of runs other than '%s'", stage,
+                            len(stage_journals) - len(run_journals), run_id)
+            if not run_journals:
+                logger.warning("%s: no journals of run '%s'.", stage, run_id)
+                continue
+            shard_counts = sorted({journal["shard_count"] for journal in run_journals})
+            if len(shard_counts) > 1:
+                raise ValueError(f"{stage}: the journals of run '{run_id}' have different shard counts {shard_counts}. "
+                                 f"Give every sharded run its own shard_run_id, or clear '{self._shard_folder()}' "
+                                 f"and crop again.")
+            selected.extend(run_journals)
+        return selected
+
+    def merge_shard_journals(self):
+        """
+        Writes the crops recorded by the shards of a sharded crop run into the workbook as
+        hyperlinks, along with the FM features they measured. Run once after every node has
+        finished its shard.
+
+        Only the journals of one run are merged per stage (see _select_shard_run), so journals
+        left over from earlier runs are never mixed in. A missing shard or one that did not run
+        to the end (failed or cancelled) is reported, and the crops it did record are still merged.
+
+        Returns:
+            dict: Per stage, the shard count, the shards found, the incomplete shards and the merged crops.
+        """
+        df = self._load_data()
+        shard_folder = self._shard_folder()
+        journal_names = sorted(os.listdir(shard_folder)) if os.path.isdir(shard_folder) else []
+        journal_pattern = re.compile(r"^(?P<stage>.+) shard_(?P<index>\d+)_of_(?P<count>\d+)\.jsonl$")
+
+        journals = []
+        for journal_name in journal_names:
+            match = journal_pattern.match(journal_name)
+            if match is None:
+                continue
+            journal_path = os.path.join(shard_folder, journal_name)
+            header = self._read_journal_header(journal_path)
+            journals.append({"path": journal_path, "stage": match["stage"], "shard_index": int(match["index"]),
+                             "shard_count": int(match["count"]), "run_id": header.get("run_id", ""),
+                             "started": header.get("started", "")})
+
+        links = {}
+        features = {}
+        merge_summary = {}
+        for journal_info in self._select_shard_run(journals):
+            stage, shard_index, shard_count = journal_info["stage"], journal_info["shard_index"], journal_info["shard_count"]
+            stage_summary = merge_summary.setdefault((stage, shard_count), {
+                "stage": stage, "shard_count": shard_count, "shards": [], "incomplete": [], "crops": 0})
+            stage_summary["shards"].append(shard_index)
+
+            complete = False
+            with open(journal_info["path"], encoding="utf-8") as journal:
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if "run" in entry:
+                        continue
+                    if "complete" in entry:
+                        complete = entry["complete"]
+                        continue
+                    if "features" in entry:
+                        features[entry["row_id"]] = entry["features"]
+                        continue
+                    links.setdefault(entry["column"], {})[entry["row_id"]] = entry["path"]
+                    stage_summary["crops"] += 1
+            if not complete:
+                stage_summary["incomplete"].append(shard_index)
+
+        if not merge_summary:
+            logger.warning("No shard journals found in '%s'.", shard_folder)
+            return {}
+
+        for stage_summary in merge_summary.values():
+            missing = sorted(set(range(stage_summary["shard_count"])) - set(stage_summary["shards"]))
+            if missing:
+                logger.warning("%s: shards %s of %d have no journal.", stage_summary["stage"], missing,
+                               stage_summary["shard_count"])
+            if stage_summary["incomplete"]:
+                logger.warning("%s: shards %s did not run to the end.", stage_summary["stage"],
+                               sorted(stage_summary["incomplete"]))
+            logger.info("%s: merging %d crops from %d of %d shards", stage_summary["stage"], stage_summary["crops"],
+                        len(stage_summary["shards"]), stage_summary["shard_count"])
+
+        # The shards never save the workbook, so add the TOP BOTTOM column the unsharded
+        # classify crop adds before its hyperlinks
+        added_top_bottom = "TOP BOTTOM" not in df.columns
+        if added_top_bottom:
+            df["TOP BOTTOM"] = ''
+
         if self.settings.Dakar.show_hyperlink:
-            hyperlink_header = "WHITE RED IMAGE HYPERLINK"
-            if hyperlink_header not in df_to_process.columns:
-                df_to_process[hyperlink_header] = ''
+            for column, paths in links.items():
+                if column not in df.columns:
+                    df[column] = ''
+                else:
+                    df[column] = df[column].fillna('').astype(object)
+                mapped_paths = df['ROW ID'].map(paths)
+                has_crop = mapped_paths.notna()
+                df.loc[has_crop, column] = '=HYPERLINK("' + mapped_paths[has_crop] + '", "View")'
 
-        if "TOP BOTTOM" not in df_to_process.columns:
-            df_to_process["TOP BOTTOM"] = ''
+        if features:
+            import pandas as pd
+            feature_table = pd.DataFrame.from_dict(features, orient='index')
+            for column in feature_table.columns:
+                if column not in df.columns:
+                    df[column] = float('nan')
+            measured = df['ROW ID'].isin(feature_table.index)
+            df.loc[measured, feature_table.columns] = feature_table.loc[df.loc[measured, 'ROW ID']].to_numpy()
+            logger.info("Merged the features of %d FMs", int(measured.sum()))
 
+        if self.settings.Dakar.show_hyperlink or features or added_top_bottom:
+            self._save_data(df)
+            logger.info("Successfully created Excel file with hyperlinks at '%s'", self.excel_path)
 
-        states = df_to_process['STATE'].unique()
-        
-        for state in states:
-            state_df = df_to_process[df_to_process['STATE'] == state]
-            foils = state_df['FOIL'].unique()
-            print(f"Processing state '{state}' with {len(foils)} unique foils: {foils}")
+        return {f"{stage} ({shard_count} shards)": stage_summary
+                for (stage, shard_count), stage_summary in merge_summary.items()}
+
+    def export_excel(self):
+        """
+        Streams the FM table to '<analysis> export.xlsx' in constant memory, with the crop
+        links as real cell hyperlinks, so large analyses export in linear time and flat memory.
+
+        Only the 'export_columns' are written (every column when empty), and rows are split
+        over several sheets beyond 'export_max_rows_per_sheet' or Excel's row and hyperlink
+        limits. The links of columns named '... HYPERLINK' become cell hyperlinks.
+
+        Returns:
+            dict: The export path, columns, and the number of rows, sheets and hyperlinks.
+        """
+        from ExcelExport import export_fm_table
+
+        # _load_data restored the link formulas that pandas reads back empty
+        df = self._load_data()
+        columns = list(self.settings.Dakar.export_columns) or list(df.columns)
+        link_columns = [column for column in columns if column in df.columns and "HYPERLINK" in column]
+
+        export_path = os.path.join(self.save_folder, f"{self.settings.Dakar.analysis_name} export.xlsx")
+        self.export_report = export_fm_table(df, export_path, columns=columns, link_columns=link_columns,
+                                             max_rows_per_sheet=self.settings.Dakar.export_max_rows_per_sheet)
+        logger.info("Exported %d rows with %d hyperlinks over %d sheets to '%s'", self.export_report["rows"],
+                    self.export_report["hyperlinks"], self.export_report["sheets"], export_path)
+        return self.export_report
+
+    @instrumentation.timed("crop.white_red_fov")
+    def _crop_white_red_fov(self, state, foil, fov_number, matching_rows, save_folder):
+        """
+        Crops every FM of one FOV from its white and red images and saves the combined crops.
+
+        Returns:
+            list: (row index, absolute image path) of every saved crop.
+        """
+        saved_images = []
+        white_image, red_image = self._get_image_index().match_white_red_image(state, foil, fov_number)
+        if not (white_image and red_image):
+            logger.warning("Skipping FOV %s of %s %s: Images not found (White: %s, Red: %s)", fov_number, state, foil, white_image, red_image)
+            return saved_images
+
+        white_img , red_img = self.ImageProcesser._read_image([white_image,red_image])
+        if self._fm_features is not None:
+            from FMFeatures import fov_features
+            self._fm_features.append(fov_features(white_img, red_img, matching_rows))
+        for index, row in matching_rows.iterrows():
+            with instrumentation.timer("crop.white_red_fm"):
+                fm_size,x,y,state,name,fov,fov_number,row_id = row['FM SIZE'],row['POS X'],row['POS Y'],row['STATE'],row["FOIL"],row["FOV"],row["FOV NUMBER"],str(row["ROW ID"])
             
-            for foil in foils:
-                foil_df = state_df[state_df['FOIL'] == foil]
-                fov_numbers = foil_df['FOV NUMBER'].unique()
-                print(f"Processing foil '{foil}' with {len(fov_numbers)} FOVs: {fov_numbers}")
-                
-                for fov_number in fov_numbers:
-                    matching_rows = foil_df[foil_df['FOV NUMBER'] == fov_number]
-                    
-                    white_image, red_image = self.ImageProcesser._match_white_red_image(
-                        state, foil, fov_number, self.raw_image_folder_path
-                    )
-                    if white_image and red_image:
-                        white_img , red_img = self.ImageProcesser._read_image([white_image,red_image])
-                        for index, row in matching_rows.iterrows():
-                            fm_size,x,y,state,name,fov,fov_number,row_id = row['FM SIZE'],row['POS X'],row['POS Y'],row['STATE'],row["FOIL"],row["FOV"],row["FOV NUMBER"],str(row["ROW ID"])
-                            
-                            cropped_white_img   = self.ImageProcesser._crop_image_base_on_coordinate(white_img,x,y,fm_size*3)
-                            cropped_red_img   = self.ImageProcesser._crop_image_base_on_coordinate(red_img,x,y,fm_size*3)
-                            combined_img = self.ImageProcesser._combine_image(cropped_white_img,cropped_red_img,direction = "horizontal")
-                            combined_img = self.ImageProcesser._resize_keep_aspect(combined_img)
-                        
-                            title_string = f'{row_id}_{state}_{name}\nFOV Number: {fov_number}\nx: {x} y: {y}\nFMsize: {fm_size}'
-                            file_name = row_id + " " + f'{state} {name} FOV Number_{fov_number} X_{x} Y_{y} FMsize_{fm_size}'
-                            image_absolute_path = os.path.join(save_folder, file_name)
-                            combined_img = self.ImageProcesser._overlay_text(title_string,combined_img,"top-left")
-                            self.ImageProcesser._save_image_to_folder(save_folder,combined_img ,file_name)
-
-                            if self.settings.Dakar.show_hyperlink:
-                                image_absolute_path = os.path.abspath(image_absolute_path + ".png")
-                                df_to_process.loc[index, hyperlink_header] = f'=HYPERLINK("{image_absolute_path}", "View")'
-
-                    else:
-                        print(f"Skipping row {row_id}: Images not found (White: {white_image}, Red: {red_image})")
-                        
-        df_to_process.to_excel(self.excel_path, index=False, engine='openpyxl')
-        print(f"Successfully created Excel file with hyperlinks at '{self.excel_path}'")
+                cropped_white_img   = self.ImageProcesser._crop_image_base_on_coordinate(white_img,x,y,fm_size*3)
+                cropped_red_img   = self.ImageProcesser._crop_image_base_on_coordinate(red_img,x,y,fm_size*3)
+                combined_img = self.ImageProcesser._combine_image(cropped_white_img,cropped_red_img,direction = "horizontal")
+                if self._contact_sheet is not None:
+                    self._contact_sheet.add(row_id, combined_img)
+
+                file_name, combined_img = self._render_crop(combined_img, row)
+                image_absolute_path = self._save_crop(save_folder, combined_img, file_name)
+                saved_images.append((index, image_absolute_path))
+        return saved_images
 
 
+    @staticmethod
+    def crop_file_name(row):
+        """Returns the file name, without extension, of the crops of a FM row, e.g. '12 BeforeCutState Foil1 FOV Number_3 X_10 Y_20 FMsize_300'."""
+        return f"{row['ROW ID']} {row['STATE']} {row['FOIL']} FOV Number_{row['FOV NUMBER']} X_{row['POS X']} Y_{row['POS Y']} FMsize_{row['FM SIZE']}"
+
+    def _render_crop(self, combined_img, row):
+        """
+        Resizes a combined crop of a FM row and overlays its title, as the crop stages save it.
+        Shared with the on-demand crop server so both produce the same images.
+
+        Returns:
+            tuple: (file name without extension, rendered image).
+        """
+        combined_img = self.ImageProcesser._resize_keep_aspect(combined_img)
+        title_string = (f"{row['ROW ID']}_{row['STATE']}_{row['FOIL']}\nFOV Number: {row['FOV NUMBER']}\n"
+                        f"x: {row['POS X']} y: {row['POS Y']}\nFMsize: {row['FM SIZE']}")
+        return self.crop_file_name(row), self.ImageProcesser._overlay_text(title_string, combined_img, "top-left")
+
     def crop_FM_check_background_fm(self):
         """
         Crops and classifies images based on data from the combined CSV file, iterating through states and foils.
         This version is optimized to reduce memory usage by reading and processing one image at a time.
+        Progress is reported per FOV and cancellation is checked between FOVs.
         """
         save_folder = os.path.join(self.save_folder,"Combined different foil images")
         os.makedirs(save_folder, exist_ok=True)
 
-        df = pd.read_excel(self.excel_path)
-        self.ImageProcesser = ImageProcesser(df)
+        df = self._load_data()
+        self._get_image_processer()
+        self._get_image_index()
 
+        hyperlink_header = "DIFFERENT FOIL COMBINED HYPERLINK "
         if self.settings.Dakar.show_hyperlink:
-            hyperlink_header = "DIFFERENT FOIL COMBINED HYPERLINK "
             if hyperlink_header not in df.columns:
                 df[hyperlink_header] = ''
+            else:
+                # An empty link column reads back from Excel as float NaN, which rejects strings
+                df[hyperlink_header] = df[hyperlink_header].fillna('').astype(object)
 
         df_to_process = df[df['TOP BOTTOM'].isin(['top', 'bottom'])]
-        states = df_to_process['STATE'].unique()
-        
-        for state in states:
-            state_df = df_to_process[df_to_process['STATE'] == state]
-            fov_numbers = state_df['FOV NUMBER'].unique()
-            print(f"Processing {state}  with {len(fov_numbers)} FOVs: {fov_numbers}")
+        if self.settings.Dakar.background_crop_ambiguous_only:
+            if 'BACKGROUND FOILS' in df.columns:
+                df_to_process = df_to_process[self._is_background_ambiguous(df).loc[df_to_process.index]]
+                logger.info("Cropping the %d FMs whose background check is ambiguous", len(df_to_process))
+            else:
+                logger.warning("No BACKGROUND FOILS column, run detect_background_fm first. Cropping every FM.")
+        work_units = [
+            (state, fov_number, matching_rows, save_folder)
+            for (state, fov_number), matching_rows
+            in df_to_process.groupby(['STATE', 'FOV NUMBER'], sort=False)
+        ]
+
+        self._run_crop_units("crop_FM_check_background_fm", "Crop background check FOVs", work_units,
+                             self._crop_background_fov, df, hyperlink_header, save_folder, key_length=2)
+
+    @instrumentation.timed("crop.background_fov")
+    def _crop_background_fov(self, state, fov_number, matching_rows, save_folder):
+        """
+        Crops every FM of one FOV from the white images of up to 4 foils of the state
+        and saves the combined crops.
+
+        Returns:
+            list: (row index, absolute image path) of every saved crop.
+        """
+        saved_images = []
+        image_paths = self._get_image_index().match_white_images(state, fov_number)
+        image_paths = image_paths[:4] # Limit to a maximum of 4 images
+
+        if not image_paths:
+            logger.warning("Skipping FOV %s in state %s: No images found.", fov_number, state)
+            return saved_images
+
+        for index, row in matching_rows.iterrows():
+            with instrumentation.timer("crop.background_fm"):
+                fm_size,x,y,state,name,fov,fov_number,row_id = row['FM SIZE'],row['POS X'],row['POS Y'],row['STATE'],row["FOIL"],row["FOV"],row["FOV NUMBER"],str(row["ROW ID"])
             
-            for fov_number in fov_numbers:
-                matching_rows = state_df[state_df['FOV NUMBER'] == fov_number]
-                
-                image_paths = self.ImageProcesser._match_all_name_white_images(
-                    state,  fov_number, self.raw_image_folder_path
-                )
-                image_paths = image_paths[:4] # Limit to a maximum of 4 images
-
-                if image_paths:
-                    for index, row in matching_rows.iterrows():
-                        fm_size,x,y,state,name,fov,fov_number,row_id = row['FM SIZE'],row['POS X'],row['POS Y'],row['STATE'],row["FOIL"],row["FOV"],row["FOV NUMBER"],str(row["ROW ID"])
-                        
-                        cropped_parts = []
-                        for image_path in image_paths:
-                            try:
-                                # Read one image at a time to save memory
-                                single_img_list = self.ImageProcesser._read_image([image_path])
-                                if not single_img_list:
-                                    print(f"Warning: Could not read image {image_path}")
-                                    continue
-                                single_img = single_img_list[0]
-                                
-                                # Crop the single loaded image
-                                cropped_part_list = self.ImageProcesser._crop_image_base_on_coordinate([single_img], x, y, fm_size * 3)
-                                if not cropped_part_list:
-                                    print(f"Warning: Could not crop image {image_path}")
-                                    continue
-                                cropped_parts.append(cropped_part_list[0])
-                            except Exception as e:
-                                print(f"An error occurred while processing {image_path} for row {row_id}: {e}")
-                        
-                        if not cropped_parts:
-                            print(f"Skipping row {row_id} as no images could be cropped.")
+                cropped_parts = []
+                for image_path in image_paths:
+                    try:
+                        # Read one image at a time to save memory
+                        single_img_list = self.ImageProcesser._read_image([image_path])
+                        if not single_img_list:
+                            logger.warning("Could not read image %s", image_path)
                             continue
-
-                        # Combine the collected cropped parts
-                        combined_img = self.ImageProcesser._combine_image(*cropped_parts, direction="horizontal")
-                        combined_img = self.ImageProcesser._resize_keep_aspect(combined_img)
+                        single_img = single_img_list[0]
                     
-                        title_string = f'{row_id}_{state}_{name}\nFOV Number: {fov_number}\nx: {x} y: {y}\nFMsize: {fm_size}'
-                        file_name = row_id + " " + f'{state} {name} FOV Number_{fov_number} X_{x} Y_{y} FMsize_{fm_size}'
-                        combined_img = self.ImageProcesser._overlay_text(title_string,combined_img,"top-left")
+                        # Crop the single loaded image
+                        cropped_part_list = self.ImageProcesser._crop_image_base_on_coordinate([single_img], x, y, fm_size * 3)
+                        if not cropped_part_list:
+                            logger.warning("Could not crop image %s", image_path)
+                            continue
+                        cropped_parts.append(cropped_part_list[0])
+                    except Exception as e:
+                        logger.error("An error occurred while processing %s for row %s: %s", image_path, row_id, e)
+            
+                if not cropped_parts:
+                    logger.warning("Skipping row %s as no images could be cropped.", row_id)
+                    continue
 
-                        image_absolute_path = os.path.join(save_folder, file_name)
-                        self.ImageProcesser._save_image_to_folder(save_folder,combined_img ,file_name)
+                # Combine the collected cropped parts
+                combined_img = self.ImageProcesser._combine_image(*cropped_parts, direction="horizontal")
+
+                file_name, combined_img = self._render_crop(combined_img, row)
+                image_absolute_path = self._save_crop(save_folder, combined_img, file_name)
+                saved_images.append((index, image_absolute_path))
+        return saved_images
 
-                        if self.settings.Dakar.show_hyperlink:
-                            image_absolute_path = os.path.abspath(image_absolute_path + ".png")
-                            df.loc[index, hyperlink_header] = f'=HYPERLINK("{image_absolute_path}", "View")'
-                else:
-                    print(f"Skipping FOV {fov_number} in state {state}: No images found.")
-                        
-        df.to_excel(self.excel_path, index=False, engine='openpyxl')
-        print(f"Successfully created Excel file with hyperlinks at '{self.excel_path}'")
 
+    def detect_background_fm(self):
+        """
+        Counts, for every FM, the other foils of its state with an FM within 'background_tolerance'
+        (X/Y PERCENTAGE) of it and saves the count in the BACKGROUND FOILS column. FMs found
+        on every other foil are background and FMs found on none are not; with
+        'background_crop_ambiguous_only' crop_FM_check_background_fm only crops the rest.
+        """
+        df = self._load_data()
+        self._get_plotter()
+
+        counts = self.Plotter.count_foil_coincidences(float(self.settings.Dakar.background_tolerance))
+        df['BACKGROUND FOILS'] = counts.reindex(df.index).to_numpy()
+        self.Plotter.index_cache.save()
+        self._save_data(df)
+
+        other_foils = df.groupby('STATE')['FOIL'].transform('nunique') - 1
+        background = int(((df['BACKGROUND FOILS'] >= other_foils) & (other_foils > 0)).sum())
+        ambiguous = int(self._is_background_ambiguous(df).sum())
+        logger.info("Found %d background FMs and %d ambiguous FMs out of %d", background, ambiguous, len(df))
+
+    @staticmethod
+    def _is_background_ambiguous(df):
+        """FMs found on some but not all other foils of their state, or not checked yet."""
+        other_foils = df.groupby('STATE')['FOIL'].transform('nunique') - 1
+        decided = (df['BACKGROUND FOILS'] == 0) | (df['BACKGROUND FOILS'] >= other_foils)
+        return ~decided
+
+    def build_foil_pyramids(self):
+        """
+        Stitches the white FOV images of every foil in the FM table into a deep-zoom pyramid
+        with an overlay of its FMs, in the 'Foil pyramids' folder, so the real foil imagery can
+        be panned and zoomed in a tiled viewer such as OpenSeadragon. FOVs are placed in the
+        grid combine_csv assumes; foils are built in parallel with the 'workers' setting.
+
+        Returns:
+            dict: Per '<state> <foil>', the pyramid size, the FOVs stitched and missing, and the tiles written.
+        """
+        df = self._load_data()
+        image_index = self._get_image_index()
+        save_folder = os.path.join(self.save_folder, "Foil pyramids")
+        os.makedirs(save_folder, exist_ok=True)
+
+        work_units = []
+        for (state, foil), fms in df.groupby(['STATE', 'FOIL'], sort=False):
+            fov_paths = image_index.fov_images(state, foil)
+            if not fov_paths:
+                logger.warning("Skipping %s %s: No white images found.", state, foil)
+                continue
+            work_units.append((f"{state} {foil}", fov_paths, fms, save_folder))
+
+        pyramids = {}
+        for name, pyramid in self._process_work_units("Build foil pyramids", work_units, self._build_foil_pyramid):
+            pyramids[name] = pyramid
+            if pyramid["missing_fovs"]:
+                logger.warning("%s: no image for FOVs %s, left black.", name, pyramid["missing_fovs"])
+            logger.info("Built the %dx%d pyramid of %s with %d tiles", pyramid["width"], pyramid["height"], name,
+                        pyramid["tiles"])
+        return pyramids
+
+    def _build_foil_pyramid(self, name, fov_paths, fms, save_folder):
+        from FoilPyramid import build_foil_pyramid
+
+        pyramid = build_foil_pyramid(os.path.join(save_folder, name), fov_paths, fms,
+                                     reduction=int(self.settings.Dakar.pyramid_reduction),
+                                     tile_size=int(self.settings.Dakar.pyramid_tile_size))
+        return name, pyramid
 
     def plot_compare_FM_summary(self):
+        """
+        Compares every selected foil from the before to the after state and saves the
+        before/after/added/removed/stayed counts per foil, TOP BOTTOM and size category to
+        '<analysis> FM changes <before> to <after>.csv' (also kept in self.change_table).
+        Unless 'compare_stats_only' is on, also renders the six-image summary of every foil.
+        """
+        import pandas as pd
 
-        df = pd.read_excel(self.excel_path)
-        self.Plotter = Plotter(df,self.settings.plotter)
-        self.ImageProcesser = ImageProcesser(df)
+        stats_only = bool(self.settings.Dakar.compare_stats_only)
+        self._get_plotter()
 
         save_folder = os.path.join(self.save_folder,"Plot compare FM summary")
-        os.makedirs(save_folder, exist_ok=True)
+        if not stats_only:
+            self._get_image_processer()
+            os.makedirs(save_folder, exist_ok=True)
 
         before_state = self.settings.Dakar.before_state
         after_state = self.settings.Dakar.after_state
 
         if not before_state or not after_state:
-            print("Warning: Before and/or After state not selected. Skipping comparison.")
+            logger.warning("Before and/or After state not selected. Skipping comparison.")
             return
 
         # Get foils from the settings that are selected for the 'before' state
         foils_to_plot = self.settings.Dakar.foils_to_plot.get(before_state, [])
 
+        change_counts = []
+        self.progress.start_phase("Plot compare FM summary foils", len(foils_to_plot))
         for foil in foils_to_plot:
+            self.progress.check_cancelled()
             # Check if the foil exists in the dataframe for both states to avoid errors
-            before_foils = df[df['STATE'] == before_state]['FOIL'].unique()
-            after_foils = df[df['STATE'] == after_state]['FOIL'].unique()
+            if not self.Plotter.groups.count(before_state, foil) or not self.Plotter.groups.count(after_state, foil):
+                logger.warning("Foil '%s' not found in both states. Skipping comparison for this foil.", foil)
+                self.progress.advance()
+                continue
+
+            logger.info("Comparing foil '%s' from '%s' to '%s'", foil, before_state, after_state)
 
-            if foil not in before_foils or foil not in after_foils:
-                print(f"Warning: Foil '{foil}' not found in both states. Skipping comparison for this foil.")
+            changes = self.Plotter._compare_states(foil, before_state, after_state)
+            change_counts.append(self.Plotter.count_changes(foil, before_state, after_state, changes))
+            if stats_only:
+                self.progress.advance()
                 continue
 
-            print(f"Comparing foil '{foil}' from '{before_state}' to '{after_state}'")
-            
             before = self.Plotter.create_FM_position_plot(before_state, foil)
             after = self.Plotter.create_FM_position_plot(after_state, foil)
-            generated_FM_changed_plots = self.Plotter.create_FM_change_plots(foil, before_state, after_state)
+            generated_FM_changed_plots = self.Plotter.create_FM_change_plots(foil, before_state, after_state, changes)
             added, removed, stayed = generated_FM_changed_plots
             summary = self.Plotter.create_changed_summary_plot(before, after, added, removed, stayed, foil, before_state, after_state)
             combined = self.ImageProcesser._combine_image_grid(before[0], after[0], summary, added[0], removed[0], stayed[0])
             self.ImageProcesser._save_image_to_folder(save_folder, combined, f'{foil} {before_state} to {after_state} summary')
+            self.progress.advance()
+
+        self.Plotter.index_cache.save()
+
+        self.change_table = pd.concat(change_counts, ignore_index=True) if change_counts else pd.DataFrame(
+            columns=['FOIL', 'TOP BOTTOM', 'marker_category', 'BEFORE', 'AFTER', 'ADDED', 'REMOVED', 'STAYED'])
+        table_path = os.path.join(self.save_folder,
+                                  f"{self.settings.Dakar.analysis_name} FM changes {before_state} to {after_state}.csv")
+        self.change_table.to_csv(table_path, index=False)
+        logger.info("Saved the FM changes of %d foils to '%s'", len(change_counts), table_path)
 
 
     def plot_FM_summary(self):
 
         save_folder = os.path.join(self.save_folder,"Plot FM summary")
         os.makedirs(save_folder, exist_ok=True)
-        df = pd.read_excel(self.excel_path)
-
-        self.ImageProcesser = ImageProcesser(df)
-        self.Plotter = Plotter(df,self.settings.plotter)
+        self._get_image_processer()
+        self._get_plotter()
 
         foils_to_plot = self.settings.Dakar.foils_to_plot
+        self.progress.start_phase("Plot FM summary foils", sum(len(foils) for foils in foils_to_plot.values()))
         for state, foils in foils_to_plot.items():
       
             for foil in foils:
+                self.progress.check_cancelled()
                 generated_plot = self.Plotter.create_FM_position_plot(state,foil)
                 self.ImageProcesser._save_image_to_folder(save_folder,generated_plot[0],state + " " + foil + ' plot')
-                print(f"Plotted {state} {foil}")
\ No newline at end of file
+                logger.info("Plotted %s %s", state, foil)
+                self.progress.advance()
+
+
+    def track_FM_across_states(self):
+        """
+        Tracks FMs through the ordered state sequence in one pass and saves the
+        FM track table (first seen, last seen, state-by-state ROW ID) next to the analysis.
+        """
+        states = self._get_state_sequence()
+        if len(states) < 2:
+            logger.warning("At least two states are needed to track FMs. Skipping tracking.")
+            return
+
+        self._get_plotter()
+
+        foils_to_plot = self.settings.Dakar.foils_to_plot
+        foils = sorted({foil for state in states for foil in foils_to_plot.get(state, [])})
+        logger.info("Tracking %d foils across states: %s", len(foils), ' -> '.join(states))
+
+        track_table = self.Plotter.track_FM_across_states(foils, states)
+        track_path = os.path.join(self.save_folder, self.settings.Dakar.analysis_name + ' FM tracks.xlsx')
+        track_table.to_excel(track_path, index=False)
+        self.Plotter.index_cache.save()
+        logger.info("Successfully saved %d FM tracks to '%s'", len(track_table), track_path)
+
+    def _create_plotter(self, df):
+        """
+        Creates a Plotter for the dataset. When 'persist_spatial_index' is enabled the
+        spatial index cache is stored next to the analysis, so later comparisons start warm.
+        """
+        from Plotter import Plotter
+        from SpatialIndexCache import SpatialIndexCache
+
+        cache_path = None
+        if self.settings.Dakar.persist_spatial_index:
+            cache_path = os.path.join(self.save_folder, 'spatial_index_cache.pkl')
+        return Plotter(df, self.settings.plotter, SpatialIndexCache(cache_path))
+
+    def _get_state_sequence(self):
+        """
+        Returns the ordered list of states to walk through. Uses the 'state_sequence'
+        setting when given, otherwise the before and after states.
+        """
+        state_sequence = self.settings.Dakar.state_sequence
+        if state_sequence:
+            return list(state_sequence)
+        return [state for state in (self.settings.Dakar.before_state, self.settings.Dakar.after_state) if state]
@@ -0,0 +1,156 @@
+import re
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger, RateLimitedProgress
+
+logger = get_logger("ExcelExport")
+
+# Rows of an .xlsx worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+# Hyperlinks Excel accepts per worksheet; xlsxwriter drops the ones above it
+EXCEL_MAX_URLS = 65530
+# Rows converted from the DataFrame at a time, bounds the Python objects held while streaming
+CHUNK_ROWS = 10000
+
+_HYPERLINK_FORMULA = re.compile(r'^=HYPERLINK\("(?P<target>[^"]*)"', re.IGNORECASE)
+
+
+def hyperlink_target(value):
+    """
+    Returns the target of a link cell, either a '=HYPERLINK("path", "View")' formula as
+    written by the crop stages or a plain path, or None for an empty cell.
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    match = _HYPERLINK_FORMULA.match(value)
+    if match is not None:
+        return match["target"] or None
+    return None if value.startswith('=') else value
+
+
+def read_hyperlink_targets(excel_path, columns):
+    """
+    Reads the link targets of some columns of a workbook written by Dakar._save_data.
+
+    pandas reads formula cells back as empty values, so the targets of the '=HYPERLINK'
+    formulas are only available from the workbook itself. The sheet is streamed in
+    openpyxl's read-only mode, keeping memory flat on large analyses.
+
+    Returns:
+        dict: Per column found in the header, the targets of its rows in order (None without a link).
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_path, read_only=True, data_only=False)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = {column: header.index(column) for column in columns if column in header}
+        targets = {column: [] for column in positions}
+        for row in rows:
+            for column, position in positions.items():
+                targets[column].append(hyperlink_target(row[position]) if position < len(row) else None)
+    finally:
+        workbook.close()
+    return targets
+
+
+def rows_per_sheet(link_column_count, max_rows_per_sheet=None):
+    """Data rows that fit on one sheet given Excel's row and hyperlink limits."""
+    limit = EXCEL_MAX_ROWS - 1
+    if max_rows_per_sheet:
+        limit = min(limit, int(max_rows_per_sheet))
+    if link_column_count:
+        limit = min(limit, EXCEL_MAX_URLS // link_column_count)
+    return max(limit, 1)
+
+
+@instrumentation.timed("excel.export")
+def export_fm_table(df, excel_path, columns=None, link_columns=None, link_targets=None,
+                    max_rows_per_sheet=None, sheet_name="FM", link_text="View"):
+    """
+    Streams a FM table to .xlsx row by row with xlsxwriter's constant-memory mode.
+
+    Every row is written to the file as soon as the next one starts, so memory stays flat
+    however many FMs the analysis has. Link columns become real cell hyperlinks instead of
+    '=HYPERLINK' formulas. Rows beyond one sheet's capacity (see rows_per_sheet) continue on
+    sheets 'FM 2', 'FM 3', ... with the same header; read_exported_table joins them back.
+
+    Args:
+        df (pd.DataFrame): The FM table.
+        excel_path (str): File to write.
+        columns (list, optional): Columns to export, in order; all columns by default.
+            Columns missing from df are skipped with a warning.
+        link_columns (list, optional): Columns holding crop paths or '=HYPERLINK' formulas.
+        link_targets (dict, optional): Per link column, targets aligned with the rows of df,
+            used instead of the column values (see read_hyperlink_targets).
+        max_rows_per_sheet (int, optional): Split the rows over sheets of at most this many rows.
+        sheet_name (str): Name of the first sheet.
+        link_text (str): Text shown in the hyperlink cells.
+
+    Returns:
+        dict: The path, the exported columns, the number of rows, sheets and hyperlinks.
+    """
+    import xlsxwriter
+
+    if columns is None:
+        columns = list(df.columns)
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        logger.warning("Skipping columns missing from the FM table: %s", missing)
+    columns = [column for column in columns if column in df.columns]
+    link_targets = link_targets or {}
+    link_positions = {columns.index(column): column for column in (link_columns or []) if column in columns}
+    sheet_rows = rows_per_sheet(len(link_positions), max_rows_per_sheet)
+
+    workbook = xlsxwriter.Workbook(excel_path, {'constant_memory': True})
+    sheets = 0
+    links = 0
+    exported_rows = RateLimitedProgress(logger, "Exported %d rows")
+    try:
+        header_format = workbook.add_format({'bold': True})
+        worksheet = None
+        sheet_row = sheet_rows
+        for chunk_start in range(0, len(df), CHUNK_ROWS):
+            chunk = df.iloc[chunk_start:chunk_start + CHUNK_ROWS][columns]
+            # Plain Python values with None for empty cells, xlsxwriter rejects NaN
+            values = chunk.astype(object).where(chunk.notna(), None).values.tolist()
+            for offset, row_values in enumerate(values):
+                if sheet_row == sheet_rows:
+                    sheets += 1
+                    worksheet = workbook.add_worksheet(sheet_name if sheets == 1 else f"{sheet_name} {sheets}")
+                    worksheet.write_row(0, 0, columns, header_format)
+                    sheet_row = 0
+                sheet_row += 1
+                for position, column in link_positions.items():
+                    if column in link_targets:
+                        target = link_targets[column][chunk_start + offset]
+                    else:
+                        target = hyperlink_target(row_values[position])
+                    row_values[position] = None
+                    if target is not None:
+                        if worksheet.write_url(sheet_row, position, "external:" + target, string=link_text) == 0:
+                            links += 1
+                        else:
+                            # Beyond Excel's URL length limit, keep at least the path
+                            row_values[position] = target
+                worksheet.write_row(sheet_row, 0, row_values)
+            exported_rows.update(len(values))
+        if worksheet is None:
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, columns, header_format)
+            sheets = 1
+    finally:
+        workbook.close()
+        exported_rows.close()
+
+    instrumentation.add("excel.exported_rows", len(df))
+    return {"path": excel_path, "columns": columns, "rows": len(df), "sheets": sheets, "hyperlinks": links}
+
+
+def read_exported_table(excel_path):
+    """Reads an export of export_fm_table back as one DataFrame, joining the sheets it was split over."""
+    import pandas as pd
+
+    sheets = pd.read_excel(excel_path, sheet_name=None)
+    return pd.concat(sheets.values(), ignore_index=True)
@@ -0,0 +1,97 @@
+"""
+Intensity features of FMs, measured on the white and red FOV images the crop stage has
+already decoded, so FMs can be triaged or sorted into top and bottom in bulk without
+decoding the images again.
+
+Every FM is measured in two squares centred on its POS X/POS Y: the FM box, FM SIZE wide,
+and the ring around it, up to 3 x FM SIZE wide, which stands for the local background.
+"""
+import cv2
+import numpy as np
+import pandas as pd
+
+from Instrumentation import instrumentation
+
+FEATURE_COLUMNS = ['WHITE MEAN', 'WHITE MAX', 'RED MEAN', 'RED MAX', 'RED WHITE RATIO', 'LOCAL CONTRAST', 'SPOT AREA']
+
+# FM box pixels further than this many standard deviations from the ring mean count as spot
+SPOT_SIGMA = 3.0
+
+
+def _window_bounds(xs, ys, half_sides, width, height):
+    """Returns the x1, y1, x2, y2 arrays of squares centred on xs/ys, clipped to the image."""
+    x1 = np.clip(np.rint(xs - half_sides), 0, width).astype(np.int64)
+    y1 = np.clip(np.rint(ys - half_sides), 0, height).astype(np.int64)
+    x2 = np.clip(np.rint(xs + half_sides), 0, width).astype(np.int64)
+    y2 = np.clip(np.rint(ys + half_sides), 0, height).astype(np.int64)
+    return x1, y1, x2, y2
+
+
+@instrumentation.timed("features.fov")
+def fov_features(white_img, red_img, fms):
+    """
+    Measures the FMs of one FOV on its decoded white and red images.
+
+    The window bounds and the derived features are computed for all FMs at once; only the
+    reductions over each FM's own pixels run per FM, on views of the decoded images, so
+    nothing FOV-sized is copied or converted.
+
+    Args:
+        white_img, red_img (np.ndarray): Decoded BGR images of the FOV.
+        fms (pd.DataFrame): FM rows of the FOV with POS X, POS Y and FM SIZE.
+
+    Returns:
+        pd.DataFrame: The FEATURE_COLUMNS, indexed like fms:
+            WHITE MEAN/MAX: gray level of the FM box on the white image.
+            RED MEAN/MAX: red channel of the FM box on the red image.
+            RED WHITE RATIO: RED MEAN / WHITE MEAN.
+            LOCAL CONTRAST: WHITE MEAN minus the mean of the ring, negative for dark FMs.
+            SPOT AREA: pixels of the FM box differing from the ring by more than SPOT_SIGMA
+                standard deviations on the white image.
+            FMs outside the image get NaN.
+    """
+    height, width = white_img.shape[:2]
+    xs = fms['POS X'].to_numpy(dtype=float)
+    ys = fms['POS Y'].to_numpy(dtype=float)
+    sizes = fms['FM SIZE'].to_numpy(dtype=float)
+    box_x1, box_y1, box_x2, box_y2 = _window_bounds(xs, ys, sizes / 2, width, height)
+    ring_x1, ring_y1, ring_x2, ring_y2 = _window_bounds(xs, ys, sizes * 1.5, width, height)
+    red_channel = red_img[:, :, 2] if red_img.ndim == 3 else red_img
+
+    white_sum, white_max, red_sum, red_max, ring_sum, ring_square_sum, spot_area = (
+        np.full(len(fms), np.nan) for _ in range(7))
+    box_area = ((box_x2 - box_x1) * (box_y2 - box_y1)).astype(float)
+    ring_area = ((ring_x2 - ring_x1) * (ring_y2 - ring_y1)).astype(float) - box_area
+
+    for i in np.flatnonzero(box_area > 0):
+        ring = white_img[ring_y1[i]:ring_y2[i], ring_x1[i]:ring_x2[i]]
+        ring = cv2.cvtColor(ring, cv2.COLOR_BGR2GRAY) if ring.ndim == 3 else ring
+        box = ring[box_y1[i] - ring_y1[i]:box_y2[i] - ring_y1[i], box_x1[i] - ring_x1[i]:box_x2[i] - ring_x1[i]]
+        red_box = red_channel[box_y1[i]:box_y2[i], box_x1[i]:box_x2[i]]
+
+        box_values = box.astype(np.float64)
+        ring_values = ring.astype(np.float64)
+        white_sum[i], white_max[i] = box_values.sum(), box_values.max()
+        red_sum[i], red_max[i] = red_box.sum(dtype=np.float64), red_box.max()
+        ring_sum[i] = ring_values.sum() - white_sum[i]
+        ring_square_sum[i] = np.square(ring_values).sum() - np.square(box_values).sum()
+        if ring_area[i] > 0:
+            ring_mean = ring_sum[i] / ring_area[i]
+            ring_std = np.sqrt(max(ring_square_sum[i] / ring_area[i] - ring_mean ** 2, 0.0))
+            spot_area[i] = np.count_nonzero(np.abs(box_values - ring_mean) > SPOT_SIGMA * ring_std)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        white_mean = white_sum / box_area
+        red_mean = red_sum / box_area
+        ring_mean = np.where(ring_area > 0, ring_sum / ring_area, np.nan)
+        ratio = np.where(white_mean > 0, red_mean / white_mean, np.nan)
+
+    return pd.DataFrame({
+        'WHITE MEAN': white_mean,
+        'WHITE MAX': white_max,
+        'RED MEAN': red_mean,
+        'RED MAX': red_max,
+        'RED WHITE RATIO': ratio,
+        'LOCAL CONTRAST': white_mean - ring_mean,
+        'SPOT AREA': spot_area,
+    }, index=fms.index)
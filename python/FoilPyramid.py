@@ -0,0 +1,193 @@
+"""
+Deep-zoom pyramids of whole foils, stitched from their FOV images, with an FM overlay.
+
+Every foil is written as a Deep Zoom Image (the format of OpenSeadragon and most tiled
+viewers): '<name>.dzi' describing the size and '<name>_files/<level>/<column>_<row>.jpg'
+tiles, level 0 being 1x1 pixel and the last level the stitched foil. '<name> overlay.json'
+places every FM of the foil in the pixel coordinates of the last level.
+
+Memory stays bounded whatever the foil size: FOV images are decoded one at a time at a
+reduced resolution directly by the JPEG decoder, a foil is assembled one FOV row (strip) at
+a time, and every level only buffers the rows of its next tile row.
+"""
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("FoilPyramid")
+
+# FOVs per foil row, the grid combine_csv assumes
+FOV_COLUMNS = 5
+
+_REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class DeepZoomWriter:
+    """
+    Writes a Deep Zoom pyramid from horizontal bands of the full-resolution image fed top to
+    bottom. Each level cuts tiles as soon as it has a tile row of pixels and hands the row,
+    downsampled 2x2, to the level below, so no level is ever held in memory.
+    """
+    def __init__(self, output_base, width, height, tile_size=256, jpeg_quality=85):
+        """
+        Args:
+            output_base (str): Path without extension; writes '<output_base>.dzi' and '<output_base>_files'.
+            width, height (int): Size of the full-resolution image.
+            tile_size (int): Tile edge in pixels, even.
+            jpeg_quality (int): Quality of the JPEG tiles.
+        """
+        if tile_size % 2:
+            raise ValueError(f"tile_size must be even, got {tile_size}")
+        self.output_base = output_base
+        self.width = int(width)
+        self.height = int(height)
+        self.tile_size = int(tile_size)
+        self.jpeg_quality = int(jpeg_quality)
+        self.max_level = math.ceil(math.log2(max(self.width, self.height, 1)))
+        self.level_widths = {}
+        level_width = self.width
+        for level in range(self.max_level, -1, -1):
+            self.level_widths[level] = level_width
+            level_width = math.ceil(level_width / 2)
+        self._buffers = {level: None for level in self.level_widths}
+        self._tile_rows = {level: 0 for level in self.level_widths}
+        self._rows_received = 0
+        self.tiles_written = 0
+
+    def add_rows(self, band):
+        """Appends the next rows of the full-resolution image (rows x width x 3 uint8)."""
+        if band.shape[1] != self.width:
+            raise ValueError(f"Bands must be {self.width} pixels wide, got {band.shape[1]}")
+        self._rows_received += band.shape[0]
+        self._push(self.max_level, band)
+
+    def _push(self, level, band):
+        buffer = band if self._buffers[level] is None else np.concatenate([self._buffers[level], band])
+        while buffer.shape[0] >= self.tile_size:
+            self._emit(level, buffer[:self.tile_size])
+            buffer = buffer[self.tile_size:]
+        self._buffers[level] = buffer if buffer.shape[0] else None
+
+    def _emit(self, level, tile_row):
+        """Writes one tile row of a level and feeds it, halved, to the level below."""
+        folder = os.path.join(self.output_base + "_files", str(level))
+        os.makedirs(folder, exist_ok=True)
+        row = self._tile_rows[level]
+        with instrumentation.timer("pyramid.write_tiles"):
+            for column, x in enumerate(range(0, tile_row.shape[1], self.tile_size)):
+                cv2.imwrite(os.path.join(folder, f"{column}_{row}.jpg"), tile_row[:, x:x + self.tile_size],
+                            [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                self.tiles_written += 1
+        self._tile_rows[level] = row + 1
+        if level > 0:
+            half = (self.level_widths[level - 1], math.ceil(tile_row.shape[0] / 2))
+            self._push(level - 1, cv2.resize(tile_row, half, interpolation=cv2.INTER_AREA))
+
+    def close(self):
+        """Writes the last, partial tile row of every level and the .dzi descriptor."""
+        if self._rows_received != self.height:
+            raise ValueError(f"Received {self._rows_received} rows of an image {self.height} rows high")
+        for level in range(self.max_level, -1, -1):
+            if self._buffers[level] is not None:
+                buffer, self._buffers[level] = self._buffers[level], None
+                self._emit(level, buffer)
+        with open(self.output_base + ".dzi", "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="0" '
+                    f'TileSize="{self.tile_size}"><Size Width="{self.width}" Height="{self.height}"/></Image>\n')
+
+
+@instrumentation.timed("pyramid.decode")
+def read_reduced(path, reduction):
+    """Decodes a JPEG at 1/reduction of its size; the JPEG decoder skips the discarded detail."""
+    return cv2.imread(path, _REDUCED_READ_FLAGS[reduction])
+
+
+def build_foil_pyramid(output_base, fov_paths, fms, reduction=4, tile_size=256, jpeg_quality=85):
+    """
+    Stitches the FOV images of one foil into a Deep Zoom pyramid and writes its FM overlay.
+
+    Args:
+        output_base (str): Path without extension of the .dzi, its tiles and '<output_base> overlay.json'.
+        fov_paths (dict): FOV number -> image path; FOV n sits in row (n-1)//5 and column (n-1)%5.
+            FOVs without an image stay black.
+        fms (pd.DataFrame): FM rows of the foil with ROW ID, FOV NUMBER, ROW INDEX, COLUMN INDEX,
+            POS X, POS Y (pixels of the FOV image) and FM SIZE.
+        reduction (int): 1, 2, 4 or 8; the stitched foil is 1/reduction of the full resolution.
+        tile_size (int): Tile edge in pixels.
+
+    Returns:
+        dict: Size of the stitched foil, FOV size, number of FOVs, missing FOVs and tiles.
+    """
+    if reduction not in _REDUCED_READ_FLAGS:
+        raise ValueError(f"reduction must be one of {sorted(_REDUCED_READ_FLAGS)}, got {reduction}")
+    if not fov_paths:
+        raise ValueError("No FOV images to stitch")
+
+    # The FOV size from a JPEG header, without decoding; the reduced decode rounds up
+    from ImageIndex import ImageIndex
+    full_size = None
+    for path in fov_paths.values():
+        full_size = ImageIndex.read_jpeg_size(path)
+        if full_size is not None:
+            break
+    if full_size is None:
+        raise ValueError("None of the FOV images is a readable JPEG")
+    fov_width = math.ceil(full_size[0] / reduction)
+    fov_height = math.ceil(full_size[1] / reduction)
+
+    fov_rows = max((fov_number - 1) // FOV_COLUMNS + 1 for fov_number in fov_paths)
+    if len(fms):
+        fov_rows = max(fov_rows, int(fms['ROW INDEX'].max()))
+    width, height = FOV_COLUMNS * fov_width, fov_rows * fov_height
+    writer = DeepZoomWriter(output_base, width, height, tile_size, jpeg_quality)
+
+    missing = []
+    for fov_row in range(fov_rows):
+        strip = np.zeros((fov_height, width, 3), dtype=np.uint8)
+        for fov_column in range(FOV_COLUMNS):
+            fov_number = fov_row * FOV_COLUMNS + fov_column + 1
+            image = read_reduced(fov_paths[fov_number], reduction) if fov_number in fov_paths else None
+            if image is None:
+                missing.append(fov_number)
+                continue
+            if image.shape[:2] != (fov_height, fov_width):
+                image = cv2.resize(image, (fov_width, fov_height), interpolation=cv2.INTER_AREA)
+            strip[:, fov_column * fov_width:(fov_column + 1) * fov_width] = image
+        writer.add_rows(strip)
+    writer.close()
+
+    overlay = {
+        "width": width,
+        "height": height,
+        "reduction": reduction,
+        "fov_width": fov_width,
+        "fov_height": fov_height,
+        "fms": [
+            {
+                "row_id": int(fm['ROW ID']),
+                "fov_number": int(fm['FOV NUMBER']),
+                "x": ((int(fm['COLUMN INDEX']) - 1) * full_size[0] + float(fm['POS X'])) / reduction,
+                "y": ((int(fm['ROW INDEX']) - 1) * full_size[1] + float(fm['POS Y'])) / reduction,
+                "size": float(fm['FM SIZE']) / reduction,
+                "top_bottom": fm['TOP BOTTOM'] if isinstance(fm.get('TOP BOTTOM'), str) else "",
+            }
+            for fm in fms.to_dict('records')
+        ],
+    }
+    with open(output_base + " overlay.json", "w", encoding="utf-8") as f:
+        json.dump(overlay, f)
+
+    return {"width": width, "height": height, "fov_width": fov_width, "fov_height": fov_height,
+            "fovs": len(fov_paths), "missing_fovs": missing, "tiles": writer.tiles_written}
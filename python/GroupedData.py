@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class GroupedData:
+    """
+    Sorts the FM data once by (STATE, FOIL, TOP BOTTOM, marker_category) and keeps
+    offset tables for every prefix of those keys. Any group, e.g. one state/foil or
+    one state/foil/TOP BOTTOM, is then a contiguous row range: slices are zero-copy
+    views and counts are O(1) instead of a full-length boolean mask per lookup.
+    Unclassified FMs (empty TOP BOTTOM) are grouped under ''.
+    """
+    GROUP_KEYS = ['STATE', 'FOIL', 'TOP BOTTOM', 'marker_category']
+    COORDINATE_COLUMNS = ['X PERCENTAGE', 'Y PERCENTAGE']
+
+    def __init__(self, data):
+        """
+        Args:
+            data (pd.DataFrame): FM data with the GROUP_KEYS and coordinate columns.
+        """
+        key_frame = data[self.GROUP_KEYS].reset_index(drop=True)
+        key_frame['TOP BOTTOM'] = key_frame['TOP BOTTOM'].fillna('')
+        key_frame = key_frame.sort_values(self.GROUP_KEYS, kind='stable')
+
+        self.data = data.iloc[key_frame.index.to_numpy()]
+        self.labels = self.data.index.to_numpy()
+        self.coords = np.ascontiguousarray(self.data[self.COORDINATE_COLUMNS].to_numpy(dtype=np.float32))
+        self._columns = {}
+
+        # --- Build the offset table of every key prefix in one pass per level ---
+        self._offsets = {(): (0, len(self.data))}
+        self._children = {}
+        key_arrays = [key_frame[key].to_numpy() for key in self.GROUP_KEYS]
+        n = len(self.data)
+        boundary = np.zeros(n, dtype=bool)
+        if n:
+            boundary[0] = True
+        for level, keys in enumerate(key_arrays, start=1):
+            boundary[1:] |= keys[1:] != keys[:-1]
+            starts = np.flatnonzero(boundary)
+            stops = np.append(starts[1:], n)
+            for start, stop in zip(starts, stops):
+                key = tuple(key_arrays[j][start] for j in range(level))
+                self._offsets[key] = (int(start), int(stop))
+                self._children.setdefault(key[:-1], []).append(key[-1])
+
+    def slice(self, *key):
+        """Returns the row slice of a group, e.g. slice(state, foil, 'top'). Missing groups give an empty slice."""
+        start, stop = self._offsets.get(key, (0, 0))
+        return slice(start, stop)
+
+    def count(self, *key):
+        start, stop = self._offsets.get(key, (0, 0))
+        return stop - start
+
+    def keys(self, *prefix):
+        """Returns the values of the next group key under a prefix, e.g. the TOP BOTTOM values of a state/foil."""
+        return list(self._children.get(prefix, []))
+
+    def frame(self, *key):
+        """Returns the rows of a group as a contiguous DataFrame slice."""
+        return self.data.iloc[self.slice(*key)]
+
+    def values(self, column, *key):
+        """Returns a zero-copy NumPy view of one column for a group."""
+        if column not in self._columns:
+            self._columns[column] = self.data[column].to_numpy()
+        return self._columns[column][self.slice(*key)]
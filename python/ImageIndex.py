@@ -0,0 +1,124 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("ImageIndex")
+
+
+class ImageIndex:
+    """
+    Index of the raw FOV images, built with a single walk of the data folder.
+
+    Expected layout: <raw folder>/<state>/<foil>/**/<name>.jpeg, where the third '_'-separated
+    part of the file name is the image type ('01' white, '02' red) and the last part of the
+    stem is the FOV number, e.g. 'ABC_123_01_..._7.jpeg'.
+
+    Replaces the per-FOV recursive glob of ImageProcesser._match_white_red_image and the
+    full-tree walk of ImageProcesser._match_all_name_white_images with dictionary lookups.
+    """
+    WHITE = '01'
+    RED = '02'
+
+    def __init__(self, raw_image_folder_path: str):
+        self.raw_image_folder_path = raw_image_folder_path
+        self._images: Dict[Tuple[str, str, int], Dict[str, str]] = {}
+        self._white_by_state: Dict[Tuple[str, int], List[str]] = {}
+        self.scan()
+
+    @staticmethod
+    def parse_image_name(filename: str) -> Optional[Tuple[str, int]]:
+        """Returns (image type, FOV number) of a raw image file name, or None if it does not follow the convention."""
+        if not filename.lower().endswith('.jpeg'):
+            return None
+        parts = filename.split('_')
+        if len(parts) < 3:
+            return None
+        try:
+            fov_number = int(os.path.splitext(filename)[0].split('_')[-1])
+        except ValueError:
+            return None
+        return parts[2], fov_number
+
+    @staticmethod
+    def read_jpeg_size(path: str) -> Optional[Tuple[int, int, int]]:
+        """
+        Returns (width, height, components) from the SOF header of a JPEG without decoding it,
+        or None if the file is not a readable JPEG. Only the marker segments before the frame
+        header are read, so this costs a few small reads per image.
+        """
+        try:
+            with open(path, 'rb') as f:
+                if f.read(2) != b'\xff\xd8':
+                    return None
+                while True:
+                    byte = f.read(1)
+                    while byte and byte != b'\xff':
+                        byte = f.read(1)
+                    while byte == b'\xff':
+                        byte = f.read(1)
+                    if not byte:
+                        return None
+                    marker = byte[0]
+                    if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                        continue  # Markers without a length
+                    if marker in (0xD9, 0xDA):
+                        return None  # End of image or start of scan before any frame header
+                    length_bytes = f.read(2)
+                    if len(length_bytes) < 2:
+                        return None
+                    length = int.from_bytes(length_bytes, 'big')
+                    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                        header = f.read(6)
+                        if len(header) < 6:
+                            return None
+                        height = int.from_bytes(header[1:3], 'big')
+                        width = int.from_bytes(header[3:5], 'big')
+                        return width, height, header[5]
+                    f.seek(length - 2, os.SEEK_CUR)
+        except OSError:
+            return None
+
+    @instrumentation.timed("image_index.scan")
+    def scan(self):
+        """(Re)builds the index from the raw image folder."""
+        self._images.clear()
+        self._white_by_state.clear()
+        if not self.raw_image_folder_path or not os.path.isdir(self.raw_image_folder_path):
+            logger.warning("Raw image folder '%s' not found, image index is empty.", self.raw_image_folder_path)
+            return
+
+        for root, dirs, files in os.walk(self.raw_image_folder_path):
+            dirs.sort()
+            relative_parts = os.path.relpath(root, self.raw_image_folder_path).split(os.sep)
+            if len(relative_parts) < 2 or relative_parts[0] == '.':
+                continue
+            state, foil = relative_parts[0], relative_parts[1]
+            for filename in sorted(files):
+                parsed = self.parse_image_name(filename)
+                if parsed is None:
+                    continue
+                image_type, fov_number = parsed
+                full_path = os.path.join(root, filename)
+                self._images.setdefault((state, foil, fov_number), {})[image_type] = full_path
+                if image_type == self.WHITE:
+                    self._white_by_state.setdefault((state, fov_number), []).append(full_path)
+
+    def match_white_red_image(self, state: str, foil: str, fov_number: int) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (white_image_path, red_image_path) of a FOV, with None for a missing image."""
+        images = self._images.get((str(state).strip(), str(foil).strip(), int(fov_number)), {})
+        return images.get(self.WHITE), images.get(self.RED)
+
+    def match_white_images(self, state: str, fov_number: int) -> List[str]:
+        """Returns the white image paths of one FOV number across all foils of a state."""
+        return list(self._white_by_state.get((str(state).strip(), int(fov_number)), []))
+
+    def fov_images(self, state: str, foil: str, image_type: str = WHITE) -> Dict[int, str]:
+        """Returns {FOV number: image path} of every FOV of a foil with an image of the given type."""
+        key_state, key_foil = str(state).strip(), str(foil).strip()
+        return {fov_number: images[image_type] for (image_state, image_foil, fov_number), images in self._images.items()
+                if image_state == key_state and image_foil == key_foil and image_type in images}
+
+    def __len__(self):
+        return len(self._images)
@@ -2,10 +2,17 @@ import numpy as np
 import cv2
 import os
 from typing import Union, List, Optional
-import logging
-import tkinter as tk
+
+from Instrumentation import instrumentation
+from PipelineLogging import get_logger
+
+logger = get_logger("ImageProcesser")
 
 class ImageProcesser:
+    # Width used by _resize_keep_aspect when no target width is given. Detected from the
+    # screen once and cached; the GUI sets it up front so worker threads never create a Tk root.
+    default_target_width = None
+
     def __init__(self, data):
         """
         Initialize the ImageProcesser with data and settings.
@@ -18,6 +25,7 @@ class ImageProcesser:
         
     
     @staticmethod
+    @instrumentation.timed("image.read")
     def _read_image(file_path: Union[str, List[str]]) -> Union[np.ndarray, List[np.ndarray]]:
         """
         Reads an image or up to 5 images from the specified path(s) using OpenCV.
@@ -39,6 +47,8 @@ class ImageProcesser:
             img = cv2.imread(file_path)
             if img is None:
                 raise ValueError(f"Failed to load image from {file_path}")
+            instrumentation.add("image.decoded_images")
+            instrumentation.add("image.decoded_bytes", img.nbytes)
             return img
         elif isinstance(file_path, list):
             # Limit to first 5 paths if more are provided
@@ -46,11 +56,14 @@ class ImageProcesser:
             images = [cv2.imread(path) for path in paths_to_read]
             if any(img is None for img in images):
                 raise ValueError("Failed to load one or more images from the provided paths")
+            instrumentation.add("image.decoded_images", len(images))
+            instrumentation.add("image.decoded_bytes", sum(img.nbytes for img in images))
             return images
         else:
             raise TypeError("file_path must be a string or a list of strings")
 
     @staticmethod
+    @instrumentation.timed("image.combine")
     def _combine_image(*images: 'np.ndarray', direction: str = "vertical") -> Optional['np.ndarray']:
         """
         Combines a sequence of images either vertically or horizontally.
@@ -69,11 +82,11 @@ class ImageProcesser:
         Raises:
             ValueError: If direction is not "vertical" or "horizontal", or if any input is not a valid numpy array.
         """
-        logging.info(f"Combining {len(images)} images in {direction} direction")
+        logger.debug("Combining %d images in %s direction", len(images), direction)
 
 
         if direction not in ["vertical", "horizontal"]:
-            logging.error(f"Invalid direction: {direction}. Must be 'vertical' or 'horizontal'.")
+            logger.error("Invalid direction: %s. Must be 'vertical' or 'horizontal'.", direction)
             raise ValueError("Direction must be 'vertical' or 'horizontal'.")
 
         max_width = 0
@@ -81,10 +94,10 @@ class ImageProcesser:
         processed_for_size_check = []
         for i, img in enumerate(images):
             if img is None:
-                logging.warning(f"Image {i+1} is None and will be skipped.")
+                logger.warning("Image %d is None and will be skipped.", i + 1)
                 continue
             if not isinstance(img, np.ndarray):
-                logging.error(f"Image {i+1} is not a numpy array, got type: {type(img)}")
+                logger.error("Image %d is not a numpy array, got type: %s", i + 1, type(img))
                 raise ValueError(f"Image {i+1} must be a numpy array, got {type(img)}")
             if img.ndim == 2:
                 img_3ch = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
@@ -93,7 +106,7 @@ class ImageProcesser:
             elif img.ndim == 3 and img.shape[2] == 3:
                 img_3ch = img
             else:
-                logging.error(f"Image {i+1} has an unsupported shape: {img.shape}")
+                logger.error("Image %d has an unsupported shape: %s", i + 1, img.shape)
                 raise ValueError(f"Image {i+1} has an unsupported shape: {img.shape}")
             processed_for_size_check.append(img_3ch)
             if direction == "vertical":
@@ -104,7 +117,7 @@ class ImageProcesser:
                     max_height = img_3ch.shape[0]
 
         if not processed_for_size_check:
-            logging.error("No valid images left to combine after validation.")
+            logger.error("No valid images left to combine after validation.")
             return None
 
         # Pad images to match max width (for vertical) or max height (for horizontal)
@@ -115,7 +128,7 @@ class ImageProcesser:
                 if w < max_width:
                     padding = max_width - w
                     padded_img = cv2.copyMakeBorder(img, 0, 0, 0, padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-                    logging.info(f"Padded image {i+1} with {padding} pixels to match max width {max_width}.")
+                    logger.debug("Padded image %d with %d pixels to match max width %d.", i + 1, padding, max_width)
                     padded_images.append(padded_img)
                 else:
                     padded_images.append(img)
@@ -123,7 +136,7 @@ class ImageProcesser:
                 if h < max_height:
                     padding = max_height - h
                     padded_img = cv2.copyMakeBorder(img, 0, padding, 0, 0, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-                    logging.info(f"Padded image {i+1} with {padding} pixels to match max height {max_height}.")
+                    logger.debug("Padded image %d with %d pixels to match max height %d.", i + 1, padding, max_height)
                     padded_images.append(padded_img)
                 else:
                     padded_images.append(img)
@@ -131,15 +144,16 @@ class ImageProcesser:
         # Stack images based on direction
         if direction == "vertical":
             combined_image = np.vstack(padded_images)
-            logging.info(f"Successfully combined {len(padded_images)} images vertically. Combined shape: {combined_image.shape}")
+            logger.debug("Successfully combined %d images vertically. Combined shape: %s", len(padded_images), combined_image.shape)
         else:  # horizontal
             combined_image = np.hstack(padded_images)
-            logging.info(f"Successfully combined {len(padded_images)} images horizontally. Combined shape: {combined_image.shape}")
+            logger.debug("Successfully combined %d images horizontally. Combined shape: %s", len(padded_images), combined_image.shape)
 
-        logging.info("Finished image combination.")
+        logger.debug("Finished image combination.")
         return combined_image
     
     @staticmethod
+    @instrumentation.timed("image.resize")
     def _resize_keep_aspect(image, target_width=None):
         """
         Resize an image to a target width while keeping aspect ratio.
@@ -150,10 +164,13 @@ class ImageProcesser:
         """
         # Get screen width if no target_width is given
         if target_width is None:
-            root = tk.Tk()
-            screen_width = root.winfo_screenwidth()
-            root.destroy()
-            target_width = int(screen_width * 0.5)  # Default 50% of screen width
+            if ImageProcesser.default_target_width is None:
+                import tkinter as tk
+                root = tk.Tk()
+                screen_width = root.winfo_screenwidth()
+                root.destroy()
+                ImageProcesser.default_target_width = int(screen_width * 0.5)  # Default 50% of screen width
+            target_width = ImageProcesser.default_target_width
 
         # Original dimensions
         orig_height, orig_width = image.shape[:2]
@@ -169,6 +186,7 @@ class ImageProcesser:
         return resized_image
     
     @staticmethod
+    @instrumentation.timed("image.overlay_text")
     def _overlay_text(text, image, position="top-left"):
         """
         Overlay text on an image with resolution-independent scaling.
@@ -224,6 +242,7 @@ class ImageProcesser:
 
 
     @staticmethod
+    @instrumentation.timed("image.crop")
     def _crop_image_base_on_coordinate(
         image_input: Union[np.ndarray, List[np.ndarray]],
         x: float,
@@ -287,95 +306,86 @@ class ImageProcesser:
             return crop_single_image(image_input)
 
     @staticmethod
-    def _combine_image_grid(*images: 'np.ndarray') -> Optional['np.ndarray']:
+    @instrumentation.timed("image.combine_grid")
+    def _combine_image_grid(*images: 'np.ndarray', rows: int = 2, cols: int = 3,
+                            cell_size: Optional[tuple] = None) -> Optional['np.ndarray']:
         """
-        Combines up to 6 images into a 2x3 grid. If fewer than 6 images are provided, or if any input is None,
-        the corresponding position is filled with a black image.
-        Grid layout:
+        Combines images into a rows x cols grid (2x3 by default). If fewer images than cells are provided,
+        or if any input is None, the corresponding cell is left black.
+        Default grid layout:
             Row 1: Image 1, Image 2, Image 3
             Row 2: Image 4, Image 5, Image 6
-        Images are padded with black to align dimensions to the widest width and tallest height among all valid images.
-        All images are converted to 3-channel BGR if they are not already.
+        The output canvas is allocated once and every image is written directly into its cell, so no padded
+        copies or intermediate row stacks are made. Cells are as wide as the widest and as tall as the tallest
+        valid image, unless cell_size is given, in which case each image is resized (keeping aspect) to fit it.
+        Grayscale images are broadcast to 3-channel BGR while they are written.
 
         Args:
-            *images: Up to 6 cv2 images (as numpy arrays). None inputs are replaced with black images.
+            *images: Up to rows * cols cv2 images (as numpy arrays). None inputs leave a black cell.
+            rows (int): Number of grid rows. Default is 2.
+            cols (int): Number of grid columns. Default is 3.
+            cell_size (tuple, optional): (width, height) of every cell in pixels.
 
         Returns:
-            np.ndarray: A single combined cv2 image in a 2x3 grid, or None if no valid images are provided and no black images are needed.
+            np.ndarray: A single combined cv2 image, or None if no valid images are provided.
 
         Raises:
-            ValueError: If more than 6 images are provided, or if any non-None input is not a valid numpy array.
+            ValueError: If more than rows * cols images are provided, or if any non-None input is not a valid numpy array.
         """
-        logging.info(f"Combining up to 6 images into a 2x3 grid, received {len(images)} images")
+        cell_count = rows * cols
+        logger.debug("Combining up to %d images into a %dx%d grid, received %d images", cell_count, rows, cols, len(images))
 
         # Validate number of images
-        if len(images) > 6:
-            logging.error(f"Expected up to 6 images, got {len(images)}")
-            raise ValueError("Up to 6 images can be provided")
+        if len(images) > cell_count:
+            logger.error("Expected up to %d images, got %d", cell_count, len(images))
+            raise ValueError(f"Up to {cell_count} images can be provided")
 
-        # Validate inputs and convert to 3-channel BGR, find max width and height
+        # Validate inputs and find max width and height
         max_width = 0
         max_height = 0
-        processed_images = []
-        for i, img in enumerate(images[:6]):  # Process only up to 6 images
+        for i, img in enumerate(images):
             if img is None:
-                logging.info(f"Image {i+1} is None, will be replaced with a black image")
-                processed_images.append(None)
+                logger.debug("Image %d is None, its cell will be left black", i + 1)
                 continue
             if not isinstance(img, np.ndarray):
-                logging.error(f"Image {i+1} is not a numpy array, got type: {type(img)}")
+                logger.error("Image %d is not a numpy array, got type: %s", i + 1, type(img))
                 raise ValueError(f"Image {i+1} must be a numpy array, got {type(img)}")
-            if img.ndim == 2:
-                img_3ch = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            elif img.ndim == 3 and img.shape[2] == 1:
-                img_3ch = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            elif img.ndim == 3 and img.shape[2] == 3:
-                img_3ch = img
-            else:
-                logging.error(f"Image {i+1} has an unsupported shape: {img.shape}")
+            if not (img.ndim == 2 or (img.ndim == 3 and img.shape[2] in (1, 3))):
+                logger.error("Image %d has an unsupported shape: %s", i + 1, img.shape)
                 raise ValueError(f"Image {i+1} has an unsupported shape: {img.shape}")
-            processed_images.append(img_3ch)
-            max_width = max(max_width, img_3ch.shape[1])
-            max_height = max(max_height, img_3ch.shape[0])
-
-        # If fewer than 6 images, fill remaining positions with None (for black images)
-        while len(processed_images) < 6:
-            logging.info(f"Filling position {len(processed_images)+1} with a black image (fewer than 6 images provided)")
-            processed_images.append(None)
+            max_width = max(max_width, img.shape[1])
+            max_height = max(max_height, img.shape[0])
 
         # If no valid images were provided, return None
-        if all(img is None for img in processed_images):
-            logging.error("No valid images provided to combine")
+        if max_width == 0 or max_height == 0:
+            logger.error("No valid images provided to combine")
             return None
 
-        # Pad images to match max width and max height, or create black images
-        padded_images = []
-        for i, img in enumerate(processed_images):
+        cell_width, cell_height = cell_size if cell_size is not None else (max_width, max_height)
+
+        # Allocate the output canvas once and write every image into its cell
+        combined_image = np.zeros((rows * cell_height, cols * cell_width, 3), dtype=np.uint8)
+        for i, img in enumerate(images):
             if img is None:
-                black_image = np.zeros((max_height, max_width, 3), dtype=np.uint8)
-                logging.info(f"Created black image for position {i+1} with shape: {black_image.shape}")
-                padded_images.append(black_image)
+                continue
+            h, w = img.shape[:2]
+            if cell_size is not None and (w > cell_width or h > cell_height or (w < cell_width and h < cell_height)):
+                scale = min(cell_width / w, cell_height / h)
+                w, h = max(1, int(w * scale)), max(1, int(h * scale))
+                img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+            y = (i // cols) * cell_height
+            x = (i % cols) * cell_width
+            cell = combined_image[y:y + h, x:x + w]
+            if img.ndim == 2:
+                cell[:] = img[:, :, np.newaxis]
             else:
-                h, w, _ = img.shape
-                pad_right = max_width - w
-                pad_bottom = max_height - h
-                if pad_right > 0 or pad_bottom > 0:
-                    padded_img = cv2.copyMakeBorder(img, 0, pad_bottom, 0, pad_right, cv2.BORDER_CONSTANT, value=[0, 0, 0])
-                    logging.info(f"Padded image {i+1} with {pad_right} right and {pad_bottom} bottom pixels")
-                    padded_images.append(padded_img)
-                else:
-                    padded_images.append(img)
-
-        # Arrange images in 2x3 grid
-        row1 = np.hstack([padded_images[0], padded_images[1], padded_images[2]])
-        row2 = np.hstack([padded_images[3], padded_images[4], padded_images[5]])
-        combined_image = np.vstack([row1, row2])
-        logging.info(f"Successfully combined images into 2x3 grid. Combined shape: {combined_image.shape}")
+                cell[:] = img.reshape(h, w, -1)
 
-        logging.info("Finished grid image combination")
+        logger.debug("Successfully combined images into %dx%d grid. Combined shape: %s", rows, cols, combined_image.shape)
         return combined_image
 
     @staticmethod
+    @instrumentation.timed("image.save")
     def _save_image_to_folder(save_folder, plot_image, title):
         """
         Saves a plot image to a specified folder with a dynamically generated filename.
@@ -392,7 +402,9 @@ class ImageProcesser:
         filename = f"{title}.png"
         full_path = os.path.join(save_folder, filename)
         cv2.imwrite(full_path, plot_image)
-        print(f" Image successfully saved to: {full_path}")
+        if instrumentation.enabled:
+            instrumentation.add("image.written_bytes", os.path.getsize(full_path))
+        logger.debug("Image successfully saved to: %s", full_path)
 
     @staticmethod
     def _show_image(image: 'np.ndarray', window_name: str = "Image Display", wait_time: int = 0, scale_resize = 1) -> None:
@@ -411,14 +423,15 @@ class ImageProcesser:
         Raises:
             ValueError: If the input image is not a valid numpy array.
         """
-        logging.info(f"Preparing to display image in window: {window_name}")
+        logger.info("Preparing to display image in window: %s", window_name)
         if not isinstance(image, np.ndarray) or image.ndim not in [2, 3]:
             msg = "Input must be a 2D or 3D numpy array representing an image."
-            logging.error(msg)
+            logger.error(msg)
             raise ValueError(msg)
 
         try:
             # --- DYNAMIC SCREEN SIZE DETECTION ---
+            import tkinter as tk
             root = tk.Tk()
             root.withdraw()
             screen_width = root.winfo_screenwidth()
@@ -458,7 +471,7 @@ class ImageProcesser:
                 if event == cv2.EVENT_LBUTTONDOWN:  # Left click - continue
                     mouse_clicked = True
                 elif event == cv2.EVENT_RBUTTONDOWN:  # Right click - mark to exit
-                    logging.info("Right-click detected. Will exit after processing.")
+                    logger.info("Right-click detected. Will exit after processing.")
                     nonlocal exit_program
                     exit_program = True
 
@@ -478,10 +491,10 @@ class ImageProcesser:
                     if cv2.waitKey(1) != -1 or mouse_clicked:
                         break
 
-            logging.info(f"Closing window: {window_name}")
+            logger.info("Closing window: %s", window_name)
 
             if exit_program:
-                logging.info("Exiting program due to right-click.")
+                logger.info("Exiting program due to right-click.")
                 import sys
                 sys.exit(0)
 
@@ -0,0 +1,139 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _NullTimer:
+    """Shared do-nothing context manager returned while instrumentation is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _percentile(sorted_values, q):
+    """Linear-interpolated percentile of a sorted, non-empty list (same as numpy's default)."""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class Instrumentation:
+    """
+    Timers and counters around the hot spots of a Dakar run (image decode, crop, combine,
+    encode/write, Excel I/O, plotting, state comparison).
+
+    Disabled by default: timer() then returns a shared no-op context manager, timed() functions
+    call straight through and add() returns immediately, so the calls left in the hot paths cost
+    one attribute check. When enabled, every timer keeps its individual samples so the report
+    can give p50/p95, e.g. per FM.
+    Safe to use from the crop worker threads.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counters = {}
+        self._started = time.perf_counter()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        """Drops every sample and counter, e.g. at the start of a pipeline run."""
+        with self._lock:
+            self._samples = {}
+            self._counters = {}
+            self._started = time.perf_counter()
+
+    def timer(self, name: str):
+        """
+        Returns a context manager that records the duration of its block under 'name'.
+
+        Example:
+            with instrumentation.timer("image.read"):
+                img = cv2.imread(path)
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timed(name)
+
+    def timed(self, name: str):
+        """Decorator recording every call of a function under 'name', see timer()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._samples.setdefault(name, []).append(seconds)
+
+    def add(self, name: str, value=1):
+        """Adds to a counter, e.g. add("image.decoded_bytes", img.nbytes)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        """Returns the totals, count, mean, p50, p95 and max (seconds) of every timer and the counters."""
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            counters = dict(self._counters)
+        timers = {}
+        for name, values in sorted(samples.items()):
+            values.sort()
+            total = sum(values)
+            timers[name] = {
+                "count": len(values),
+                "total": total,
+                "mean": total / len(values),
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "max": values[-1],
+            }
+        return {
+            "wall_seconds": time.perf_counter() - self._started,
+            "timers": timers,
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def save(self, path: str, **extra) -> dict:
+        """Writes the report, with any extra keys (e.g. the stage results), as JSON and returns it."""
+        report = self.report()
+        report.update(extra)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+        return report
+
+
+# Process-wide instance used by Dakar, ImageProcesser, ImageIndex and Plotter
+instrumentation = Instrumentation()
@@ -0,0 +1,74 @@
+import queue
+import threading
+import time
+
+from PipelineLogging import get_logger
+
+logger = get_logger("JobProgress")
+
+
+class JobCancelled(Exception):
+    """Raised inside a running Dakar function when its job has been cancelled."""
+
+
+class ProgressReporter:
+    """
+    Thread-safe progress channel between a running Dakar function and whoever watches it.
+    The worker calls start_phase/advance and checks for cancellation between work units
+    (FOVs, foils); the watcher polls the queue of progress snapshots, e.g. from the Tk loop.
+    """
+    def __init__(self, progress_queue: queue.Queue = None, cancel_event: threading.Event = None):
+        """
+        Args:
+            progress_queue (queue.Queue, optional): Receives a snapshot dict after every update.
+                If None, progress is only tracked, not published.
+            cancel_event (threading.Event, optional): Set by the watcher to request cancellation.
+        """
+        self.progress_queue = progress_queue
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.phase = None
+        self.done = 0
+        self.total = 0
+        self._phase_start = time.perf_counter()
+
+    def start_phase(self, phase, total):
+        """Starts a new phase of 'total' work units, e.g. the FOVs of a crop run."""
+        self.phase = phase
+        self.done = 0
+        self.total = total
+        self._phase_start = time.perf_counter()
+        logger.info("Starting '%s' with %d work units", phase, total)
+        self._publish()
+
+    def advance(self, count=1):
+        self.done += count
+        self._publish()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Raises JobCancelled if cancellation was requested. Called between work units."""
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Cancelled during '{self.phase}' after {self.done}/{self.total} work units")
+
+    def snapshot(self):
+        """Returns the current phase, done/total, rate (units per second) and ETA (seconds)."""
+        elapsed = time.perf_counter() - self._phase_start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = remaining / rate if rate > 0 else None
+        return {
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "rate": rate,
+            "eta": eta,
+        }
+
+    def _publish(self):
+        if self.progress_queue is not None:
+            self.progress_queue.put(self.snapshot())
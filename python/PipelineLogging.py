@@ -0,0 +1,160 @@
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT_LOGGER_NAME = "dakar"
+
+_configure_lock = threading.Lock()
+_configured = False
+_installed_handlers = []
+_module_levels = []
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns the logger of a pipeline module, e.g. get_logger("ImageProcesser") -> 'dakar.ImageProcesser'.
+    Installs the default configuration (INFO to the console) the first time it is called,
+    so modules used on their own still print their messages.
+
+    Use lazy %-formatting, logger.debug("Combined shape: %s", image.shape), so messages below
+    the active level are never formatted.
+    """
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Prints messages like the pipeline's former print() calls, prefixing warnings and errors with their level."""
+    def format(self, record):
+        message = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            message = f"{record.levelname.capitalize()}: {message}"
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        return message
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line: time, level, logger, thread and message,
+    plus the structured fields passed as extra={"fields": {...}}.
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _to_level(level):
+    if isinstance(level, int):
+        return level
+    resolved = logging.getLevelName(str(level).upper())
+    if not isinstance(resolved, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return resolved
+
+
+def configure_logging(level="INFO", module_levels=None, json_lines_path=None, console=True):
+    """
+    (Re)configures the 'dakar' loggers. Calling it again replaces the previous configuration.
+
+    Args:
+        level (str | int): Level of all pipeline modules, e.g. "INFO" or "DEBUG".
+        module_levels (dict, optional): Per-module overrides, e.g. {"ImageProcesser": "DEBUG"}.
+        json_lines_path (str, optional): Also append every record as a JSON line to this file.
+        console (bool): Print the records to stdout.
+    """
+    global _configured
+    with _configure_lock:
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in _installed_handlers:
+            root.removeHandler(handler)
+            handler.close()
+        _installed_handlers.clear()
+        for name in _module_levels:
+            logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}").setLevel(logging.NOTSET)
+        _module_levels.clear()
+
+        root.setLevel(_to_level(level))
+        # The pipeline output does not go through the application's root logger handlers
+        root.propagate = False
+
+        if console:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(ConsoleFormatter())
+            _installed_handlers.append(console_handler)
+        if json_lines_path:
+            file_handler = logging.FileHandler(json_lines_path, mode="a", encoding="utf-8")
+            file_handler.setFormatter(JsonLinesFormatter())
+            _installed_handlers.append(file_handler)
+        for handler in _installed_handlers:
+            root.addHandler(handler)
+
+        for name, module_level in (module_levels or {}).items():
+            logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}").setLevel(_to_level(module_level))
+            _module_levels.append(name)
+        _configured = True
+
+
+class RateLimitedProgress:
+    """
+    Counts repeated events, e.g. saved crops, and logs a summary at most every 'interval'
+    seconds instead of one line per event, plus a final total on close().
+
+    Example:
+        saved = RateLimitedProgress(logger, "Saved %d crops")
+        for fov in fovs:
+            saved.update(len(crop(fov)))
+        saved.close()
+    """
+    def __init__(self, logger: logging.Logger, message: str, interval: float = 5.0, level=logging.INFO):
+        """
+        Args:
+            logger (logging.Logger): Logger the summaries go to.
+            message (str): %-format with one %d placeholder for the count so far.
+            interval (float): Minimum seconds between two summaries.
+            level (int): Level of the summaries.
+        """
+        self.logger = logger
+        self.message = message
+        self.interval = interval
+        self.level = level
+        self.count = 0
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_emit = self._start
+
+    def update(self, count=1):
+        with self._lock:
+            self.count += count
+            now = time.perf_counter()
+            if now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+        self._emit(now)
+
+    def close(self):
+        self._emit(time.perf_counter(), final=True)
+
+    def _emit(self, now, final=False):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        elapsed = now - self._start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        suffix = " in total" if final else " so far"
+        self.logger.log(self.level, self.message + suffix + " (%.1f/s)", self.count, rate,
+                        extra={"fields": {"count": self.count, "rate": rate, "final": final}})
@@ -1,9 +1,14 @@
 import numpy as np
+import pandas as pd
+from matplotlib.colors import to_rgb
 from matplotlib.lines import Line2D
 from matplotlib import pyplot as plt
 import cv2
-from scipy.spatial import KDTree
 from tkinter_app.settings import PlotterSettings
+from SpatialIndexCache import SpatialIndexCache
+from GroupedData import GroupedData
+from SummaryPanelRenderer import SummaryPanelRenderer
+from Instrumentation import instrumentation
 
 
 class Plotter:
@@ -12,19 +17,38 @@ class Plotter:
     It handles the business rule of mapping 'FM Size' to specific
     marker shapes as defined in its configuration.
     """
-    def __init__(self, data, settings: PlotterSettings):
+    def __init__(self, data, settings: PlotterSettings, index_cache: SpatialIndexCache = None):
         """
         Initialize the PLotter with data and settings.
 
         Args:
             data: The data to plot
             settings: PlotterSettings containing plot configuration
+            index_cache: Optional SpatialIndexCache to reuse, e.g. one persisted next to the analysis
         """
         self.settings = settings
         self.background_image_path = self.settings.background_image_path
         self._base_legend_elements = self._build_base_legend()
         self.title = None
-        self.data = self._assign_marker_category(data)
+        self.index_cache = index_cache if index_cache is not None else SpatialIndexCache()
+        self.summary_renderer = None
+        self.set_data(data)
+
+    def set_data(self, data):
+        """
+        Replaces the working dataset. Cached spatial indexes built for the
+        previous dataset are invalidated. Data without a TOP BOTTOM column, e.g.
+        straight from combine_csv, is treated as all unclassified ('').
+        """
+        if 'TOP BOTTOM' not in data.columns:
+            data = data.assign(**{'TOP BOTTOM': ''})
+        self.groups = GroupedData(self._assign_marker_category(data))
+        self.data = self.groups.data
+        self.index_cache.set_data_version(SpatialIndexCache.compute_data_version(self.data))
+
+    def _get_spatial_index(self, state, foil, top_bottom):
+        """Returns the cached (index labels, coordinates, KDTree) of one state/foil/TOP BOTTOM group."""
+        return self.index_cache.get(self.groups, state, foil, top_bottom)
 
     def _assign_marker_category(self, data):
         """
@@ -41,9 +65,9 @@ class Plotter:
             # If no other category matched, return 'other'
             return 'other'
 
-        # Create a new column with the assigned category for each point
-        data['marker_category'] = data['FM SIZE'].apply(get_category)
-        return data
+        # Create a new column with the assigned category for each point, leaving the
+        # caller's frame untouched since Dakar shares it across pipeline stages
+        return data.assign(marker_category=data['FM SIZE'].apply(get_category))
 
     def _build_base_legend(self):
         legend_elements = [
@@ -71,11 +95,58 @@ class Plotter:
             ax.scatter(group['X PERCENTAGE'], group['Y PERCENTAGE'], s=marker_size,
                        marker=marker_style, c=color, zorder=10)
 
-    def _generate_plot(self, title, data):
+    def _use_density(self, point_count):
+        """Whether to draw the points as a density heatmap, per the 'density' settings."""
+        mode = self.settings.density.get('mode', 'auto')
+        if mode == 'auto':
+            return point_count > self.settings.density.get('threshold', 5000)
+        return mode == 'density'
+
+    @instrumentation.timed("plotter.density")
+    def _density_counts(self, plot_data):
+        """
+        Bins the top and bottom points into 2D histograms in one vectorized pass: every point
+        gets a flat (layer, row, column) bin code and a single np.bincount counts them all.
+
+        Returns:
+            np.ndarray: Counts shaped (2, y bins, x bins), top in layer 0 and bottom in layer 1.
+        """
+        x_bins, y_bins = (int(bins) for bins in self.settings.density['bins'])
+        top_bottom = plot_data['TOP BOTTOM'].to_numpy()
+        layer = np.where(top_bottom == 'top', 0, np.where(top_bottom == 'bottom', 1, -1))
+        x = plot_data['X PERCENTAGE'].to_numpy(dtype=float)
+        y = plot_data['Y PERCENTAGE'].to_numpy(dtype=float)
+        keep = (layer >= 0) & np.isfinite(x) & np.isfinite(y)
+
+        columns = np.clip((x[keep] * x_bins).astype(np.int64), 0, x_bins - 1)
+        rows = np.clip((y[keep] * y_bins).astype(np.int64), 0, y_bins - 1)
+        codes = (layer[keep] * y_bins + rows) * x_bins + columns
+        return np.bincount(codes, minlength=2 * y_bins * x_bins).reshape(2, y_bins, x_bins)
+
+    def _plot_density(self, ax, plot_data):
+        """Draws the top and bottom points as heatmaps in their point colors over the background."""
+        max_alpha = self.settings.density.get('max_alpha', 0.85)
+        counts = self._density_counts(plot_data)
+        for layer_counts, color_key in zip(counts, ('top_color', 'bottom_color')):
+            if not layer_counts.any():
+                continue
+            rgba = np.zeros(layer_counts.shape + (4,))
+            rgba[..., :3] = to_rgb(self.settings.points[color_key])
+            # Log scale, so isolated FMs stay visible next to dense clusters
+            rgba[..., 3] = max_alpha * np.log1p(layer_counts) / np.log1p(layer_counts.max())
+            ax.imshow(rgba, extent=[0, 1, 1, 0], aspect='auto', interpolation='nearest', zorder=10)
+
+    @instrumentation.timed("plotter.render")
+    def _generate_plot(self, title, data, counts=None):
         """
         Categorizes data based on FM Size and generates a plot.
+
+        Args:
+            title (str): Plot title.
+            data (pd.DataFrame): Points to plot.
+            counts (tuple, optional): Precomputed (top_count, bottom_count). Counted from the data if None.
         """
-        plot_data = data.copy()
+        plot_data = data
         fig, ax = plt.subplots(figsize=self.settings.figure['figsize'])
         fig.subplots_adjust(left=self.settings.figure['margin_left'])
 
@@ -83,7 +154,10 @@ class Plotter:
         ax.imshow(img, extent=[0, 1, 1, 0], aspect='auto', zorder=1)
         ax.set_title(title, fontweight='bold', fontsize=16)
 
-        if not plot_data.empty:
+        density = not plot_data.empty and self._use_density(len(plot_data))
+        if density:
+            self._plot_density(ax, plot_data)
+        elif not plot_data.empty:
             # Group by 'Top-Bottom' for coloring
             for group_name, group_data in plot_data.groupby('TOP BOTTOM'):
                 if group_name == 'top':
@@ -93,13 +167,17 @@ class Plotter:
                     color = self.settings.points['bottom_color']
                     self._plot_points(ax, group_data, color)
 
-        top_count = len(plot_data[plot_data['TOP BOTTOM'] == 'top'])
-        bottom_count = len(plot_data[plot_data['TOP BOTTOM'] == 'bottom'])
+        if counts is None:
+            top_bottom_counts = plot_data['TOP BOTTOM'].value_counts()
+            counts = (int(top_bottom_counts.get('top', 0)), int(top_bottom_counts.get('bottom', 0)))
+        top_count, bottom_count = counts
         summary_text = (f"--- Summary ---\nTop Points:    {top_count}\n"
                         f"Bottom Points: {bottom_count}\nTotal Points:  {top_count + bottom_count}")
 
         legend_cfg = self.settings.legend
-        ax.legend(handles=self._base_legend_elements,
+        # The marker shapes of the size categories do not apply to a heatmap
+        legend_elements = self._base_legend_elements[:2] if density else self._base_legend_elements
+        ax.legend(handles=legend_elements,
                  loc=legend_cfg['location'],
                  bbox_to_anchor=legend_cfg['anchor'],
                  fontsize=legend_cfg['fontsize'],
@@ -120,64 +198,206 @@ class Plotter:
         plt.close(fig)
         return bgr_array, title, top_count, bottom_count
 
+    @staticmethod
+    def _match_nearest(kdtree, coords_after, tolerance, priority=None):
+        """
+        Greedily matches each 'after' point to its nearest 'before' point in the KD-tree.
+        A 'before' point can only be claimed once; the first 'after' point within
+        tolerance wins it. 'First' follows the priority array when given (e.g. the
+        original row labels), otherwise the order of coords_after.
+
+        Returns:
+            np.ndarray: For each 'after' point, the position of its matched 'before'
+                point in the tree data, or -1 if it has no match.
+        """
+        matches = np.full(len(coords_after), -1, dtype=np.int64)
+        if len(coords_after) == 0:
+            return matches
+        distances, closest_indices = kdtree.query(coords_after, k=1)
+        within = np.flatnonzero(distances <= tolerance)
+        if priority is not None:
+            within = within[np.argsort(priority[within], kind='stable')]
+        # np.unique returns the first occurrence, which is the lowest 'after' position
+        _, first = np.unique(closest_indices[within], return_index=True)
+        winners = within[first]
+        matches[winners] = closest_indices[winners]
+        return matches
+
+    @instrumentation.timed("plotter.compare_states")
     def _compare_states(self, name_filter, state_before, state_after, tolerance=0.02):
         """
         Compares two states using a spatial tolerance for x/y coordinates.
         Returns the added, removed, and stayed points as three separate DataFrames.
         """
         names_to_filter = name_filter if isinstance(name_filter, list) else [name_filter]
-        data_before = self.data[(self.data['FOIL'].isin(names_to_filter)) & (self.data['STATE'] == state_before)].copy()
-        data_after = self.data[(self.data['FOIL'].isin(names_to_filter)) & (self.data['STATE'] == state_after)].copy()
-        exact_match_keys = ['FOIL', 'TOP BOTTOM']
-        matched_before_indices = set()
-        matched_after_indices = set()
-        grouped_before = data_before.groupby(exact_match_keys)
-        grouped_after = data_after.groupby(exact_match_keys)
-
-        for group_keys, after_group in grouped_after:
-            if group_keys not in grouped_before.groups:
-                continue
-            before_group = grouped_before.get_group(group_keys)
-            if before_group.empty or after_group.empty:
-                continue
-            coords_before = before_group[['X PERCENTAGE', 'Y PERCENTAGE']].values
-            coords_after = after_group[['X PERCENTAGE', 'Y PERCENTAGE']].values
-            kdtree = KDTree(coords_before)
-            distances, closest_indices = kdtree.query(coords_after, k=1)
-            used_before_indices = set()
-            for i, (dist, closest_idx) in enumerate(zip(distances, closest_indices)):
-                if dist <= tolerance and closest_idx not in used_before_indices:
-                    matched_after_indices.add(after_group.index[i])
-                    matched_before_indices.add(before_group.index[closest_idx])
-                    used_before_indices.add(closest_idx)
-
-        removed_indices = set(data_before.index) - matched_before_indices
-        removed_points = data_before.loc[list(removed_indices)]
-        added_indices = set(data_after.index) - matched_after_indices
-        added_points = data_after.loc[list(added_indices)]
-        stay_points = data_after.loc[list(matched_after_indices)]
+        empty = self.groups.labels[:0]
+        added_labels, removed_labels, stay_labels = [empty], [empty], [empty]
+
+        for foil in names_to_filter:
+            top_bottoms = set(self.groups.keys(state_before, foil)) | set(self.groups.keys(state_after, foil))
+            for top_bottom in top_bottoms:
+                before_labels, _, kdtree = self._get_spatial_index(state_before, foil, top_bottom)
+                after_labels, coords_after, _ = self._get_spatial_index(state_after, foil, top_bottom)
+                matches = np.full(len(after_labels), -1, dtype=np.int64)
+                # Unclassified FMs are never matched, they count as removed/added
+                if top_bottom != '' and kdtree is not None:
+                    matches = self._match_nearest(kdtree, coords_after, tolerance, priority=after_labels)
+                matched = matches >= 0
+                before_matched = np.zeros(len(before_labels), dtype=bool)
+                before_matched[matches[matched]] = True
+
+                added_labels.append(after_labels[~matched])
+                removed_labels.append(before_labels[~before_matched])
+                stay_labels.append(after_labels[matched])
+
+        added_points = self.data.loc[np.concatenate(added_labels)]
+        removed_points = self.data.loc[np.concatenate(removed_labels)]
+        stay_points = self.data.loc[np.concatenate(stay_labels)]
         return added_points, removed_points, stay_points
 
+    @instrumentation.timed("plotter.foil_coincidences")
+    def count_foil_coincidences(self, tolerance=0.005):
+        """
+        Counts, for every FM, the other foils of its state that have an FM within tolerance
+        of it, by querying the KD-trees of the other foils with all FMs of a foil at once.
+        An FM found at the same place on the other foils is likely background (e.g. dirt on
+        the optics) rather than on the foil. FMs of every TOP BOTTOM class are matched.
+
+        Args:
+            tolerance (float): Maximum X/Y PERCENTAGE distance for two FMs to coincide.
+
+        Returns:
+            pd.Series: Number of other foils, indexed by the row labels of the data.
+        """
+        counts = np.zeros(len(self.groups.labels), dtype=np.int64)
+        for state in self.groups.keys():
+            foils = self.groups.keys(state)
+            for foil in foils:
+                foil_slice = self.groups.slice(state, foil)
+                coords = self.groups.coords[foil_slice]
+                for other_foil in foils:
+                    if other_foil == foil:
+                        continue
+                    coincides = np.zeros(len(coords), dtype=bool)
+                    for top_bottom in self.groups.keys(state, other_foil):
+                        _, _, kdtree = self._get_spatial_index(state, other_foil, top_bottom)
+                        distances, _ = kdtree.query(coords, k=1, distance_upper_bound=tolerance)
+                        coincides |= distances <= tolerance
+                    counts[foil_slice] += coincides
+        return pd.Series(counts, index=self.groups.labels)
+
+    @instrumentation.timed("plotter.count_changes")
+    def count_changes(self, foil, state_before, state_after, changes=None, tolerance=0.02):
+        """
+        Counts the FMs of one foil before, after, added, removed and stayed, per TOP BOTTOM
+        and marker category, without rendering anything.
+
+        Args:
+            foil (str): Foil to compare.
+            state_before, state_after (str): States to compare.
+            changes (tuple, optional): (added, removed, stayed) from _compare_states, compared here if None.
+            tolerance (float): Maximum X/Y PERCENTAGE distance for two FMs to be the same FM.
+
+        Returns:
+            pd.DataFrame: One row per (TOP BOTTOM, marker_category) with FOIL, BEFORE, AFTER,
+                ADDED, REMOVED and STAYED counts; unclassified FMs under TOP BOTTOM ''.
+        """
+        if changes is None:
+            changes = self._compare_states(foil, state_before, state_after, tolerance)
+        parts = dict(zip(['BEFORE', 'AFTER', 'ADDED', 'REMOVED', 'STAYED'],
+                         [self.groups.frame(state_before, foil), self.groups.frame(state_after, foil), *changes]))
+        counts = pd.DataFrame({
+            name: part.groupby([part['TOP BOTTOM'].fillna(''), part['marker_category']]).size()
+            for name, part in parts.items()
+        }).fillna(0).astype(int)
+        counts.index.names = ['TOP BOTTOM', 'marker_category']
+        counts = counts.reset_index()
+        counts.insert(0, 'FOIL', foil)
+        return counts
+
+    @instrumentation.timed("plotter.track_states")
+    def track_FM_across_states(self, name_filter, states, tolerance=0.02):
+        """
+        Chains FM identities through an ordered sequence of states in a single pass.
+        One KD-tree is built per (state, foil, TOP BOTTOM) group and each state is
+        matched against the previous one, so an FM keeps its track ID for as long as
+        it is found again in the next state.
+
+        Args:
+            name_filter (str | list): Foil name or list of foil names to track.
+            states (list): Ordered list of state names, e.g. ['BeforeCutState', 'AfterCutState'].
+            tolerance (float): Maximum X/Y PERCENTAGE distance for two FMs to be the same FM.
+
+        Returns:
+            pd.DataFrame: One row per track with FOIL, TOP BOTTOM, FIRST SEEN, LAST SEEN,
+                STATES SEEN and one column per state holding the ROW ID of the FM in that state.
+        """
+        names_to_filter = name_filter if isinstance(name_filter, list) else [name_filter]
+
+        # --- Fetch one spatial index per (state, foil, TOP BOTTOM) group ---
+        # Unclassified FMs (TOP BOTTOM '') are chained among themselves instead of being dropped
+        indexes = {}
+        for state in states:
+            for foil in names_to_filter:
+                for top_bottom in self.groups.keys(state, foil):
+                    labels, coords, kdtree = self._get_spatial_index(state, foil, top_bottom)
+                    # Row IDs from the labels of the cached entry, so they always pair with its coordinates
+                    row_ids = self.data.loc[labels, 'ROW ID'].to_numpy()
+                    indexes[(state, foil, top_bottom)] = (row_ids, coords, kdtree)
+
+        # --- Chain consecutive states, carrying track IDs forward ---
+        track_rows = []
+        group_keys = sorted({(foil, top_bottom) for _, foil, top_bottom in indexes}, key=str)
+        for foil, top_bottom in group_keys:
+            previous = None
+            for state in states:
+                current = indexes.get((state, foil, top_bottom))
+                if current is None:
+                    previous = None
+                    continue
+                row_ids, coords, _ = current
+                tracks = np.empty(len(row_ids), dtype=np.int64)
+                matches = (self._match_nearest(previous[2], coords, tolerance, priority=row_ids)
+                           if previous is not None else np.full(len(row_ids), -1))
+                for i, match in enumerate(matches):
+                    if match >= 0:
+                        tracks[i] = previous[3][match]
+                    else:
+                        tracks[i] = len(track_rows)
+                        track_rows.append({'FOIL': foil, 'TOP BOTTOM': top_bottom})
+                    track_rows[tracks[i]][state] = row_ids[i]
+                previous = (row_ids, coords, current[2], tracks)
+
+        track_table = pd.DataFrame(track_rows, columns=['FOIL', 'TOP BOTTOM'] + list(states))
+        track_table[list(states)] = track_table[list(states)].astype('Int64')
+        presence = track_table[list(states)].notna()
+        track_table.insert(0, 'TRACK ID', np.arange(1, len(track_table) + 1))
+        track_table['FIRST SEEN'] = presence.idxmax(axis=1)
+        track_table['LAST SEEN'] = presence.iloc[:, ::-1].idxmax(axis=1)
+        track_table['STATES SEEN'] = presence.sum(axis=1)
+        return track_table
+
     def create_FM_position_plot(self,state,foil):
         """
         Filters data based on all criteria and tells the plotter to generate an image.
         The name_filter can be a single string or a list of strings.
         """
-        filtered_data = self.data[
-            (self.data['STATE'] == state) &
-            (self.data['FOIL'] == foil) 
-        ]
+        filtered_data = self.groups.frame(state, foil)
+        counts = (self.groups.count(state, foil, 'top'), self.groups.count(state, foil, 'bottom'))
 
         plot_title = f"State: {state} | Foil: {foil} |"
 
-        return self._generate_plot(plot_title, filtered_data)
+        return self._generate_plot(plot_title, filtered_data, counts)
 
-    def create_FM_change_plots(self, name_filter, state_before, state_after):
+    def create_FM_change_plots(self, name_filter, state_before, state_after, changes=None):
         """
         Generates plots for added, removed, and stayed points using a
         more concise, loop-based approach.
+        The (added, removed, stayed) points are compared here unless changes are given.
         """
-        added_points, removed_points, stay_points = self._compare_states(name_filter, state_before, state_after)
+        if changes is None:
+            changes = self._compare_states(name_filter, state_before, state_after)
+        added_points, removed_points, stay_points = changes
         plot_data_map = {"Added": added_points, "Removed": removed_points, "Stayed": stay_points}
 
         plots = []
@@ -190,10 +410,12 @@ class Plotter:
             plots.append((plot_image, title, top, bottom))
         return plots
 
+    @instrumentation.timed("plotter.summary_panel")
     def create_changed_summary_plot(self, before, after, added, removed, stayed, name, state1, state2):
         """
         Generates a single summary image with a text report and a refined 3-bar chart.
-        The bar width is controlled, and the stacked bar has individual labels.
+        The static parts of the panel are rendered once per run by the
+        SummaryPanelRenderer; only the numbers and bar heights are drawn per foil.
         The final image dimensions match the input plot images.
         """
         # --- Step 1: Unpack all the data and calculate totals ---
@@ -209,14 +431,7 @@ class Plotter:
         removed_total = removed_top_count + removed_bottom_count
         stay_total = stay_top_count + stay_bottom_count
 
-        # --- Step 2: Create the main figure canvas ---
-        height, width, _ = before_image.shape
-        dpi = 100
-        fig, ax = plt.subplots(figsize=(width / dpi, height / dpi), dpi=dpi)
-        fig.patch.set_facecolor('white')
-        ax.axis('off')
-
-        # --- Step 3: Place the formatted text on the TOP half ---
+        # --- Step 2: Format the text report for the TOP half ---
         report_text = (
             f"Analysis Report for: {name}\n"
             f"Transition: {state1} -> {state2}\n"
@@ -228,61 +443,10 @@ class Plotter:
             f"Removed: Top: {removed_top_count:>4} | Bottom: {removed_bottom_count:>4} | Total: {removed_total:>4}\n"
             f"Added:   Top: {add_top_count:>4} | Bottom: {add_bottom_count:>4} | Total: {add_total:>4}\n"
         )
-        fig.text(0.5, 0.73, report_text, ha='center', va='center', fontsize=16, fontfamily='monospace')
-
-        # --- Step 4: Create a NEW axes on the BOTTOM half for the bar chart ---
-        ax_chart = fig.add_axes([0.1, 0.1, 0.8, 0.35])
-
-        # --- Step 5: Draw the 3-bar chart with refined aesthetics ---
-        bar_width = 0.2  # Control the width of the bars for a sleeker look
-
-        # Plot the simple 'Before' and 'After' bars
-        ax_chart.bar('Before', before_total, width=bar_width, color='#1f77b4')
-
-        # --- NEW: Logic for STACKED bar with individual labels ---
-        stacked_data = [stay_total, removed_total, add_total]
-        stacked_labels = ['Stayed', 'Removed', 'Added']
-        stacked_colors = ['#2ca02c', '#d62728', '#9467bd']  # Green, Red, Purple
-
-        bottom_offset = 0
-        for i, count in enumerate(stacked_data):
-            # Draw the bar segment
-            ax_chart.bar('Changes', count, width=bar_width, bottom=bottom_offset,
-                         color=stacked_colors[i], label=stacked_labels[i])
-
-            # Add text label in the middle of the segment, but only if the count is > 0
-            if count > 0:
-                y_center = bottom_offset + count / 2
-                ax_chart.text('Changes', y_center, str(count), ha='center', va='center',
-                              color='white', fontsize=12, fontweight='bold')
-
-            # Update the bottom offset for the next segment
-            bottom_offset += count
-
-        ax_chart.bar('After', after_total, width=bar_width, color='#1f77b4')
-
-        # Add text labels on top of the simple bars
-        ax_chart.text('Before', before_total, f'{before_total}', ha='center', va='bottom', fontsize=12,
-                      fontweight='bold', bbox=dict(facecolor='white', alpha=0.5, edgecolor='none',
-                                                   boxstyle='round,pad=0.2'))
-        ax_chart.text('After', after_total, f'{after_total}', ha='center', va='bottom', fontsize=12,
-                      fontweight='bold', bbox=dict(facecolor='white', alpha=0.5, edgecolor='none',
-                                                   boxstyle='round,pad=0.2'))
-
-        # --- Chart Customization ---
-        ax_chart.set_ylabel('Total Counts', fontsize=12)
-        ax_chart.set_title('Summary of Changes', fontsize=16, fontweight='bold')
-        ax_chart.tick_params(axis='x', labelsize=12)
-        ax_chart.legend(loc='upper right')
-        ax_chart.grid(axis='y', linestyle='--', alpha=0.6)
-
-        # Add a top margin to make space for the bar labels
-        ax_chart.margins(y=0.15)
-
-        # --- Step 6: Convert the entire figure to a CV2 image ---
-        fig.canvas.draw()
-        rgba_array = np.array(fig.canvas.renderer.buffer_rgba())
-        bgr_array = cv2.cvtColor(rgba_array, cv2.COLOR_RGBA2BGR)
-        plt.close(fig)
 
-        return bgr_array
+        # --- Step 3: Composite the report and the bar chart onto the cached template ---
+        if self.summary_renderer is None:
+            self.summary_renderer = SummaryPanelRenderer()
+        height, width, _ = before_image.shape
+        return self.summary_renderer.render(width, height, report_text,
+                                            before_total, after_total, stay_total, removed_total, add_total)
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import pickle
+
+import pandas as pd
+from scipy.spatial import KDTree
+
+from PipelineLogging import get_logger
+
+logger = get_logger("SpatialIndexCache")
+
+
+class SpatialIndexCache:
+    """
+    Caches pre-extracted coordinate arrays and KD-trees per
+    (state, foil, TOP BOTTOM, data version), so repeated state comparisons
+    reuse the same spatial index instead of refiltering and rebuilding it.
+    The cache can optionally be persisted to disk next to the analysis.
+    """
+    # The row order within a group follows GroupedData's sort, which includes the
+    # marker_category derived from FM SIZE and the shape mapping, so those are hashed too
+    VERSION_COLUMNS = ['STATE', 'FOIL', 'TOP BOTTOM', 'X PERCENTAGE', 'Y PERCENTAGE',
+                       'FM SIZE', 'marker_category', 'ROW ID']
+
+    def __init__(self, cache_path=None):
+        """
+        Args:
+            cache_path (str, optional): Pickle file used to persist the cache between runs.
+                If None, the cache only lives in memory.
+        """
+        self.cache_path = cache_path
+        self.data_version = None
+        self._entries = {}
+        if self.cache_path:
+            self.load()
+
+    @classmethod
+    def compute_data_version(cls, data):
+        """
+        Returns a content hash of the columns the spatial index and its row order depend on,
+        so an unchanged dataset read back from Excel maps to the same version. The data must
+        have its marker_category assigned (see Plotter.set_data).
+        """
+        hashed = pd.util.hash_pandas_object(data[cls.VERSION_COLUMNS], index=True)
+        return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+    def set_data_version(self, data_version):
+        """Switches to a new data version and drops every entry built for an older one."""
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self._entries = {key: entry for key, entry in self._entries.items() if key[3] == data_version}
+
+    def get(self, grouped_data, state, foil, top_bottom):
+        """
+        Returns the (index labels, float32 coordinates, KDTree) entry for a group,
+        building it from the GroupedData slices on the first request. Unclassified
+        FMs are looked up with top_bottom=''. The tree is None for an empty group.
+        """
+        key = (state, foil, top_bottom, self.data_version)
+        entry = self._entries.get(key)
+        if entry is None:
+            group_slice = grouped_data.slice(state, foil, top_bottom)
+            labels = grouped_data.labels[group_slice]
+            coords = grouped_data.coords[group_slice]
+            kdtree = KDTree(coords) if len(coords) else None
+            entry = (labels, coords, kdtree)
+            self._entries[key] = entry
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+    def load(self):
+        """Loads persisted entries; a missing or unreadable cache file starts the cache cold."""
+        if not self.cache_path or not os.path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'rb') as f:
+                self._entries = pickle.load(f)
+            logger.info("Loaded %d cached spatial indexes from '%s'", len(self._entries), self.cache_path)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning("Could not read spatial index cache '%s': %s", self.cache_path, e)
+            self._entries = {}
+
+    def save(self):
+        """Persists the entries of the current data version."""
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self._entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.cache_path)
@@ -0,0 +1,220 @@
+import math
+import string
+
+import numpy as np
+import cv2
+from matplotlib import pyplot as plt
+from matplotlib.colors import to_rgb
+from matplotlib.font_manager import FontProperties
+from matplotlib.patches import Patch
+from matplotlib.ticker import MaxNLocator
+from matplotlib.transforms import IdentityTransform
+
+
+def _to_bgr(color):
+    r, g, b = to_rgb(color)
+    return (b * 255, g * 255, r * 255)
+
+
+class GlyphAtlas:
+    """
+    Pre-rendered alpha masks of the glyphs of one fixed-advance font (a monospace
+    font, or the tabular digits of a proportional one), so text can be composited
+    onto an image with NumPy instead of drawing a matplotlib figure.
+    """
+    def __init__(self, chars, fontsize, dpi, family='sans-serif', weight='normal'):
+        prop = FontProperties(family=family, size=fontsize, weight=weight)
+        fig = plt.figure(dpi=dpi)
+        renderer = fig.canvas.get_renderer()
+        advance, _, _ = renderer.get_text_width_height_descent('0', prop, ismath=False)
+        _, text_height, descent = renderer.get_text_width_height_descent('|Agjpqy', prop, ismath=False)
+
+        self.advance = advance
+        self.cell_width = int(math.ceil(advance)) + 2
+        self.height = int(math.ceil(text_height)) + 2
+        self.baseline = self.height - int(math.ceil(descent)) - 1
+
+        fig.set_size_inches((self.cell_width * len(chars) + 0.5) / dpi, (self.height + 0.5) / dpi)
+        for i, char in enumerate(chars):
+            fig.text(i * self.cell_width + 1, self.height - self.baseline, char, fontproperties=prop,
+                     transform=IdentityTransform(), ha='left', va='baseline')
+        fig.canvas.draw()
+        gray = np.asarray(fig.canvas.buffer_rgba())[:self.height, :, :3].min(axis=2)
+        plt.close(fig)
+
+        alpha = (255 - gray.astype(np.float32)) / 255
+        self.glyphs = {
+            char: alpha[:, i * self.cell_width:(i + 1) * self.cell_width, np.newaxis]
+            for i, char in enumerate(chars)
+        }
+
+    def text_width(self, text):
+        return int(round(len(text) * self.advance))
+
+    def draw(self, canvas, text, x, y, color):
+        """Alpha-blends text onto a BGR canvas in place, with (x, y) the top-left corner of the text."""
+        color = np.array(color, dtype=np.float32)
+        canvas_height, canvas_width = canvas.shape[:2]
+        for k, char in enumerate(text):
+            glyph = self.glyphs.get(char)
+            if glyph is None:
+                continue
+            gx = int(round(x + k * self.advance)) - 1
+            gy = int(round(y))
+            x1, y1 = max(gx, 0), max(gy, 0)
+            x2, y2 = min(gx + glyph.shape[1], canvas_width), min(gy + glyph.shape[0], canvas_height)
+            if x1 >= x2 or y1 >= y2:
+                continue
+            alpha = glyph[y1 - gy:y2 - gy, x1 - gx:x2 - gx]
+            region = canvas[y1:y2, x1:x2].astype(np.float32)
+            canvas[y1:y2, x1:x2] = (region * (1 - alpha) + color * alpha).astype(np.uint8)
+
+
+class SummaryPanelRenderer:
+    """
+    Renders the changed-summary panel of plot_compare_FM_summary from a template.
+    The static parts (chart frame, title, axis labels, legend) are drawn with
+    matplotlib once per panel size; the report text, gridlines, y ticks, bars
+    and bar labels are composited onto a copy of the template for each foil.
+    """
+    BAR_NAMES = ['Before', 'Changes', 'After']
+    STACKED_LABELS = ['Stayed', 'Removed', 'Added']
+    STACKED_COLORS = ['#2ca02c', '#d62728', '#9467bd']  # Green, Red, Purple
+    TOTAL_COLOR = '#1f77b4'
+    BAR_WIDTH = 0.2
+    CHART_RECT = [0.1, 0.1, 0.8, 0.35]
+
+    def __init__(self, dpi=100):
+        self.dpi = dpi
+        self._templates = {}
+        self.report_atlas = GlyphAtlas(string.printable[:95], 16, dpi, family='monospace')
+        self.bar_label_atlas = GlyphAtlas(string.digits, 12, dpi, weight='bold')
+        self.tick_atlas = GlyphAtlas(string.digits, 10, dpi)
+
+    def render(self, width, height, report_text, before_total, after_total, stay_total, removed_total, add_total):
+        """
+        Returns the summary panel as a BGR image of the given size.
+
+        Args:
+            width (int), height (int): Panel size in pixels, normally the size of the FM plots.
+            report_text (str): Multi-line report drawn in monospace on the top half.
+            before_total, after_total, stay_total, removed_total, add_total (int): Bar values.
+        """
+        template = self._get_template(width, height)
+        canvas = template['image'].copy()
+        self._draw_report(canvas, report_text, width, height)
+        self._draw_chart(canvas, template, before_total, after_total, [stay_total, removed_total, add_total])
+
+        # The legend sits above the bars, so composite it back from the template
+        lx1, ly1, lx2, ly2 = template['legend_box']
+        canvas[ly1:ly2, lx1:lx2] = template['image'][ly1:ly2, lx1:lx2]
+        return canvas
+
+    def _get_template(self, width, height):
+        key = (width, height)
+        if key not in self._templates:
+            self._templates[key] = self._build_template(width, height)
+        return self._templates[key]
+
+    def _build_template(self, width, height):
+        fig = plt.figure(figsize=(width / self.dpi, height / self.dpi), dpi=self.dpi)
+        fig.patch.set_facecolor('white')
+        ax_chart = fig.add_axes(self.CHART_RECT)
+
+        ax_chart.set_xlim(-0.5, len(self.BAR_NAMES) - 0.5)
+        ax_chart.set_ylim(0, 1)
+        ax_chart.set_xticks(range(len(self.BAR_NAMES)), self.BAR_NAMES)
+        ax_chart.set_yticks([])
+        ax_chart.set_ylabel('Total Counts', fontsize=12)
+        ax_chart.yaxis.set_label_coords(-0.07, 0.5)
+        ax_chart.set_title('Summary of Changes', fontsize=16, fontweight='bold')
+        ax_chart.tick_params(axis='x', labelsize=12)
+        legend = ax_chart.legend(handles=[Patch(color=color, label=label) for color, label
+                                          in zip(self.STACKED_COLORS, self.STACKED_LABELS)],
+                                 loc='upper right')
+
+        fig.canvas.draw()
+        rgba_array = np.array(fig.canvas.renderer.buffer_rgba())
+        image = cv2.cvtColor(rgba_array, cv2.COLOR_RGBA2BGR)
+
+        # --- Record pixel geometry (matplotlib display coordinates start bottom-left) ---
+        image_height = image.shape[0]
+        axes_box = ax_chart.get_window_extent()
+        legend_box = legend.get_window_extent()
+        bar_centers = ax_chart.transData.transform([(i, 0) for i in range(len(self.BAR_NAMES))])[:, 0]
+        plt.close(fig)
+
+        return {
+            'image': image,
+            'left': int(round(axes_box.x0)),
+            'right': int(round(axes_box.x1)),
+            'top': int(round(image_height - axes_box.y1)),
+            'bottom': int(round(image_height - axes_box.y0)),
+            'bar_centers': bar_centers,
+            'bar_half_width': self.BAR_WIDTH / 2 * axes_box.width / len(self.BAR_NAMES),
+            'legend_box': (int(math.floor(legend_box.x0)), int(math.floor(image_height - legend_box.y1)),
+                           int(math.ceil(legend_box.x1)) + 1, int(math.ceil(image_height - legend_box.y0)) + 1),
+        }
+
+    def _draw_report(self, canvas, report_text, width, height):
+        atlas = self.report_atlas
+        lines = report_text.rstrip('\n').split('\n')
+        line_height = 1.2 * 16 * self.dpi / 72
+        y = 0.27 * height - len(lines) * line_height / 2
+        # Every line centred on its own width, like matplotlib's ha='center' on multi-line text
+        for i, line in enumerate(lines):
+            atlas.draw(canvas, line, (width - atlas.text_width(line)) / 2, y + i * line_height, (0, 0, 0))
+
+    def _draw_chart(self, canvas, template, before_total, after_total, stacked_data):
+        left, right, top, bottom = template['left'], template['right'], template['top'], template['bottom']
+        centers, half_width = template['bar_centers'], template['bar_half_width']
+
+        # Leave a 15% top margin for the bar labels, like ax.margins(y=0.15)
+        y_max = max(before_total, after_total, sum(stacked_data)) * 1.15 or 1
+
+        def to_pixel(value):
+            return int(round(bottom - value / y_max * (bottom - top)))
+
+        # --- Gridlines and y ticks ---
+        tick_atlas = self.tick_atlas
+        for tick in MaxNLocator(integer=True).tick_values(0, y_max):
+            if tick < 0 or tick > y_max:
+                continue
+            y = to_pixel(tick)
+            for x in range(left + 1, right - 1, 6):
+                cv2.line(canvas, (x, y), (min(x + 3, right - 2), y), (208, 208, 208), 1)
+            cv2.line(canvas, (left - 4, y), (left, y), (0, 0, 0), 1)
+            label = str(int(tick))
+            tick_atlas.draw(canvas, label, left - 6 - tick_atlas.text_width(label),
+                            y - tick_atlas.baseline / 2 - 1, (0, 0, 0))
+
+        # --- Bars ---
+        def draw_bar(center, low, high, color):
+            if low == high:
+                return
+            x1, x2 = int(round(center - half_width)), int(round(center + half_width))
+            cv2.rectangle(canvas, (x1, to_pixel(high)), (x2, to_pixel(low) - 1), _to_bgr(color), thickness=-1)
+
+        draw_bar(centers[0], 0, before_total, self.TOTAL_COLOR)
+        draw_bar(centers[2], 0, after_total, self.TOTAL_COLOR)
+        label_atlas = self.bar_label_atlas
+        bottom_offset = 0
+        for count, color in zip(stacked_data, self.STACKED_COLORS):
+            draw_bar(centers[1], bottom_offset, bottom_offset + count, color)
+            if count > 0:
+                label = str(count)
+                y_center = to_pixel(bottom_offset + count / 2)
+                label_atlas.draw(canvas, label, centers[1] - label_atlas.text_width(label) / 2,
+                                 y_center - label_atlas.height / 2, (255, 255, 255))
+            bottom_offset += count
+
+        # --- Total labels on top of the simple bars, on a half-transparent white box ---
+        for center, total in ((centers[0], before_total), (centers[2], after_total)):
+            label = str(total)
+            label_width = label_atlas.text_width(label)
+            x = center - label_width / 2
+            y = to_pixel(total) - label_atlas.height - 2
+            x1, y1 = int(x) - 3, max(int(y) - 2, 0)
+            x2, y2 = int(x + label_width) + 3, int(y + label_atlas.height) + 2
+            canvas[y1:y2, x1:x2] = (canvas[y1:y2, x1:x2] // 2 + 127).astype(np.uint8)
+            label_atlas.draw(canvas, label, x, y, (0, 0, 0))
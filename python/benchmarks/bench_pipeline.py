@@ -0,0 +1,205 @@
+"""
+End-to-end benchmark of the Dakar stages on a synthetic dataset.
+
+Generates a reproducible raw data tree (see synthetic_dataset.py), then runs the pipeline
+on it 'repeats' times, each time with a fresh Dakar and output folder so no cache carries over.
+Records the wall time of every stage and the instrumentation timers and counters of every
+component (decode, crop, encode, Excel I/O, plotting, comparison), and writes one JSON file
+that can be compared with the results of another version:
+
+    python python/benchmarks/bench_pipeline.py --work-dir bench_work --repeats 3 --results before.json
+    (check out the other version)
+    python python/benchmarks/bench_pipeline.py --work-dir bench_work --repeats 3 --results after.json --compare before.json
+
+Between combine_csv and the later stages every FM is randomly classified top or bottom,
+standing in for the manual classification, so the background check and the plots have work.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+from synthetic_dataset import add_dataset_arguments, dataset_kwargs, generate_dataset
+from tkinter_app.settings import MasterSettings
+from Instrumentation import instrumentation
+
+STAGES = [
+    "combine_csv",
+    "preflight_dataset_stats",
+    "crop_FM_classify_top_bottom_from_excel",
+    "crop_FM_check_background_fm",
+    "plot_compare_FM_summary",
+    "plot_FM_summary",
+    "track_FM_across_states",
+]
+
+
+def build_settings(dataset, output_folder, workers):
+    settings = MasterSettings()
+    settings.Dakar.data = dataset["root"]
+    settings.Dakar.save_folder = output_folder
+    settings.Dakar.analysis_name = "benchmark"
+    settings.Dakar.workers = workers
+    settings.Dakar.show_hyperlink = True
+    settings.Dakar.foils_to_plot = {state: list(dataset["foils"]) for state in dataset["states"]}
+    settings.Dakar.before_state = dataset["states"][0]
+    settings.Dakar.after_state = dataset["states"][-1]
+    settings.Dakar.state_sequence = list(dataset["states"])
+    settings.plotter.background_image_path = dataset["background_image_path"]
+    return settings
+
+
+def classify_top_bottom(dakar, seed):
+    """Randomly marks every FM top or bottom, standing in for the manual classification."""
+    df = dakar._load_data()
+    rng = np.random.default_rng(seed)
+    df["TOP BOTTOM"] = rng.choice(["top", "bottom"], size=len(df))
+    dakar._save_data(df)
+
+
+def run_once(settings, stages, seed):
+    """Runs the stages with a fresh Dakar and returns the stage results and the instrumentation report."""
+    from Dakar import Dakar
+
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        dakar = Dakar(settings)
+        stage_results = []
+        for stage in stages:
+            stage_results.extend(dakar.run_pipeline([stage]))
+            if stage == "combine_csv" and len(stages) > 1:
+                classify_top_bottom(dakar, seed)
+    finally:
+        instrumentation.enable(False)
+    report = instrumentation.report()
+    report["stages"] = stage_results
+    return report
+
+
+def summarize(runs):
+    """Medians over the repeats: seconds per stage, and total/p50/p95 per timer."""
+    stage_seconds = {}
+    for run in runs:
+        for result in run["stages"]:
+            stage_seconds.setdefault(result["stage"], []).append(result["seconds"])
+    timers = {}
+    for name in sorted({name for run in runs for name in run["timers"]}):
+        samples = [run["timers"][name] for run in runs if name in run["timers"]]
+        timers[name] = {key: statistics.median(sample[key] for sample in samples)
+                        for key in ("count", "total", "p50", "p95")}
+    counters = {}
+    for name in sorted({name for run in runs for name in run["counters"]}):
+        counters[name] = statistics.median(run["counters"].get(name, 0) for run in runs)
+    return {
+        "stage_seconds": {stage: statistics.median(values) for stage, values in stage_seconds.items()},
+        "total_seconds": statistics.median(sum(result["seconds"] for result in run["stages"]) for run in runs),
+        "timers": timers,
+        "counters": counters,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PYTHON_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(summary, baseline_summary):
+    """Prints the median stage and component times next to those of a baseline result file."""
+    def line(name, current, baseline):
+        if baseline:
+            print(f"{name:<50} {baseline:>9.3f}s {current:>9.3f}s {current / baseline:>7.2f}x", file=sys.stderr)
+        else:
+            print(f"{name:<50} {'-':>10} {current:>9.3f}s", file=sys.stderr)
+
+    print(f"{'':<50} {'baseline':>10} {'current':>10} {'ratio':>8}", file=sys.stderr)
+    for stage, seconds in summary["stage_seconds"].items():
+        line(stage, seconds, baseline_summary["stage_seconds"].get(stage))
+    for name, timer in summary["timers"].items():
+        baseline_timer = baseline_summary["timers"].get(name)
+        line(name, timer["total"], baseline_timer["total"] if baseline_timer else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Dakar stages on a synthetic dataset.")
+    parser.add_argument("--work-dir", default=None,
+                        help="Folder for the dataset and outputs; a temporary folder removed afterwards by default.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, metavar="STAGE",
+                        help=f"Stages to run in order. Choices: {', '.join(STAGES)}")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of the pipeline; medians are reported.")
+    parser.add_argument("--workers", type=int, default=1, help="The 'workers' setting of the runs.")
+    parser.add_argument("--crop-width", type=int, default=960, help="Width in pixels of the saved crops.")
+    parser.add_argument("--results", default=None, help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument("--compare", default=None, help="Results file of a previous run to print the changes against.")
+    add_dataset_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from ImageProcesser import ImageProcesser
+    ImageProcesser.default_target_width = args.crop_width
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="dakar_bench_")
+    try:
+        start = time.perf_counter()
+        dataset = generate_dataset(os.path.join(work_dir, "data"), **dataset_kwargs(args))
+        dataset["generate_seconds"] = time.perf_counter() - start
+        print(f"Generated {dataset['fms']} FMs and {dataset['images']} images in {dataset['generate_seconds']:.1f}s",
+              file=sys.stderr)
+
+        runs = []
+        for repeat in range(args.repeats):
+            output_folder = os.path.join(work_dir, f"result_{repeat}")
+            shutil.rmtree(output_folder, ignore_errors=True)
+            run = run_once(build_settings(dataset, output_folder, args.workers), args.stages, args.seed)
+            total = sum(result["seconds"] for result in run["stages"])
+            print(f"Run {repeat + 1}/{args.repeats}: {total:.2f}s", file=sys.stderr)
+            runs.append(run)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers,
+        "crop_width": args.crop_width,
+        "dataset": dataset,
+        "stages": args.stages,
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results["summary"], json.load(f)["summary"])
+
+    text = json.dumps(results, indent=4)
+    if args.results:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Startup-time benchmark for the GUI and the command-line runner.
+
+Every case runs in a fresh interpreter, so nothing is already imported or cached,
+and is repeated to get a stable median. Besides the timings, each case records which
+heavy libraries (pandas, OpenCV, matplotlib, SciPy) it loaded, so a module that starts
+importing them at the top again shows up even when the machine is fast.
+
+Run from the repository root (the GUI reads python/tkinter_app/settings.json from there):
+
+    python python/benchmarks/bench_startup.py --repeats 5 --output startup.json --max-window-seconds 1.0
+
+Exit codes: 0 within budget, 1 a case exceeded --max-window-seconds or failed.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(PYTHON_DIR)
+
+HEAVY_MODULES = ["pandas", "cv2", "matplotlib", "scipy"]
+
+# Code run in the child interpreter; prints one JSON line with its own timings
+_CHILD_TEMPLATE = """
+import json, sys, time
+start = time.perf_counter()
+result = {{}}
+try:
+{body}
+except Exception as e:
+    result["error"] = f"{{type(e).__name__}}: {{e}}"
+result["seconds"] = time.perf_counter() - start
+result["heavy_modules"] = [name for name in {heavy!r} if name in sys.modules]
+print("BENCH_RESULT " + json.dumps(result))
+"""
+
+CASES = {
+    "import_dakar": "    import Dakar",
+    "import_cli": "    import cli",
+    "import_main_window": "    import tkinter_app.main_window",
+    # Until the first Tk event loop pass has drawn the window
+    "window_launch": """
+    import tkinter as tk
+    try:
+        root_check = tk.Tk()
+        root_check.destroy()
+    except tk.TclError as e:
+        result["skipped"] = f"No display available: {e}"
+    else:
+        from tkinter_app.main_window import MainWindow
+        app = MainWindow()
+        app.update()
+        result["window_seconds"] = time.perf_counter() - start
+        app.destroy()
+""",
+}
+
+
+def run_case(name, body):
+    """Runs one case in a fresh interpreter and returns its result dict, with the total process time."""
+    code = _CHILD_TEMPLATE.format(body=body.strip("\n"), heavy=HEAVY_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PYTHON_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.setdefault("MPLBACKEND", "Agg")
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True)
+    process_seconds = time.perf_counter() - start
+
+    for line in completed.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            result = json.loads(line[len("BENCH_RESULT "):])
+            break
+    else:
+        result = {"error": f"Case exited with code {completed.returncode}: {completed.stderr.strip()[-500:]}"}
+    result["process_seconds"] = process_seconds
+    return result
+
+
+def summarize(runs):
+    """Reduces the repeated runs of a case to min/median/max of every timing."""
+    summary = {"runs": len(runs)}
+    for key in ("seconds", "window_seconds", "process_seconds"):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {
+                "min": min(values),
+                "median": statistics.median(values),
+                "max": max(values),
+            }
+    summary["heavy_modules"] = sorted({name for run in runs for name in run.get("heavy_modules", [])})
+    for key in ("error", "skipped"):
+        if any(key in run for run in runs):
+            summary[key] = next(run[key] for run in runs if key in run)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure GUI and CLI startup time in fresh interpreters.")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per case; the median is reported.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES), metavar="CASE",
+                        help=f"Cases to run. Choices: {', '.join(CASES)}")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument("--max-window-seconds", type=float, default=None,
+                        help="Fail when the median window launch takes longer than this.")
+    args = parser.parse_args(argv)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "cases": {},
+    }
+    exit_code = 0
+    for name in args.cases:
+        runs = [run_case(name, CASES[name]) for _ in range(args.repeats)]
+        summary = summarize(runs)
+        report["cases"][name] = summary
+        if "error" in summary:
+            print(f"{name}: failed: {summary['error']}", file=sys.stderr)
+            exit_code = 1
+        elif "skipped" in summary:
+            print(f"{name}: skipped: {summary['skipped']}", file=sys.stderr)
+        else:
+            print(f"{name}: median {summary['seconds']['median']:.3f}s in-process, "
+                  f"{summary['process_seconds']['median']:.3f}s with interpreter start, "
+                  f"heavy modules: {', '.join(summary['heavy_modules']) or 'none'}", file=sys.stderr)
+
+    window = report["cases"].get("window_launch", {})
+    if args.max_window_seconds is not None and "window_seconds" in window:
+        median = window["window_seconds"]["median"]
+        report["max_window_seconds"] = args.max_window_seconds
+        if median > args.max_window_seconds:
+            print(f"Window launch median {median:.3f}s exceeds the budget of {args.max_window_seconds:.3f}s",
+                  file=sys.stderr)
+            exit_code = 1
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
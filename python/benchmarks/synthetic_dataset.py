@@ -0,0 +1,181 @@
+"""
+Synthetic raw data tree for benchmarking the Dakar pipeline.
+
+Writes the layout Dakar reads:
+
+    <root>/<state>/<foil>/<foil> FM.csv                  FOV, FM SIZE, POS X, POS Y (no header)
+    <root>/<state>/<foil>/images/IMG_<foil>_01_FOV_<n>.jpeg   white image of FOV n
+    <root>/<state>/<foil>/images/IMG_<foil>_02_FOV_<n>.jpeg   red image of FOV n
+    <root>/background.jpg                                 plot background
+
+FOV strings are 'R_<row>_C_<col>' as produced by the scanner, so combine_csv derives the
+same FOV numbers as the image names. Every state after the first keeps most FMs of the previous
+state with a small position jitter, drops some and adds new ones, so the comparison and tracking
+stages have realistic work. Images are noise with a bright spot per FM and are generated per FOV,
+so memory stays bounded at any scale.
+
+    python python/benchmarks/synthetic_dataset.py bench_data --fovs-per-foil 12 --fms-per-fov 40
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# Size of a full-resolution FOV image; combine_csv uses it to place FMs on the foil
+FULL_TILE_WIDTH = 13264
+FULL_TILE_HEIGHT = 9180
+FOV_COLUMNS = 5
+
+
+def fov_string(fov_number):
+    row, column = divmod(fov_number - 1, FOV_COLUMNS)
+    return f"R_{row + 1}_C_{column + 1}"
+
+
+def _draw_fov_image(rng, tile_width, tile_height, fms, red):
+    """Returns a BGR noise image with a bright blob at every (size, x, y) FM."""
+    # Noise is drawn at a quarter of the resolution and upscaled, generating full tiles stays fast
+    small = rng.integers(20, 60, size=(max(tile_height // 4, 1), max(tile_width // 4, 1), 1), dtype=np.uint8)
+    image = cv2.resize(small, (tile_width, tile_height), interpolation=cv2.INTER_NEAREST)
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    color = (40, 40, 230) if red else (235, 235, 235)
+    for size, x, y in fms:
+        cv2.circle(image, (int(x), int(y)), max(int(size) // 20, 2), color, thickness=-1)
+    return image
+
+
+def _next_state_fms(rng, fms, tile_width, tile_height, fms_per_fov, keep_fraction, jitter):
+    """Keeps keep_fraction of the FMs with a small jitter and tops the FOV up with new FMs."""
+    kept = [fm for fm in fms if rng.random() < keep_fraction]
+    kept = [(size, min(max(x + rng.integers(-jitter, jitter + 1), 0), tile_width - 1),
+             min(max(y + rng.integers(-jitter, jitter + 1), 0), tile_height - 1)) for size, x, y in kept]
+    return kept + _random_fms(rng, fms_per_fov - len(kept), tile_width, tile_height)
+
+
+def _random_fms(rng, count, tile_width, tile_height):
+    return [(int(rng.integers(100, 700)), int(rng.integers(0, tile_width)), int(rng.integers(0, tile_height)))
+            for _ in range(max(count, 0))]
+
+
+def generate_dataset(root, states=("BeforeCutState", "AfterCutState"), foils=("Foil1", "Foil2"),
+                     fovs_per_foil=10, fms_per_fov=20, tile_width=1326, tile_height=918,
+                     keep_fraction=0.8, jpeg_quality=90, seed=0):
+    """
+    Writes a synthetic raw data tree and returns its description.
+
+    Args:
+        root (str): Folder to create the tree in.
+        states, foils (sequence of str): Folder names; foils must not contain '_'.
+        fovs_per_foil (int): FOVs per foil, at most 30 (6 rows of 5 columns, the default foil size).
+        fms_per_fov (int): FMs per FOV in every state.
+        tile_width, tile_height (int): FOV image size in pixels; the full scanner size is 13264x9180.
+        keep_fraction (float): Share of the FMs of a state that are still present in the next one.
+        jpeg_quality (int): JPEG quality of the images, which drives the decode cost.
+        seed (int): Seed of the generator, the same arguments always produce the same tree.
+
+    Returns:
+        dict: The arguments plus the number of FMs and images and the bytes written.
+    """
+    if fovs_per_foil > 6 * FOV_COLUMNS:
+        raise ValueError(f"fovs_per_foil must be at most {6 * FOV_COLUMNS}, got {fovs_per_foil}")
+    if any('_' in foil for foil in foils):
+        raise ValueError("Foil names must not contain '_', it separates the parts of the image names")
+
+    rng = np.random.default_rng(seed)
+    jitter = max(tile_width // 400, 1)
+    fm_count = 0
+    image_count = 0
+    bytes_written = 0
+
+    for foil in foils:
+        fms_by_fov = {fov: _random_fms(rng, fms_per_fov, tile_width, tile_height)
+                      for fov in range(1, fovs_per_foil + 1)}
+        for state_number, state in enumerate(states):
+            if state_number > 0:
+                fms_by_fov = {fov: _next_state_fms(rng, fms, tile_width, tile_height, fms_per_fov, keep_fraction, jitter)
+                              for fov, fms in fms_by_fov.items()}
+            foil_folder = os.path.join(root, state, foil)
+            image_folder = os.path.join(foil_folder, "images")
+            os.makedirs(image_folder, exist_ok=True)
+
+            csv_lines = []
+            for fov, fms in fms_by_fov.items():
+                csv_lines.extend(f"{fov_string(fov)},{size},{x},{y}" for size, x, y in fms)
+                for image_type in ("01", "02"):
+                    image = _draw_fov_image(rng, tile_width, tile_height, fms, red=image_type == "02")
+                    image_path = os.path.join(image_folder, f"IMG_{foil}_{image_type}_FOV_{fov}.jpeg")
+                    cv2.imwrite(image_path, image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                    bytes_written += os.path.getsize(image_path)
+                    image_count += 1
+                fm_count += len(fms)
+
+            csv_path = os.path.join(foil_folder, f"{foil} FM.csv")
+            with open(csv_path, "w") as f:
+                f.write("\n".join(csv_lines) + "\n")
+            bytes_written += os.path.getsize(csv_path)
+
+    background_path = os.path.join(root, "background.jpg")
+    cv2.imwrite(background_path, np.full((600, 800, 3), 255, dtype=np.uint8))
+
+    return {
+        "root": os.path.abspath(root),
+        "states": list(states),
+        "foils": list(foils),
+        "fovs_per_foil": fovs_per_foil,
+        "fms_per_fov": fms_per_fov,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "keep_fraction": keep_fraction,
+        "jpeg_quality": jpeg_quality,
+        "seed": seed,
+        "fms": fm_count,
+        "images": image_count,
+        "bytes_written": bytes_written,
+        "background_image_path": os.path.abspath(background_path),
+    }
+
+
+def add_dataset_arguments(parser):
+    """Adds the generate_dataset options to an argparse parser; shared with bench_pipeline.py."""
+    parser.add_argument("--states", nargs="+", default=["BeforeCutState", "AfterCutState"])
+    parser.add_argument("--foils", nargs="+", default=["Foil1", "Foil2"])
+    parser.add_argument("--fovs-per-foil", type=int, default=10)
+    parser.add_argument("--fms-per-fov", type=int, default=20)
+    parser.add_argument("--tile-width", type=int, default=1326,
+                        help=f"FOV image width in pixels; {FULL_TILE_WIDTH} is the scanner size.")
+    parser.add_argument("--tile-height", type=int, default=918,
+                        help=f"FOV image height in pixels; {FULL_TILE_HEIGHT} is the scanner size.")
+    parser.add_argument("--keep-fraction", type=float, default=0.8)
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def dataset_kwargs(args):
+    return {
+        "states": args.states,
+        "foils": args.foils,
+        "fovs_per_foil": args.fovs_per_foil,
+        "fms_per_fov": args.fms_per_fov,
+        "tile_width": args.tile_width,
+        "tile_height": args.tile_height,
+        "keep_fraction": args.keep_fraction,
+        "jpeg_quality": args.jpeg_quality,
+        "seed": args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw data tree for the Dakar pipeline.")
+    parser.add_argument("root", help="Folder to create the data tree in.")
+    add_dataset_arguments(parser)
+    args = parser.parse_args(argv)
+    description = generate_dataset(args.root, **dataset_kwargs(args))
+    print(json.dumps(description, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
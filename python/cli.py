@@ -0,0 +1,242 @@
+"""
+Headless command-line runner for Dakar pipelines.
+
+Runs one or more Dakar functions from a settings file without importing tkinter,
+so analyses can be scheduled on machines without a display, e.g.:
+
+    python python/cli.py --settings settings.json --stages combine_csv crop_FM_classify_top_bottom_from_excel --workers 4
+
+Crop stages can be split across nodes that share the data and result folders: every node runs
+the same command with its own --shard-index and the same --shard-count and --run-id, then one
+node runs merge_shard_journals with that --run-id. --local-shards N does all of this on one
+machine with N processes.
+
+Exit codes: 0 success, 1 a stage failed, 2 invalid arguments or settings, 130 interrupted.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime
+
+from tkinter_app.settings import load_settings
+
+EXIT_OK = 0
+EXIT_STAGE_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+STAGES = [
+    "combine_csv",
+    "preflight_dataset_stats",
+    "crop_FM_classify_top_bottom_from_excel",
+    "detect_background_fm",
+    "crop_FM_check_background_fm",
+    "plot_compare_FM_summary",
+    "plot_FM_summary",
+    "track_FM_across_states",
+    "build_foil_pyramids",
+    "merge_shard_journals",
+    "expand_crop_archives",
+    "export_excel",
+]
+
+# Stages whose FOVs can be split across shards
+SHARDED_STAGES = ["crop_FM_classify_top_bottom_from_excel", "crop_FM_check_background_fm"]
+
+DEFAULT_SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tkinter_app", "settings.json")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run Dakar pipeline stages without a GUI.")
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS_PATH, help="Path to the settings JSON file.")
+    parser.add_argument("--stages", nargs="+", required=True, choices=STAGES, metavar="STAGE",
+                        help=f"Dakar functions to run in order. Choices: {', '.join(STAGES)}")
+    parser.add_argument("--workers", type=int, default=None, help="Number of FOVs cropped in parallel (overrides the settings).")
+    parser.add_argument("--start-row", type=int, default=0, help="First row of the combined table to crop or pre-flight.")
+    parser.add_argument("--end-row", type=int, default=None, help="Row after the last row of the combined table to crop or pre-flight.")
+    parser.add_argument("--crop-width", type=int, default=960,
+                        help="Width in pixels of the saved crops; replaces the screen-based default of the GUI.")
+    parser.add_argument("--shard-index", type=int, default=None,
+                        help="Shard cropped by this node, from 0 to --shard-count - 1 (overrides the settings).")
+    parser.add_argument("--shard-count", type=int, default=None,
+                        help="Number of nodes the crop FOVs are split across (overrides the settings).")
+    parser.add_argument("--run-id", default=None,
+                        help="Name of the sharded run, the same on every node; merge_shard_journals only merges its journals.")
+    parser.add_argument("--local-shards", type=int, default=None,
+                        help="Run every crop stage as this many local shard processes, then merge their journals.")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Time the hot spots and save a report to the Instrumentation folder of the analysis.")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Level of the pipeline log (overrides the settings).")
+    parser.add_argument("--log-json", default=None,
+                        help="Also append the pipeline log as JSON lines to this file (overrides the settings).")
+    parser.add_argument("--summary-json", default=None, help="Write the JSON run summary to this file instead of stdout.")
+    return parser
+
+
+def write_summary(summary, path):
+    text = json.dumps(summary, indent=4, default=str)
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+def shard_command(args, stage, shard_index, shard_count, summary_path):
+    """Returns the command line running one shard of a crop stage with the options of this run."""
+    command = [sys.executable, os.path.abspath(__file__), "--settings", args.settings, "--stages", stage,
+               "--shard-index", str(shard_index), "--shard-count", str(shard_count),
+               "--start-row", str(args.start_row), "--crop-width", str(args.crop_width),
+               "--summary-json", summary_path, "--run-id", args.run_id]
+    if args.end_row is not None:
+        command += ["--end-row", str(args.end_row)]
+    if args.workers is not None:
+        command += ["--workers", str(args.workers)]
+    if args.log_level is not None:
+        command += ["--log-level", args.log_level]
+    if args.log_json is not None:
+        # Every shard appends its records to the same file; each record is one line
+        command += ["--log-json", os.path.abspath(args.log_json)]
+    if args.instrument:
+        command.append("--instrument")
+    return command
+
+
+def run_local_shards(dakar, args, stage):
+    """
+    Runs one crop stage as args.local_shards processes standing in for nodes and waits for them.
+
+    Returns:
+        list: The exit code of every shard process.
+    """
+    shard_count = args.local_shards
+    shard_folder = os.path.join(dakar.save_folder, "Shards")
+    os.makedirs(shard_folder, exist_ok=True)
+    processes = []
+    for shard_index in range(shard_count):
+        summary_path = os.path.join(shard_folder, f"{stage} shard_{shard_index}_of_{shard_count} summary.json")
+        processes.append(subprocess.Popen(shard_command(args, stage, shard_index, shard_count, summary_path)))
+    return [process.wait() for process in processes]
+
+
+def run_with_local_shards(dakar, args, stage_results):
+    """Runs the stages, crop stages as local shards followed by merge_shard_journals."""
+    for stage in args.stages:
+        if stage not in SHARDED_STAGES:
+            stage_results.extend(dakar.run_pipeline([stage], start_row=args.start_row, end_row=args.end_row))
+            continue
+
+        start_time = time.perf_counter()
+        exit_codes = run_local_shards(dakar, args, stage)
+        failed = sum(1 for code in exit_codes if code != EXIT_OK)
+        stage_results.append({
+            "stage": stage,
+            "status": "failed" if failed else "finished",
+            "seconds": time.perf_counter() - start_time,
+            "shard_exit_codes": exit_codes,
+        })
+        if failed:
+            raise RuntimeError(f"{failed} of {len(exit_codes)} shards of {stage} failed")
+        stage_results.extend(dakar.run_pipeline(["merge_shard_journals"]))
+
+
+def main(argv=None):
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+
+    if args.workers is not None and args.workers < 1:
+        print("--workers must be at least 1", file=sys.stderr)
+        return EXIT_USAGE
+    if args.local_shards is not None and (args.local_shards < 1 or args.shard_count is not None):
+        print("--local-shards must be at least 1 and cannot be combined with --shard-count", file=sys.stderr)
+        return EXIT_USAGE
+    if not os.path.isfile(args.settings):
+        print(f"Settings file '{args.settings}' not found", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings = load_settings(args.settings)
+    if args.workers is not None:
+        settings.Dakar.workers = args.workers
+    if args.shard_index is not None:
+        settings.Dakar.shard_index = args.shard_index
+    if args.shard_count is not None:
+        settings.Dakar.shard_count = args.shard_count
+    if args.local_shards is not None and args.run_id is None:
+        # One run ID for the shard processes and the merge of this invocation
+        args.run_id = f"local {datetime.now():%Y%m%d-%H%M%S} {os.getpid()}"
+    if args.run_id is not None:
+        settings.Dakar.shard_run_id = args.run_id
+    if settings.Dakar.shard_count < 1 or not 0 <= settings.Dakar.shard_index < settings.Dakar.shard_count:
+        print(f"The shard index must be between 0 and the shard count - 1, got shard {settings.Dakar.shard_index} "
+              f"of {settings.Dakar.shard_count}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.instrument:
+        settings.Dakar.instrumentation = True
+    if args.log_level is not None:
+        settings.Dakar.log_level = args.log_level
+    if args.log_json is not None:
+        settings.Dakar.log_json_path = os.path.abspath(args.log_json)
+
+    # Render plots off-screen; never let matplotlib pick an interactive backend
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    from Dakar import Dakar
+    from ImageProcesser import ImageProcesser
+
+    # Headless runs have no screen to size the crops from
+    ImageProcesser.default_target_width = args.crop_width
+
+    summary = {
+        "settings": os.path.abspath(args.settings),
+        "stages": args.stages,
+        "workers": settings.Dakar.workers,
+        "start_row": args.start_row,
+        "end_row": args.end_row,
+        "shard_index": settings.Dakar.shard_index,
+        "shard_count": args.local_shards or settings.Dakar.shard_count,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "status": "running",
+        "stage_results": [],
+    }
+
+    exit_code = EXIT_OK
+    dakar = None
+    local_stage_results = []
+    try:
+        dakar = Dakar(settings)
+        summary["output_folder"] = os.path.abspath(dakar.save_folder)
+        if args.local_shards is not None:
+            run_with_local_shards(dakar, args, local_stage_results)
+        else:
+            dakar.run_pipeline(args.stages, start_row=args.start_row, end_row=args.end_row)
+        summary["status"] = "finished"
+    except KeyboardInterrupt:
+        summary["status"] = "interrupted"
+        exit_code = EXIT_INTERRUPTED
+    except Exception as e:
+        traceback.print_exc()
+        summary["status"] = "failed"
+        summary["error"] = f"{type(e).__name__}: {e}"
+        exit_code = EXIT_STAGE_FAILED
+
+    if dakar is not None:
+        summary["stage_results"] = local_stage_results if args.local_shards is not None else dakar.stage_results
+        if dakar.preflight_report is not None:
+            summary["preflight"] = dakar.preflight_report["totals"]
+        if dakar.export_report is not None:
+            summary["export"] = {key: dakar.export_report[key] for key in ("path", "rows", "sheets", "hyperlinks")}
+    summary["finished"] = datetime.now().isoformat(timespec="seconds")
+    write_summary(summary, args.summary_json)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
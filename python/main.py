@@ -10,12 +10,17 @@ def main():
 
     start_time = datetime.now()
     #dakar.combine_csv()
+    #dakar.preflight_dataset_stats()
     #dakar.crop_FM_classify_top_bottom_from_excel(start_row=187, end_row=501)
 
+    #dakar.detect_background_fm()
     #dakar.crop_FM_check_background_fm()
 
     dakar.plot_compare_FM_summary()
     #dakar.plot_FM_summary()
+    #dakar.track_FM_across_states()
+    #dakar.build_foil_pyramids()
+    #dakar.export_excel()
 
 
     end_time = datetime.now()
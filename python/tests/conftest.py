@@ -0,0 +1,42 @@
+"""
+Shared fixtures: puts the python and benchmarks folders on the import path and builds a
+small synthetic dataset (see benchmarks/synthetic_dataset.py) per test.
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, PYTHON_DIR)
+sys.path.insert(0, os.path.join(PYTHON_DIR, "benchmarks"))
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import pytest
+
+from ImageProcesser import ImageProcesser
+from synthetic_dataset import generate_dataset
+from tkinter_app.settings import MasterSettings
+
+# Without a display the crop width cannot come from the screen, as in the CLI
+ImageProcesser.default_target_width = 960
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    return generate_dataset(str(tmp_path / "data"), fovs_per_foil=3, fms_per_fov=5)
+
+
+@pytest.fixture
+def settings(dataset, tmp_path):
+    settings = MasterSettings()
+    settings.Dakar.data = dataset["root"]
+    settings.Dakar.save_folder = str(tmp_path / "output")
+    settings.Dakar.analysis_name = "test"
+    settings.Dakar.workers = 1
+    settings.Dakar.show_hyperlink = True
+    settings.Dakar.foils_to_plot = {state: list(dataset["foils"]) for state in dataset["states"]}
+    settings.Dakar.before_state = dataset["states"][0]
+    settings.Dakar.after_state = dataset["states"][-1]
+    settings.Dakar.state_sequence = list(dataset["states"])
+    settings.plotter.background_image_path = dataset["background_image_path"]
+    return settings
@@ -0,0 +1,14 @@
+from Dakar import Dakar
+
+
+def test_detect_background_without_top_bottom(settings):
+    """detect_background_fm runs on a dataset no FM of which has been classified top or bottom."""
+    dakar = Dakar(settings)
+    dakar.combine_csv()
+    assert "TOP BOTTOM" not in dakar._load_data().columns
+
+    dakar.detect_background_fm()
+
+    df = dakar._load_data()
+    assert df["BACKGROUND FOILS"].notna().all()
+    assert "TOP BOTTOM" not in df.columns
@@ -0,0 +1,14 @@
+import os
+
+from Dakar import Dakar
+
+
+def test_track_without_top_bottom(settings):
+    """Tracking works straight after combine_csv, before any FM is classified top or bottom."""
+    dakar = Dakar(settings)
+    dakar.combine_csv()
+    assert "TOP BOTTOM" not in dakar._load_data().columns
+
+    dakar.track_FM_across_states()
+
+    assert os.path.exists(os.path.join(dakar.save_folder, "test FM tracks.xlsx"))
@@ -0,0 +1,16 @@
+from tkinter_app.settings import MasterSettings
+from tkinter_app.settings_service import SettingsService
+
+
+def test_fields_without_widget_keep_loaded_values():
+    """Saving from the GUI keeps the settings hidden from the UI as loaded."""
+    loaded = MasterSettings()
+    loaded.Dakar.persist_spatial_index = not loaded.Dakar.persist_spatial_index
+    loaded.Dakar.shard_run_id = "nightly"
+    loaded.Dakar.state_sequence = ["BeforeCutState", "AfterCutState"]
+
+    rebuilt = SettingsService().build_dataclass_from_ui({}, loaded)
+
+    assert rebuilt == loaded
+    assert rebuilt.Dakar.state_sequence is not loaded.Dakar.state_sequence
+    assert SettingsService().build_dataclass_from_ui({}) == MasterSettings()
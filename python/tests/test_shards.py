@@ -0,0 +1,26 @@
+import copy
+
+from Dakar import Dakar
+from Plotter import Plotter
+
+
+def test_merged_shards_build_a_plotter(settings):
+    """A two-shard crop merged into the workbook gives the same columns as an unsharded crop."""
+    Dakar(settings).combine_csv()
+    for shard_index in range(2):
+        shard_settings = copy.deepcopy(settings)
+        shard_settings.Dakar.shard_count = 2
+        shard_settings.Dakar.shard_index = shard_index
+        shard_settings.Dakar.shard_run_id = "test"
+        Dakar(shard_settings).crop_FM_classify_top_bottom_from_excel()
+
+    dakar = Dakar(settings)
+    summary = dakar.merge_shard_journals()
+
+    stage_summary, = summary.values()
+    assert sorted(stage_summary["shards"]) == [0, 1]
+    assert stage_summary["incomplete"] == []
+    df = dakar._load_data()
+    assert (df["TOP BOTTOM"].fillna('') == '').all()
+    assert df["WHITE RED IMAGE HYPERLINK"].astype(str).str.startswith('=HYPERLINK').all()
+    Plotter(df, settings.plotter)
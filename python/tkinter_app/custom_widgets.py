@@ -1,4 +1,6 @@
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog
 
@@ -39,14 +41,36 @@ class PathSelectorWidget(tk.Frame):
             self.command(self.get())
 
 class FoilsSelectorWidget(tk.Frame):
-    """A tree-based widget to select folders and subfolders."""
-    def __init__(self, parent, checked_char="\u2713", unchecked_char="", on_selection_change=None):
+    """
+    A tree-based widget to select folders and subfolders.
+
+    The data path entry calls set_data_path on every keystroke, so scans are debounced and run
+    on a background thread; the tree is filled one state folder at a time as results arrive.
+    Scan results are cached per path and reused while the modification times of the data folder
+    and its state folders are unchanged, which costs one stat per folder instead of a listing
+    plus an isdir per entry (slow on network drives).
+    """
+    _scan_cache = {}  # normalized path -> (data folder mtime, [(state, state mtime, [subfolders])])
+    _scan_cache_lock = threading.Lock()
+
+    def __init__(self, parent, checked_char="\u2713", unchecked_char="", on_selection_change=None,
+                 debounce_ms: int = 300, poll_interval_ms: int = 50):
         super().__init__(parent)
         self._data_path = ""
         self._is_populating = False
         self.checked_char = checked_char
         self.unchecked_char = unchecked_char
         self.on_selection_change = on_selection_change  # Callback for selection changes
+        self.debounce_ms = debounce_ms
+        self.poll_interval_ms = poll_interval_ms
+
+        # Scan state; the generation number discards results of scans that were superseded
+        self._scan_generation = 0
+        self._scan_queue = queue.Queue()
+        self._debounce_id = None
+        self._poll_id = None
+        self._pending_selections = {}
+        self._tree_cleared = True
 
         self.tree = ttk.Treeview(self, show="tree")
         self.tree.pack(fill=tk.BOTH, expand=True)
@@ -68,40 +92,106 @@ class FoilsSelectorWidget(tk.Frame):
                 self.on_selection_change()
 
     def set_data_path(self, path: str, selections: dict):
+        """Schedules a scan of the data path; calls made within debounce_ms of each other scan only once."""
         self._data_path = path
-        self.populate_tree(selections)
-        # Notify of initial population
-        if self.on_selection_change:
-            self.on_selection_change()
+        self._pending_selections = selections
+        self._is_populating = True
+        if self._debounce_id is not None:
+            self.after_cancel(self._debounce_id)
+        self._debounce_id = self.after(self.debounce_ms, self.populate_tree, selections)
 
     def populate_tree(self, selections: dict):
+        """Starts scanning the data path on a background thread; the tree is refilled as results arrive."""
+        self._debounce_id = None
+        self._pending_selections = selections
         self._is_populating = True
-        self.tree.delete(*self.tree.get_children())
-        if not self._data_path or not os.path.isdir(self._data_path):
-            self._is_populating = False
-            return
+        self._scan_generation += 1
+        self._tree_cleared = False
+        thread = threading.Thread(target=self._scan_data_path,
+                                  args=(self._data_path, self._scan_generation, self._scan_queue), daemon=True)
+        thread.start()
+        if self._poll_id is None:
+            self._poll_id = self.after(self.poll_interval_ms, self._poll_scan_results)
+
+    @classmethod
+    def _scan_data_path(cls, path, generation, result_queue):
+        """Runs on the scan thread: puts one ('state', ...) message per state folder, then ('done', ...)."""
+        try:
+            for state, subfolders in cls._list_state_folders(path):
+                result_queue.put(("state", generation, state, subfolders))
+        except OSError as e:
+            print(f"Warning: Could not scan data folder '{path}': {e}")
+        result_queue.put(("done", generation, None, None))
+
+    @classmethod
+    def _list_state_folders(cls, path):
+        """Returns [(state, [subfolders])] of a data folder, from the cache when the folder mtimes still match."""
+        if not path or not os.path.isdir(path):
+            return []
+        key = os.path.normcase(os.path.abspath(path))
+        root_mtime = os.stat(path).st_mtime
+        with cls._scan_cache_lock:
+            cached = cls._scan_cache.get(key)
+        if cached is not None and cached[0] == root_mtime:
+            try:
+                if all(os.stat(os.path.join(path, state)).st_mtime == state_mtime
+                       for state, state_mtime, _ in cached[1]):
+                    return [(state, subfolders) for state, _, subfolders in cached[1]]
+            except OSError:
+                pass  # A state folder disappeared, rescan
+
+        states = []
+        with os.scandir(path) as entries:
+            state_entries = sorted((entry for entry in entries if entry.is_dir()), key=lambda entry: entry.name)
+        for state_entry in state_entries:
+            with os.scandir(state_entry.path) as entries:
+                subfolders = sorted(entry.name for entry in entries if entry.is_dir())
+            states.append((state_entry.name, state_entry.stat().st_mtime, subfolders))
+        with cls._scan_cache_lock:
+            cls._scan_cache[key] = (root_mtime, states)
+        return [(state, subfolders) for state, _, subfolders in states]
+
+    def _poll_scan_results(self):
+        self._poll_id = None
+        finished = False
+        while True:
+            try:
+                kind, generation, state, subfolders = self._scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._scan_generation:
+                continue  # Result of a superseded scan
+            if not self._tree_cleared:
+                self.tree.delete(*self.tree.get_children())
+                self._tree_cleared = True
+            if kind == "state":
+                self._insert_state(state, subfolders, self._pending_selections.get(state, []))
+            else:
+                finished = True
+
+        if finished:
+            # Still populating if the path changed again while this scan ran
+            self._is_populating = self._debounce_id is not None
+            # Notify of the (re)population
+            if self.on_selection_change:
+                self.on_selection_change()
+        elif self._is_populating or self._debounce_id is not None:
+            self._poll_id = self.after(self.poll_interval_ms, self._poll_scan_results)
 
+    def _insert_state(self, folder_name, subfolders, selected_subfolders):
         unchecked_prefix = f"[{self.unchecked_char}] "
         checked_prefix = f"[{self.checked_char}] "
-
-        for folder_name in sorted(os.listdir(self._data_path)):
-            folder_path = os.path.join(self._data_path, folder_name)
-            if os.path.isdir(folder_path):
-                parent_item = self.tree.insert("", tk.END, text=folder_name, open=True)
-
-                selected_subfolders = selections.get(folder_name, [])
-                
-                subfolders = [d for d in sorted(os.listdir(folder_path)) if os.path.isdir(os.path.join(folder_path, d))]
-                
-                for subfolder_name in subfolders:
-                    if subfolder_name in selected_subfolders:
-                        self.tree.insert(parent_item, tk.END, text=checked_prefix + subfolder_name)
-                    else:
-                        self.tree.insert(parent_item, tk.END, text=unchecked_prefix + subfolder_name)
-        
-        self._is_populating = False
+        parent_item = self.tree.insert("", tk.END, text=folder_name, open=True)
+        for subfolder_name in subfolders:
+            if subfolder_name in selected_subfolders:
+                self.tree.insert(parent_item, tk.END, text=checked_prefix + subfolder_name)
+            else:
+                self.tree.insert(parent_item, tk.END, text=unchecked_prefix + subfolder_name)
 
     def get_selected_as_dict(self) -> dict:
+        # While a scan is pending the tree is stale, so report the selections it will be filled with
+        if self._is_populating:
+            return {state: list(subfolders) for state, subfolders in self._pending_selections.items() if subfolders}
         selections = {}
         for parent_item in self.tree.get_children():
             parent_name = self.tree.item(parent_item, "text")
@@ -0,0 +1,489 @@
+import base64
+import os
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import ttk
+
+from Dakar import Dakar
+
+ALL = "All"
+BROWSER_COLUMNS = ['ROW ID', 'STATE', 'FOIL', 'FOV NUMBER', 'FM SIZE', 'POS X', 'POS Y', 'TOP BOTTOM']
+CROP_FOLDERS = {
+    "White/red": "Combined white and red images",
+    "Background": "Combined different foil images",
+}
+CROP_EXTENSIONS = (".png", ".jpg", ".webp")
+
+
+class FMTableModel:
+    """
+    Filtered and sorted view of the FM table. Keeps only an array of row positions, so
+    filtering and sorting 100k+ rows costs a few vectorized pandas operations and the
+    table widget asks for just the rows it shows.
+    """
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.columns = [column for column in BROWSER_COLUMNS if column in self.df.columns]
+        self.positions = self.df.index.to_numpy()
+        self.sort_column = None
+        self.sort_descending = False
+        self._positions_by_row_id = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def values(self, column):
+        """Distinct values of a column, for the filter drop-downs."""
+        if column not in self.df.columns:
+            return []
+        return sorted(self.df[column].dropna().astype(str).unique())
+
+    def apply_filters(self, equals=None, min_size=None, max_size=None):
+        """
+        Keeps the rows matching every filter, then re-applies the current sort.
+
+        Args:
+            equals (dict, optional): Column -> value the column must equal (as text); ALL or '' keeps every row.
+            min_size, max_size (float, optional): Inclusive FM SIZE bounds.
+        """
+        mask = None
+        for column, value in (equals or {}).items():
+            if value in (ALL, "") or column not in self.df.columns:
+                continue
+            column_mask = self.df[column].astype(str) == value
+            mask = column_mask if mask is None else mask & column_mask
+        if min_size is not None:
+            size_mask = self.df['FM SIZE'] >= min_size
+            mask = size_mask if mask is None else mask & size_mask
+        if max_size is not None:
+            size_mask = self.df['FM SIZE'] <= max_size
+            mask = size_mask if mask is None else mask & size_mask
+        self.positions = self.df.index.to_numpy() if mask is None else self.df.index[mask.to_numpy()].to_numpy()
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_descending)
+
+    def sort(self, column, descending=False):
+        self.sort_column = column
+        self.sort_descending = descending
+        ordered = self.df[column].iloc[self.positions].sort_values(ascending=not descending, kind="stable")
+        self.positions = ordered.index.to_numpy()
+
+    def rows(self, start, stop):
+        """Returns (view position, display values) of the rows between two view positions."""
+        positions = self.positions[start:stop]
+        block = self.df.iloc[positions][self.columns]
+        return [(start + offset, tuple("" if value != value else value for value in record))
+                for offset, record in enumerate(block.itertuples(index=False, name=None))]
+
+    def row(self, position):
+        return self.df.iloc[self.positions[position]]
+
+    def row_by_id(self, row_id):
+        """Returns the row of a ROW ID, or None; safe to call from the thumbnail threads."""
+        if self._positions_by_row_id is None:
+            self._positions_by_row_id = dict(zip(self.df['ROW ID'].tolist(), self.df.index.tolist()))
+        position = self._positions_by_row_id.get(row_id)
+        return None if position is None else self.df.iloc[position]
+
+
+class ThumbnailCache:
+    """
+    LRU cache of preview images loaded on a small thread pool.
+
+    request() returns the cached preview or schedules its load and returns PENDING; finished
+    loads are delivered through poll() on the Tk thread, so decoding and resizing never block
+    the window. Previews are kept as PNG data that tk.PhotoImage reads directly, and a crop
+    that does not exist is cached as None.
+    """
+    PENDING = object()
+
+    def __init__(self, loader, capacity=256, workers=2):
+        """
+        Args:
+            loader: Called on a worker thread with the key, returns PNG bytes or None.
+            capacity (int): Previews kept in memory.
+            workers (int): Previews loaded in parallel.
+        """
+        self.loader = loader
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._results = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+    def request(self, key):
+        """Returns the cached preview of a key (None when it has no crop), or PENDING while it loads."""
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            if key in self._in_flight:
+                return self.PENDING
+            self._in_flight.add(key)
+        self._executor.submit(self._load, key)
+        return self.PENDING
+
+    def _load(self, key):
+        try:
+            data = self.loader(key)
+        except Exception as e:
+            print(f"Warning: Could not load the preview of {key}: {e}")
+            data = None
+        with self._lock:
+            self._in_flight.discard(key)
+            self._cache[key] = data
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        self._results.put((key, data))
+
+    def poll(self):
+        """Returns the (key, data) loads finished since the last poll."""
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def is_loading(self):
+        with self._lock:
+            return bool(self._in_flight)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class CropLocator:
+    """Finds the crop of a FM row as a loose file or in the crop archives of an analysis."""
+    def __init__(self, analysis_folder):
+        self.analysis_folder = analysis_folder
+        self._readers = {}
+        self._lock = threading.Lock()
+
+    def read(self, kind, row):
+        """Returns the encoded crop of a row, or None when it was not generated."""
+        crop_folder = os.path.join(self.analysis_folder, CROP_FOLDERS[kind])
+        file_name = Dakar.crop_file_name(row)
+        for extension in CROP_EXTENSIONS:
+            path = os.path.join(crop_folder, file_name + extension)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read()
+        reader = self._archive_reader(crop_folder)
+        if reader is not None and int(row['ROW ID']) in reader:
+            return reader.read_bytes(int(row['ROW ID']))
+        return None
+
+    def _archive_reader(self, crop_folder):
+        with self._lock:
+            if crop_folder not in self._readers:
+                from CropArchive import CropArchiveReader, archive_paths
+                paths = archive_paths(crop_folder)
+                self._readers[crop_folder] = CropArchiveReader(paths) if paths else None
+            return self._readers[crop_folder]
+
+    def close(self):
+        with self._lock:
+            for reader in self._readers.values():
+                if reader is not None:
+                    reader.close()
+            self._readers = {}
+
+
+def make_preview(encoded, max_width, max_height):
+    """Decodes a crop and returns it scaled to fit max_width x max_height, as PNG bytes."""
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    h, w = image.shape[:2]
+    scale = min(max_width / w, max_height / h, 1.0)
+    if scale < 1.0:
+        image = cv2.resize(image, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+    success, png = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    return png.tobytes() if success else None
+
+
+class FMBrowser(tk.Toplevel):
+    """
+    Window to inspect the FMs of an analysis: a filterable, sortable table of FM rows and a
+    preview of the selected FM's crop.
+
+    The table is virtualized: the Treeview only ever holds the rows that fit in the window,
+    refilled from the FMTableModel when scrolling, so it stays smooth with 100k+ FMs. Crops
+    are decoded and scaled on background threads through a ThumbnailCache; the FMs after the
+    selected one are prefetched so stepping through them with the arrow keys is instant.
+    """
+    def __init__(self, parent, settings, preview_size=(720, 360), poll_interval_ms: int = 50):
+        super().__init__(parent)
+        self.title(f"FM browser - {settings.Dakar.analysis_name}")
+        self.geometry("1300x700")
+        self.settings = settings
+        self.analysis_folder = os.path.join(settings.Dakar.save_folder, settings.Dakar.analysis_name)
+        self.excel_path = os.path.join(self.analysis_folder, settings.Dakar.analysis_name + ".xlsx")
+        self.preview_size = preview_size
+        self.poll_interval_ms = poll_interval_ms
+
+        self.model = None
+        self.offset = 0
+        self.visible_rows = 25
+        self.selected_position = None
+        self._poll_id = None
+        self._preview_image = None
+        self._load_queue = queue.Queue()
+
+        self.locator = CropLocator(self.analysis_folder)
+        self.thumbnails = ThumbnailCache(self._load_preview)
+
+        self._build_widgets()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.status_label.config(text=f"Loading '{self.excel_path}'...")
+        threading.Thread(target=self._load_table, daemon=True).start()
+        self._schedule_poll()
+
+    def _build_widgets(self):
+        filter_frame = tk.Frame(self)
+        filter_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.filter_boxes = {}
+        for column in ('STATE', 'FOIL', 'TOP BOTTOM'):
+            tk.Label(filter_frame, text=column.title() + ":").pack(side=tk.LEFT)
+            box = ttk.Combobox(filter_frame, state="readonly", width=18, values=[ALL])
+            box.set(ALL)
+            box.bind("<<ComboboxSelected>>", lambda event: self._apply_filters())
+            box.pack(side=tk.LEFT, padx=(0, 10))
+            self.filter_boxes[column] = box
+        tk.Label(filter_frame, text="FM size from:").pack(side=tk.LEFT)
+        self.min_size_entry = tk.Entry(filter_frame, width=8)
+        self.min_size_entry.pack(side=tk.LEFT)
+        tk.Label(filter_frame, text="to:").pack(side=tk.LEFT)
+        self.max_size_entry = tk.Entry(filter_frame, width=8)
+        self.max_size_entry.pack(side=tk.LEFT, padx=(0, 10))
+        for entry in (self.min_size_entry, self.max_size_entry):
+            entry.bind("<Return>", lambda event: self._apply_filters())
+        tk.Button(filter_frame, text="Apply", command=self._apply_filters).pack(side=tk.LEFT)
+        self.status_label = tk.Label(filter_frame, text="", anchor=tk.W)
+        self.status_label.pack(side=tk.LEFT, padx=10)
+
+        body = tk.PanedWindow(self, orient=tk.HORIZONTAL)
+        body.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+        table_frame = tk.Frame(body)
+        self.tree = ttk.Treeview(table_frame, columns=BROWSER_COLUMNS, show="headings", selectmode="browse",
+                                 height=self.visible_rows)
+        for column in BROWSER_COLUMNS:
+            self.tree.heading(column, text=column, command=lambda column=column: self._sort_by(column))
+            self.tree.column(column, width=90, stretch=True)
+        self.scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        body.add(table_frame, minsize=400)
+
+        preview_frame = tk.Frame(body)
+        self.kind = tk.StringVar(value="White/red")
+        kind_frame = tk.Frame(preview_frame)
+        kind_frame.pack(side=tk.TOP, anchor=tk.W)
+        for kind in CROP_FOLDERS:
+            ttk.Radiobutton(kind_frame, text=kind, value=kind, variable=self.kind,
+                            command=self._show_preview).pack(side=tk.LEFT)
+        self.preview_label = tk.Label(preview_frame, text="Select a FM", anchor=tk.NW, justify=tk.LEFT)
+        self.preview_label.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        body.add(preview_frame, minsize=300)
+
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.tree.bind("<Configure>", self._on_tree_resize)
+        self.tree.bind("<MouseWheel>", lambda event: self._scroll_by(-3 if event.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda event: self._scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_by(3))
+        self.tree.bind("<Up>", lambda event: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self._move_selection(1))
+        self.tree.bind("<Prior>", lambda event: self._move_selection(-self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self._move_selection(self.visible_rows))
+
+    def _load_table(self):
+        """Runs on a loader thread: reads the FM columns of the workbook."""
+        try:
+            import pandas as pd
+            df = pd.read_excel(self.excel_path, usecols=lambda column: column in BROWSER_COLUMNS)
+            self._load_queue.put(("loaded", FMTableModel(df)))
+        except Exception as e:
+            self._load_queue.put(("failed", e))
+
+    def _schedule_poll(self):
+        if self._poll_id is None:
+            self._poll_id = self.after(self.poll_interval_ms, self._poll)
+
+    def _poll(self):
+        self._poll_id = None
+        try:
+            kind, payload = self._load_queue.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            if kind == "loaded":
+                self._on_table_loaded(payload)
+            else:
+                self.status_label.config(text=f"Could not load '{self.excel_path}': {payload}")
+
+        selected_key = self._selected_key()
+        for key, data in self.thumbnails.poll():
+            if key == selected_key:
+                self._display_preview(data)
+        if self.model is None or self.thumbnails.is_loading():
+            self._schedule_poll()
+
+    def _on_table_loaded(self, model):
+        self.model = model
+        for column, box in self.filter_boxes.items():
+            box.config(values=[ALL] + model.values(column))
+        self._refresh()
+
+    def _apply_filters(self):
+        if self.model is None:
+            return
+        try:
+            min_size = float(self.min_size_entry.get()) if self.min_size_entry.get().strip() else None
+            max_size = float(self.max_size_entry.get()) if self.max_size_entry.get().strip() else None
+        except ValueError:
+            self.status_label.config(text="FM size bounds must be numbers")
+            return
+        self.model.apply_filters({column: box.get() for column, box in self.filter_boxes.items()}, min_size, max_size)
+        self.offset = 0
+        self.selected_position = None
+        self._refresh()
+
+    def _sort_by(self, column):
+        if self.model is None or column not in self.model.columns:
+            return
+        descending = self.model.sort_column == column and not self.model.sort_descending
+        self.model.sort(column, descending)
+        for heading in BROWSER_COLUMNS:
+            arrow = (" ▼" if descending else " ▲") if heading == column else ""
+            self.tree.heading(heading, text=heading + arrow)
+        self.offset = 0
+        self.selected_position = None
+        self._refresh()
+
+    def _on_tree_resize(self, event):
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        # Roughly one row for the headings
+        visible_rows = max(event.height // row_height - 1, 1)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.tree.config(height=visible_rows)
+            self._refresh()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if self.model is None:
+            return
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * len(self.model)))
+        elif unit == "pages":
+            self._scroll_by(int(amount) * self.visible_rows)
+        else:
+            self._scroll_by(int(amount))
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self.offset + rows)
+        return "break"
+
+    def _scroll_to(self, offset):
+        if self.model is None:
+            return
+        self.offset = min(max(offset, 0), max(len(self.model) - self.visible_rows, 0))
+        self._refresh()
+
+    def _refresh(self):
+        """Refills the Treeview with the rows at the current offset; only these rows exist as items."""
+        self.tree.delete(*self.tree.get_children())
+        if self.model is None:
+            return
+        total = len(self.model)
+        for position, values in self.model.rows(self.offset, self.offset + self.visible_rows):
+            display = dict(zip(self.model.columns, values))
+            self.tree.insert("", tk.END, iid=str(position), values=[display.get(column, "") for column in BROWSER_COLUMNS])
+        if self.selected_position is not None and self.tree.exists(str(self.selected_position)):
+            self.tree.selection_set(str(self.selected_position))
+        if total:
+            self.scrollbar.set(self.offset / total, min((self.offset + self.visible_rows) / total, 1.0))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.status_label.config(text=f"{total} of {len(self.model.df)} FMs")
+
+    def _on_tree_select(self, event):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        position = int(selection[0])
+        if position != self.selected_position:
+            self.selected_position = position
+            self._show_preview()
+
+    def _move_selection(self, step):
+        if self.model is None or not len(self.model):
+            return "break"
+        current = self.selected_position if self.selected_position is not None else self.offset - 1
+        position = min(max(current + step, 0), len(self.model) - 1)
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + self.visible_rows:
+            self.offset = position - self.visible_rows + 1
+        self.selected_position = position
+        self._refresh()
+        self._show_preview()
+        return "break"
+
+    def _selected_key(self):
+        if self.model is None or self.selected_position is None or self.selected_position >= len(self.model):
+            return None
+        return self._key(self.selected_position)
+
+    def _key(self, position):
+        return (self.kind.get(), int(self.model.row(position)['ROW ID']))
+
+    def _show_preview(self):
+        key = self._selected_key()
+        if key is None:
+            return
+        data = self.thumbnails.request(key)
+        if data is not ThumbnailCache.PENDING:
+            self._display_preview(data)
+        else:
+            self.preview_label.config(image="", text=f"Loading ROW ID {key[1]}...")
+        # Prefetch the next FMs, the usual direction of review
+        for position in range(self.selected_position + 1, min(self.selected_position + 4, len(self.model))):
+            self.thumbnails.request(self._key(position))
+        self._schedule_poll()
+
+    def _display_preview(self, data):
+        row = self.model.row(self.selected_position)
+        if data is None:
+            self._preview_image = None
+            self.preview_label.config(image="", text=f"No {self.kind.get().lower()} crop of ROW ID {row['ROW ID']}.\n"
+                                                     f"Run the crop stage or the crop server to generate it.")
+            return
+        self._preview_image = tk.PhotoImage(data=base64.b64encode(data))
+        self.preview_label.config(image=self._preview_image, text="")
+
+    def _load_preview(self, key):
+        """Runs on a thumbnail thread: locates, decodes and scales the crop of a (kind, ROW ID) key."""
+        kind, row_id = key
+        row = self.model.row_by_id(row_id)
+        if row is None:
+            return None
+        encoded = self.locator.read(kind, row)
+        if encoded is None:
+            return None
+        return make_preview(encoded, *self.preview_size)
+
+    def _on_close(self):
+        if self._poll_id is not None:
+            self.after_cancel(self._poll_id)
+        self.thumbnails.close()
+        self.locator.close()
+        self.destroy()
@@ -0,0 +1,77 @@
+import queue
+import threading
+
+from JobProgress import ProgressReporter, JobCancelled
+
+
+class JobRunner:
+    """
+    Runs one job at a time on a background thread so the Tk window stays responsive.
+    Progress snapshots travel through a thread-safe queue that the Tk loop polls with after().
+    """
+    def __init__(self, root, on_progress=None, on_done=None, poll_interval_ms: int = 100):
+        """
+        Args:
+            root: The Tk root (or any widget) whose after() drives the polling.
+            on_progress: Called on the Tk thread with the latest progress snapshot dict.
+            on_done: Called on the Tk thread when the job ends, with the status
+                ("finished", "cancelled" or "failed") and the exception, if any.
+            poll_interval_ms (int): How often the progress queue is drained.
+        """
+        self.root = root
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.poll_interval_ms = poll_interval_ms
+        self._thread = None
+        self._progress = None
+        self._queue = queue.Queue()
+        self._result = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, job):
+        """
+        Starts a job on a worker thread.
+
+        Args:
+            job: Callable taking the ProgressReporter of the run, e.g. lambda progress: Dakar(settings, progress).plot_FM_summary().
+        """
+        if self.is_running():
+            raise RuntimeError("A job is already running.")
+        self._queue = queue.Queue()
+        self._progress = ProgressReporter(self._queue)
+        self._result = None
+        self._thread = threading.Thread(target=self._run, args=(job, self._progress), daemon=True)
+        self._thread.start()
+        self.root.after(self.poll_interval_ms, self._poll)
+
+    def cancel(self):
+        """Requests cooperative cancellation; the job stops at its next check between work units."""
+        if self._progress is not None:
+            self._progress.cancel()
+
+    def _run(self, job, progress):
+        try:
+            job(progress)
+            self._result = ("finished", None)
+        except JobCancelled as e:
+            self._result = ("cancelled", e)
+        except Exception as e:
+            self._result = ("failed", e)
+
+    def _poll(self):
+        latest = None
+        while True:
+            try:
+                latest = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None and self.on_progress:
+            self.on_progress(latest)
+
+        if self.is_running():
+            self.root.after(self.poll_interval_ms, self._poll)
+        elif self.on_done:
+            status, error = self._result if self._result else ("failed", None)
+            self.on_done(status, error)
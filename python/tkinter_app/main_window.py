@@ -5,6 +5,7 @@ from Dakar import Dakar
 from .settings import MasterSettings
 from .settings_service import SettingsService
 from .ui_builder import SettingsUIBuilder
+from .job_runner import JobRunner
 
 class MainWindow(tk.Tk):
     def __init__(self):
@@ -16,7 +17,9 @@ class MainWindow(tk.Tk):
         self.ui_builder = SettingsUIBuilder()
 
         self.settings = self.settings_service.load_from_json("python/tkinter_app/settings.json")
-        self.dakar = Dakar(self.settings)
+        # Created by the first run, so the window opens without loading the analysis libraries
+        self.dakar = None
+        self._running_function_name = None
 
         self.canvas = tk.Canvas(self)
         self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
@@ -55,10 +58,16 @@ class MainWindow(tk.Tk):
         
         functions = [
             "combine_csv",
+            "preflight_dataset_stats",
             "crop_FM_classify_top_bottom_from_excel",
+            "detect_background_fm",
             "crop_FM_check_background_fm",
             "plot_compare_FM_summary",
-            "plot_FM_summary"
+            "plot_FM_summary",
+            "track_FM_across_states",
+            "build_foil_pyramids",
+            "expand_crop_archives",
+            "export_excel"
         ]
         
         radio_button_frame = tk.Frame(self.functions_frame)
@@ -68,9 +77,40 @@ class MainWindow(tk.Tk):
             rb = ttk.Radiobutton(radio_button_frame, text=func, value=func, variable=self.selected_function)
             rb.pack(anchor=tk.W)
 
+        # Pipeline queue: functions added here run in order as one job sharing one Dakar
+        queue_frame = tk.Frame(self.functions_frame)
+        queue_frame.pack(side=tk.LEFT, anchor=tk.NW, padx=10)
+        tk.Label(queue_frame, text="Pipeline queue:").pack(side=tk.TOP, anchor=tk.W)
+        self.pipeline_listbox = tk.Listbox(queue_frame, height=len(functions), width=40)
+        self.pipeline_listbox.pack(side=tk.TOP, fill=tk.X)
+        queue_buttons = tk.Frame(queue_frame)
+        queue_buttons.pack(side=tk.TOP, anchor=tk.W)
+        tk.Button(queue_buttons, text="Add", command=self.add_to_pipeline).pack(side=tk.LEFT)
+        tk.Button(queue_buttons, text="Remove", command=self.remove_from_pipeline).pack(side=tk.LEFT)
+        tk.Button(queue_buttons, text="Clear", command=lambda: self.pipeline_listbox.delete(0, tk.END)).pack(side=tk.LEFT)
+
+        self.run_queue_button = tk.Button(self.functions_frame, text="Run Queue", command=self.run_pipeline_queue)
+        self.run_queue_button.pack(side=tk.RIGHT, padx=5, pady=5, anchor=tk.SE)
+
         self.run_button = tk.Button(self.functions_frame, text="Run Function", command=self.run_dakar_function)
         self.run_button.pack(side=tk.RIGHT, padx=5, pady=5, anchor=tk.SE)
 
+        self.cancel_button = tk.Button(self.functions_frame, text="Cancel", command=self.cancel_dakar_function, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5, pady=5, anchor=tk.SE)
+
+        self.browse_button = tk.Button(self.functions_frame, text="Browse FMs", command=self.open_fm_browser)
+        self.browse_button.pack(side=tk.RIGHT, padx=5, pady=5, anchor=tk.SE)
+
+        # Progress of the running function, fed by the job runner's polling
+        progress_frame = tk.Frame(self.functions_frame)
+        progress_frame.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10, anchor=tk.S)
+        self.progress_bar = ttk.Progressbar(progress_frame, orient="horizontal", mode="determinate")
+        self.progress_bar.pack(side=tk.TOP, fill=tk.X, pady=(0, 2))
+        self.progress_label = tk.Label(progress_frame, text="Idle", anchor=tk.W)
+        self.progress_label.pack(side=tk.TOP, fill=tk.X)
+
+        self.job_runner = JobRunner(self, on_progress=self._on_job_progress, on_done=self._on_job_done)
+
     def _convert_state_fields_to_dropdowns(self):
         """Replace existing before/after state fields with dropdowns using the same geometry manager."""
         for key in ["MasterSettings.Dakar.before_state", "MasterSettings.Dakar.after_state"]:
@@ -130,31 +170,128 @@ class MainWindow(tk.Tk):
         if not selected_function_name:
             print("No function selected.")
             return
+        self._start_pipeline([selected_function_name])
+
+    def add_to_pipeline(self):
+        selected_function_name = self.selected_function.get()
+        if not selected_function_name:
+            print("No function selected.")
+            return
+        self.pipeline_listbox.insert(tk.END, selected_function_name)
+
+    def remove_from_pipeline(self):
+        for index in reversed(self.pipeline_listbox.curselection()):
+            self.pipeline_listbox.delete(index)
+
+    def run_pipeline_queue(self):
+        stages = list(self.pipeline_listbox.get(0, tk.END))
+        if not stages:
+            print("The pipeline queue is empty.")
+            return
+        self._start_pipeline(stages)
 
-        # Save current settings from UI before running the function
+    def _start_pipeline(self, stages):
+        """Runs one or more Dakar functions in order as a single background job."""
+        if self.job_runner.is_running():
+            print("A function is already running.")
+            return
+
+        for stage in stages:
+            if not hasattr(Dakar, stage):
+                print(f"Function {stage} not found in Dakar class.")
+                return
+
+        if "plot_compare_FM_summary" in stages:
+            before_state = self.widget_map["MasterSettings.Dakar.before_state"].get()
+            after_state = self.widget_map["MasterSettings.Dakar.after_state"].get()
+            if not before_state or not after_state:
+                print("Please select both before and after states.")
+                return
+
+        # Save current settings from UI before running, the stages use settings directly
         self.save_settings()
         self.settings = self.settings_service.load_from_json("python/tkinter_app/settings.json")
-        self.dakar = Dakar(self.settings)
-
-        if hasattr(self.dakar, selected_function_name):
-            method_to_call = getattr(self.dakar, selected_function_name)
-            print(f"Running {selected_function_name}...")
-            try:
-                if selected_function_name == "plot_compare_FM_summary":
-                    before_state = self.widget_map["MasterSettings.Dakar.before_state"].get()
-                    after_state = self.widget_map["MasterSettings.Dakar.after_state"].get()
-                    if not before_state or not after_state:
-                        print("Please select both before and after states.")
-                        return
-                    # Call without passing arguments since method uses settings directly
-                    method_to_call()
-                else:
-                    method_to_call()
-                print(f"Successfully finished running {selected_function_name}.")
-            except Exception as e:
-                print(f"An error occurred while running {selected_function_name}: {e}")
+        settings = self.settings
+        # Crops are resized on the worker thread, which must not create its own Tk root
+        target_width = int(self.winfo_screenwidth() * 0.5)
+
+        def job(progress):
+            # Runs on the worker thread, so OpenCV and friends load without freezing the window.
+            # Plots are rendered here too: force a non-GUI backend, since with the Tk mainloop
+            # running matplotlib would pick TkAgg and create Tk figure managers off the main thread.
+            import matplotlib
+            matplotlib.use("Agg")
+            from ImageProcesser import ImageProcesser
+            ImageProcesser.default_target_width = target_width
+            # One Dakar is shared by all stages
+            self.dakar = Dakar(settings, progress)
+            self.dakar.run_pipeline(stages)
+
+        name = " -> ".join(stages)
+        print(f"Running {name}...")
+        self._running_function_name = name
+        self.run_button.config(state=tk.DISABLED)
+        self.run_queue_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress_bar.config(value=0, maximum=1)
+        self.progress_label.config(text=f"Starting {name}...")
+        self.job_runner.start(job)
+
+    def cancel_dakar_function(self):
+        if self.job_runner.is_running():
+            print("Cancelling after the current work unit...")
+            self.progress_label.config(text="Cancelling after the current work unit...")
+            self.job_runner.cancel()
+
+    def _on_job_progress(self, snapshot):
+        total = max(snapshot["total"], 1)
+        self.progress_bar.config(maximum=total, value=snapshot["done"])
+        eta = snapshot["eta"]
+        eta_text = f"{int(eta // 60)}m {int(eta % 60):02d}s" if eta is not None else "--"
+        self.progress_label.config(
+            text=f"{snapshot['phase']}: {snapshot['done']} / {snapshot['total']} "
+                 f"({snapshot['rate']:.2f}/s, ETA {eta_text})"
+        )
+
+    def _on_job_done(self, status, error):
+        name = self._running_function_name
+        if status == "finished":
+            print(f"Successfully finished running {name}.")
+            self.progress_label.config(text=f"Finished {name}")
+            if self.dakar is not None and self.dakar.preflight_report is not None:
+                self._show_preflight_panel(self.dakar.preflight_report)
+        elif status == "cancelled":
+            print(f"{name} was cancelled: {error}")
+            self.progress_label.config(text=f"Cancelled {name}")
         else:
-            print(f"Function {selected_function_name} not found in Dakar class.")
+            print(f"An error occurred while running {name}: {error}")
+            self.progress_label.config(text=f"Failed {name}: {error}")
+        self.run_button.config(state=tk.NORMAL)
+        self.run_queue_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def _show_preflight_panel(self, report):
+        """Shows the pre-flight summary and the FOVs missing images in a separate window."""
+        panel = tk.Toplevel(self)
+        panel.title("Pre-flight dataset statistics")
+        panel.geometry("900x400")
+        text = tk.Text(panel, wrap=tk.NONE)
+        scrollbar = ttk.Scrollbar(panel, orient="vertical", command=text.yview)
+        text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        text.insert(tk.END, report["text"] + "\n")
+        missing = report["missing"]
+        if len(missing):
+            text.insert(tk.END, f"\n{len(missing)} FOVs with missing images:\n")
+            text.insert(tk.END, missing.to_string(index=False) + "\n")
+        text.config(state=tk.DISABLED)
+
+    def open_fm_browser(self):
+        """Opens the FM browser on the analysis of the current settings."""
+        from .fm_browser import FMBrowser
+        FMBrowser(self, self.settings_service.build_dataclass_from_ui(self.widget_map, self.settings))
 
     def _connect_dependent_widgets(self):
         data_path_widget = self.widget_map.get("MasterSettings.Dakar.data")
@@ -169,7 +306,7 @@ class MainWindow(tk.Tk):
             data_path_widget.command = lambda path: foils_selector.set_data_path(path, {})
 
     def save_settings(self):
-        updated_settings = self.settings_service.build_dataclass_from_ui(self.widget_map)
+        updated_settings = self.settings_service.build_dataclass_from_ui(self.widget_map, self.settings)
         self.settings_service.save_to_json(updated_settings)
         print("Settings saved successfully.")
 
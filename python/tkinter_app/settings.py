@@ -1,4 +1,5 @@
-from dataclasses import dataclass, field
+import json
+from dataclasses import dataclass, field, fields, is_dataclass
 from typing import Dict, Any,List
 
 
@@ -35,6 +36,11 @@ class DakarSettings:
         }
     )
 
+    workers: int = field(
+        default=1,
+        metadata={"tooltip": "Number of FOVs cropped in parallel. Each worker holds one decoded white/red image pair in memory", "label": "Workers", "layout_group": "row2"}
+    )
+
     min_fm_size: int = field(
         default=100,
         metadata={"tooltip": "Minimum FM size to filter", "label": "Min FM Size", "layout_group": "row1"}
@@ -83,6 +89,190 @@ class DakarSettings:
         }
     )
 
+    persist_spatial_index: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "Save the KD-tree index of each state/foil next to the analysis so later comparisons start warm",
+            "visible_in_ui": False
+        }
+    )
+
+    instrumentation: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "Time the hot spots of every run and save a report (p50/p95, bytes decoded/written) to the Instrumentation folder",
+            "visible_in_ui": False
+        }
+    )
+
+    shard_index: int = field(
+        default=0,
+        metadata={
+            "tooltip": "Shard cropped by this node when shard_count is above 1, from 0 to shard_count - 1",
+            "visible_in_ui": False
+        }
+    )
+
+    shard_count: int = field(
+        default=1,
+        metadata={
+            "tooltip": "Number of nodes the crop FOVs are split across; merge the shard journals with merge_shard_journals",
+            "visible_in_ui": False
+        }
+    )
+
+    shard_run_id: str = field(
+        default="",
+        metadata={
+            "tooltip": "Name of a sharded run, the same on every node; merge_shard_journals only merges the journals of this run, or of the newest run when empty",
+            "visible_in_ui": False
+        }
+    )
+
+    log_level: str = field(
+        default="INFO",
+        metadata={
+            "tooltip": "Level of the pipeline log: DEBUG, INFO, WARNING or ERROR",
+            "visible_in_ui": False
+        }
+    )
+
+    log_module_levels: Dict[str, str] = field(
+        default_factory=dict,
+        metadata={
+            "tooltip": "Per-module log levels overriding log_level, e.g. {\"ImageProcesser\": \"DEBUG\"}",
+            "visible_in_ui": False
+        }
+    )
+
+    log_json_path: str = field(
+        default="",
+        metadata={
+            "tooltip": "Also append the pipeline log as JSON lines to this file; relative paths are placed in the analysis folder",
+            "visible_in_ui": False
+        }
+    )
+
+    decode_mb_per_second: float = field(
+        default=150.0,
+        metadata={
+            "tooltip": "Decoded megabytes per second of one worker, used by the pre-flight stats to project crop runtimes",
+            "visible_in_ui": False
+        }
+    )
+
+    crop_output: str = field(
+        default="files",
+        metadata={
+            "tooltip": "'files' saves one image per FM; 'archive' packs the crops of a stage into one uncompressed zip keyed by ROW ID, expand it with expand_crop_archives",
+            "visible_in_ui": False
+        }
+    )
+
+    crop_archive_format: str = field(
+        default=".png",
+        metadata={
+            "tooltip": "Encoding of the crops in the archive: .png, .jpg or .webp",
+            "visible_in_ui": False
+        }
+    )
+
+    contact_sheet: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "Also tile the white/red crops into contact sheet pages with a ROW ID index, for rapid review",
+            "visible_in_ui": False
+        }
+    )
+
+    contact_sheet_grid: List[int] = field(
+        default_factory=lambda: [10, 10],
+        metadata={
+            "tooltip": "Thumbnails per contact sheet page as [rows, columns]",
+            "visible_in_ui": False
+        }
+    )
+
+    contact_sheet_cell_width: int = field(
+        default=256,
+        metadata={
+            "tooltip": "Width in pixels of a contact sheet thumbnail; the height is half of it",
+            "visible_in_ui": False
+        }
+    )
+
+    pyramid_reduction: int = field(
+        default=4,
+        metadata={
+            "tooltip": "build_foil_pyramids stitches the foils at 1/N of the full resolution: 1, 2, 4 or 8",
+            "visible_in_ui": False
+        }
+    )
+
+    pyramid_tile_size: int = field(
+        default=256,
+        metadata={
+            "tooltip": "Tile edge in pixels of the foil pyramids",
+            "visible_in_ui": False
+        }
+    )
+
+    background_tolerance: float = field(
+        default=0.005,
+        metadata={
+            "tooltip": "detect_background_fm counts FMs of other foils within this X/Y PERCENTAGE distance as the same spot",
+            "visible_in_ui": False
+        }
+    )
+
+    background_crop_ambiguous_only: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "crop_FM_check_background_fm skips FMs that detect_background_fm found on none or all of the other foils",
+            "visible_in_ui": False
+        }
+    )
+
+    fm_features: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "crop_FM_classify_top_bottom_from_excel also measures the white/red intensity, contrast and spot area of every FM",
+            "visible_in_ui": False
+        }
+    )
+
+    compare_stats_only: bool = field(
+        default=False,
+        metadata={
+            "tooltip": "plot_compare_FM_summary only saves the FM change table, without rendering the summary images",
+            "visible_in_ui": False
+        }
+    )
+
+    export_columns: List[str] = field(
+        default_factory=list,
+        metadata={
+            "tooltip": "Columns written by export_excel, in order; empty exports every column",
+            "visible_in_ui": False
+        }
+    )
+
+    export_max_rows_per_sheet: int = field(
+        default=0,
+        metadata={
+            "tooltip": "Split the export_excel rows over sheets of at most this many rows; 0 fills each sheet up to Excel's limits",
+            "visible_in_ui": False
+        }
+    )
+
+    state_sequence: List[str] = field(
+        default_factory=list,
+        metadata={
+            "tooltip": "Ordered list of states used to track FMs, e.g. BeforeCutState -> AfterCutState",
+            "visible_in_ui": False
+        }
+    )
+
 
 
 
@@ -121,6 +311,16 @@ class PlotterSettings:
         },
         metadata={"tooltip": "Point settings (e.g., marker size, colors)", "label": "Points"}
     )
+    density: Dict[str, Any] = field(
+        default_factory=lambda: {
+            "mode": "auto",
+            "threshold": 5000,
+            "bins": [200, 140],
+            "max_alpha": 0.85
+        },
+        metadata={"tooltip": "Heatmap instead of points: mode 'auto' (above 'threshold' points), 'points' or 'density'; "
+                             "'bins' is [x, y]", "label": "Density"}
+    )
     shape_mapping: Dict[str, Any] = field(
         default_factory=lambda: {
             "triangle": {"label": "100-200", "marker": "^", "min_size": 100, "max_size": 200},
@@ -154,4 +354,36 @@ class MasterSettings:
     plotter: PlotterSettings = field(
         default_factory=PlotterSettings,
         metadata={"visible_in_ui": False}
-    )
\ No newline at end of file
+    )
+
+
+def settings_from_dict(cls, data_dict):
+    """Builds a settings dataclass from a dict, ignoring unknown keys and recursing into nested dataclasses."""
+    field_names = {f.name for f in fields(cls)}
+    filtered_data = {k: v for k, v in data_dict.items() if k in field_names}
+
+    for f in fields(cls):
+        if is_dataclass(f.type) and f.name in filtered_data:
+            filtered_data[f.name] = settings_from_dict(f.type, filtered_data[f.name])
+
+    return cls(**filtered_data)
+
+
+def load_settings(file_path: str) -> MasterSettings:
+    """
+    Loads settings from a JSON file and returns a new MasterSettings instance.
+    Falls back to the default settings if the file is missing or invalid.
+    Does not import tkinter, so it can be used by headless runs.
+    """
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        print(f"Successfully loaded settings from {file_path}")
+    except FileNotFoundError:
+        print("settings file not found, use default settings")
+        return MasterSettings()
+    except json.JSONDecodeError:
+        print(f"Error decoding JSON from {file_path}, using default settings instead.")
+        return MasterSettings()
+
+    return settings_from_dict(MasterSettings, data)
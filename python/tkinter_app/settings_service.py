@@ -1,3 +1,4 @@
+import copy
 import json
 from dataclasses import fields, is_dataclass, asdict
 from typing import Any, Dict, List
@@ -5,7 +6,7 @@ import os
 import tkinter as tk
 from tkinter import ttk
 
-from .settings import MasterSettings
+from .settings import MasterSettings, load_settings
 from .custom_widgets import PathSelectorWidget, FoilsSelectorWidget
 
 class SettingsService:
@@ -13,28 +14,7 @@ class SettingsService:
 
     def load_from_json(self, file_path: str) -> MasterSettings:
         """Loads settings from a JSON file and returns a new MasterSettings instance."""
-        try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            print(f"Successfully loaded settings from {file_path}")
-        except FileNotFoundError:
-            print("settings file not found, use default settings")
-            return MasterSettings()
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from {file_path}, using default settings instead.")
-            return MasterSettings()
-        
-        def create_from_dict(cls, data_dict):
-            field_names = {f.name for f in fields(cls)}
-            filtered_data = {k: v for k, v in data_dict.items() if k in field_names}
-            
-            for f in fields(cls):
-                if is_dataclass(f.type) and f.name in filtered_data:
-                    filtered_data[f.name] = create_from_dict(f.type, filtered_data[f.name])
-            
-            return cls(**filtered_data)
-
-        return create_from_dict(MasterSettings, data)
+        return load_settings(file_path)
 
     def save_to_json(self, settings: MasterSettings):
         """Saves a MasterSettings instance to a JSON file."""
@@ -58,8 +38,12 @@ class SettingsService:
                 return None
         return current_type
 
-    def build_dataclass_from_ui(self, widget_map: Dict[str, tk.Widget]) -> MasterSettings:
-        """Reconstructs the MasterSettings object from the current UI values."""
+    def build_dataclass_from_ui(self, widget_map: Dict[str, tk.Widget], base: MasterSettings = None) -> MasterSettings:
+        """
+        Reconstructs the MasterSettings object from the current UI values. Fields without a
+        widget, such as those hidden from the UI, keep their value in base (the loaded
+        settings) rather than falling back to the defaults.
+        """
         new_data = {}
         for key, widget in widget_map.items():
             path = key.split('.')[1:]
@@ -72,17 +56,19 @@ class SettingsService:
                 else:
                     current_level = current_level.setdefault(part, {})
         
-        def dict_to_dataclass(cls, data):
+        def dict_to_dataclass(cls, data, base):
             field_values = {}
             for f in fields(cls):
-                if f.name in data:
-                    if is_dataclass(f.type):
-                        field_values[f.name] = dict_to_dataclass(f.type, data[f.name])
-                    else:
-                        field_values[f.name] = data[f.name]
+                if is_dataclass(f.type):
+                    field_values[f.name] = dict_to_dataclass(
+                        f.type, data.get(f.name, {}), getattr(base, f.name) if base is not None else None)
+                elif f.name in data:
+                    field_values[f.name] = data[f.name]
+                elif base is not None:
+                    field_values[f.name] = copy.deepcopy(getattr(base, f.name))
             return cls(**field_values)
-        
-        return dict_to_dataclass(MasterSettings, new_data)
+
+        return dict_to_dataclass(MasterSettings, new_data, base)
 
     def _get_value_from_widget(self, widget: tk.Widget, field_type: Any) -> Any:
         """Retrieves the value from a widget, converting it to the correct type."""